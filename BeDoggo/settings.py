@@ -46,7 +46,7 @@ INSTALLED_APPS = [
 # Configuración de Django REST Framework
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'api.authentication.CachedJWTAuthentication',  # JWTAuthentication con caché de usuarios
         'rest_framework.authentication.SessionAuthentication',
     ],
 
@@ -54,6 +54,16 @@ REST_FRAMEWORK = {
     # 'rest_framework.permissions.IsAuthenticated',
     # 'rest_framework.permissions.IsAdminUser',
     # ],
+    # JSON con orjson si está instalado (api/renderers.py); sin él, el JSON estándar de DRF
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'api.parsers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 10,  # Número de elementos por página
@@ -86,8 +96,76 @@ SIMPLE_JWT = {
     'BLACKLIST_AFTER_ROTATION': True,
     # 'SIGNING_KEY': SECRET_KEY,  # Usa la clave secreta del proyecto
     'AUTH_HEADER_TYPES': ('Bearer',),
+    # Rotación con lista negra propia por JTI (beDoggo.revoked_tokens) en lugar de la app token_blacklist
+    'TOKEN_REFRESH_SERIALIZER': 'api.serializers.RevocableTokenRefreshSerializer',
 }
 
+# Lista negra de refresh tokens: filtro de Bloom en memoria sincronizado con RevokedToken
+REVOKED_TOKENS_FILTER_ERROR_RATE = config('REVOKED_TOKENS_FILTER_ERROR_RATE', default=0.01, cast=float)
+REVOKED_TOKENS_FILTER_MIN_CAPACITY = config('REVOKED_TOKENS_FILTER_MIN_CAPACITY', default=100_000, cast=int)
+REVOKED_TOKENS_POLL_INTERVAL = config('REVOKED_TOKENS_POLL_INTERVAL', default=2, cast=float)  # Segundos
+REVOKED_TOKENS_RELOAD_INTERVAL = config('REVOKED_TOKENS_RELOAD_INTERVAL', default=3600, cast=float)  # Segundos
+
+# Caché en proceso de los usuarios autenticados por JWT (api.authentication)
+JWT_USER_CACHE_TTL = config('JWT_USER_CACHE_TTL', default=60, cast=int)  # Segundos
+JWT_USER_CACHE_MAX_SIZE = config('JWT_USER_CACHE_MAX_SIZE', default=10000, cast=int)
+
+# Ingesta de localizaciones de los dispositivos GPS
+LOCATION_BATCH_MAX_SIZE = config('LOCATION_BATCH_MAX_SIZE', default=500, cast=int)  # Fixes por petición de lote
+LOCATION_BULK_INSERT_BATCH_SIZE = config('LOCATION_BULK_INSERT_BATCH_SIZE', default=1000, cast=int)
+DEVICE_CREDENTIALS_CACHE_TTL = config('DEVICE_CREDENTIALS_CACHE_TTL', default=60, cast=int)  # Segundos
+# 'sync': cada petición escribe sus fixes; 'buffered': se encolan y un hilo los escribe en bloques
+LOCATION_INGEST_MODE = config('LOCATION_INGEST_MODE', default='sync')
+LOCATION_BUFFER_MAX_SIZE = config('LOCATION_BUFFER_MAX_SIZE', default=20000, cast=int)  # Por encima se responde 503
+LOCATION_BUFFER_FLUSH_SIZE = config('LOCATION_BUFFER_FLUSH_SIZE', default=1000, cast=int)
+LOCATION_BUFFER_FLUSH_INTERVAL = config('LOCATION_BUFFER_FLUSH_INTERVAL', default=1.0, cast=float)  # Segundos
+# Spool en disco para los fixes cuando la base de datos está caída o lenta (ver drain_location_spool)
+LOCATION_SPOOL_ENABLED = config('LOCATION_SPOOL_ENABLED', default=False, cast=bool)
+LOCATION_SPOOL_DIR = config('LOCATION_SPOOL_DIR', default=str(BASE_DIR / 'spool'))
+LOCATION_SPOOL_SEGMENT_MAX_BYTES = config('LOCATION_SPOOL_SEGMENT_MAX_BYTES', default=16 * 1024 * 1024, cast=int)
+LOCATION_SPOOL_SEGMENT_MAX_AGE = config('LOCATION_SPOOL_SEGMENT_MAX_AGE', default=60, cast=int)  # Segundos
+LOCATION_SPOOL_FSYNC_INTERVAL = config('LOCATION_SPOOL_FSYNC_INTERVAL', default=0.2, cast=float)  # Segundos
+LOCATION_SPOOL_FSYNC_BATCH = config('LOCATION_SPOOL_FSYNC_BATCH', default=500, cast=int)  # Fixes
+LOCATION_WRITE_TIMEOUT_MS = config('LOCATION_WRITE_TIMEOUT_MS', default=2000, cast=int)
+LOCATION_DATABASE_RETRY_INTERVAL = config('LOCATION_DATABASE_RETRY_INTERVAL', default=5, cast=int)  # Segundos
+# Meses de histórico de Location que conserva manage_location_partitions (0 = sin límite)
+LOCATION_RETENTION_MONTHS = config('LOCATION_RETENTION_MONTHS', default=0, cast=int)
+# Paginación por cursor del histórico de localizaciones (page_size admite hasta LOCATION_MAX_PAGE_SIZE)
+LOCATION_PAGE_SIZE = config('LOCATION_PAGE_SIZE', default=100, cast=int)
+LOCATION_MAX_PAGE_SIZE = config('LOCATION_MAX_PAGE_SIZE', default=10000, cast=int)
+# Exportación de trayectos: filas leídas por vuelta del cursor de servidor y compresión gzip al vuelo
+LOCATION_EXPORT_CHUNK_SIZE = config('LOCATION_EXPORT_CHUNK_SIZE', default=5000, cast=int)
+LOCATION_EXPORT_GZIP = config('LOCATION_EXPORT_GZIP', default=True, cast=bool)
+# Trayectos reducidos (?simplify=/?max_points=): caché por intervalo, versionada con sus fixes en la base de datos
+LOCATION_TRACK_CACHE_TIMEOUT = config('LOCATION_TRACK_CACHE_TIMEOUT', default=3600, cast=int)  # Segundos
+LOCATION_TRACK_MAX_POINTS = config('LOCATION_TRACK_MAX_POINTS', default=5000, cast=int)
+# Días del trayecto en polilínea (?encoding=polyline) cuando no se indica fecha de inicio
+LOCATION_TRACK_MAX_DAYS = config('LOCATION_TRACK_MAX_DAYS', default=30, cast=int)
+# Índice en memoria de mascotas perdidas que atiende las búsquedas por cercanía
+LOST_PETS_INDEX_ENABLED = config('LOST_PETS_INDEX_ENABLED', default=True, cast=bool)
+LOST_PETS_INDEX_CELL_DEGREES = config('LOST_PETS_INDEX_CELL_DEGREES', default=0.05, cast=float)
+LOST_PETS_INDEX_POLL_INTERVAL = config('LOST_PETS_INDEX_POLL_INTERVAL', default=2, cast=float)  # Segundos
+LOST_PETS_INDEX_RELOAD_INTERVAL = config('LOST_PETS_INDEX_RELOAD_INTERVAL', default=300, cast=float)  # Segundos
+# Caché de las búsquedas de mascotas perdidas (coordenadas ajustadas a celdas, invalidación por regiones)
+LOST_PETS_CACHE_ENABLED = config('LOST_PETS_CACHE_ENABLED', default=True, cast=bool)
+LOST_PETS_CACHE_CELL_DEGREES = config('LOST_PETS_CACHE_CELL_DEGREES', default=0.005, cast=float)
+LOST_PETS_CACHE_DISTANCE_STEP = config('LOST_PETS_CACHE_DISTANCE_STEP', default=0.5, cast=float)  # Km
+LOST_PETS_CACHE_REGION_DEGREES = config('LOST_PETS_CACHE_REGION_DEGREES', default=0.25, cast=float)
+LOST_PETS_CACHE_MAX_REGIONS = config('LOST_PETS_CACHE_MAX_REGIONS', default=16, cast=int)
+LOST_PETS_CACHE_TIMEOUT = config('LOST_PETS_CACHE_TIMEOUT', default=300, cast=int)  # Segundos
+# Teselas vectoriales de mascotas perdidas (caché en memoria y en disco, versionada por regiones)
+LOST_PETS_TILE_DIR = config('LOST_PETS_TILE_DIR', default=str(BASE_DIR / 'tiles'))
+LOST_PETS_TILE_MEMORY_ENTRIES = config('LOST_PETS_TILE_MEMORY_ENTRIES', default=2048, cast=int)
+LOST_PETS_TILE_TIMEOUT = config('LOST_PETS_TILE_TIMEOUT', default=3600, cast=int)  # Segundos
+LOST_PETS_TILE_MAX_AGE = config('LOST_PETS_TILE_MAX_AGE', default=60, cast=int)  # Cache-Control (segundos)
+LOST_PETS_TILE_MAX_ZOOM = config('LOST_PETS_TILE_MAX_ZOOM', default=22, cast=int)
+# Grupos por zoom de las búsquedas de mascotas perdidas: celdas por ancho de tesela
+LOST_PETS_CLUSTER_CELLS_PER_TILE = config('LOST_PETS_CLUSTER_CELLS_PER_TILE', default=4, cast=int)
+# Lado máximo (en celdas) del área de una respuesta de grupos; sin bbox solo se admiten los zooms en que cabe el mundo
+LOST_PETS_CLUSTER_MAX_CELLS = config('LOST_PETS_CLUSTER_MAX_CELLS', default=128, cast=int)
+# Máximo de mascotas por respuesta en la consulta por área visible (bbox)
+LOST_PETS_BBOX_MAX_RESULTS = config('LOST_PETS_BBOX_MAX_RESULTS', default=500, cast=int)
+
 """ 
 se debe incluir lo siguiente para acceder a recursos que requieren IsAuthenticated
 Authorization: Bearer <access_token>
@@ -203,3 +281,9 @@ MEDIA_ROOT = BASE_DIR / 'media'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 GOOGLE_CLIENT_ID = config('GOOGLE_CLIENT_ID')
+# Certificados con los que se verifican los ID tokens de Google (api.google_auth)
+GOOGLE_CERTS_URL = config('GOOGLE_CERTS_URL', default='https://www.googleapis.com/oauth2/v1/certs')
+GOOGLE_CERTS_DEFAULT_MAX_AGE = config('GOOGLE_CERTS_DEFAULT_MAX_AGE', default=300, cast=int)  # Sin Cache-Control
+GOOGLE_CERTS_REFRESH_MARGIN = config('GOOGLE_CERTS_REFRESH_MARGIN', default=600, cast=int)  # Segundos antes de caducar
+GOOGLE_CERTS_RETRY_INTERVAL = config('GOOGLE_CERTS_RETRY_INTERVAL', default=30, cast=int)  # Segundos
+GOOGLE_CERTS_TIMEOUT = config('GOOGLE_CERTS_TIMEOUT', default=5, cast=float)  # Segundos
@@ -0,0 +1,140 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.utils import datetime_from_epoch
+
+from beDoggo import metrics
+from beDoggo.revoked_tokens import is_revoked, revoke
+
+
+def user_id_claim(value):
+    """Valor del claim de usuario tal como lo escribe simplejwt (los ids no enteros van como texto)."""
+    return value if isinstance(value, int) else str(value)
+
+
+class AuthenticatedUserCache:
+    """
+    Caché en proceso (LRU con TTL) de los usuarios autenticados por JWT.
+
+    Cada entrada guarda el usuario junto con la versión del token con la que se
+    validó (el claim de revocación por contraseña, si está activo): un token de
+    otra versión no acierta y se valida contra la base de datos. Las señales de
+    ``User`` (``api.signals``) invalidan la entrada al guardar o borrar el
+    usuario; los cambios hechos desde otros procesos se ven como mucho ``ttl``
+    segundos después.
+    """
+
+    def __init__(self, ttl, max_size):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._users = OrderedDict()  # id -> (versión del token, guardado en, usuario)
+        # Invalidaciones de los usuarios con lecturas en curso, para no guardar uno leído antes de un cambio
+        self._generations = {}
+        self._in_flight = {}  # id -> lecturas en curso
+        metrics.register_gauge('jwt_user_cache.size', lambda: len(self._users))
+
+    def get(self, user_id, version):
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is None or entry[0] != version or time.monotonic() - entry[1] > self.ttl:
+                metrics.incr('jwt_user_cache.misses')
+                return None
+            self._users.move_to_end(user_id)
+        metrics.incr('jwt_user_cache.hits')
+        # Copia por petición: las vistas pueden modificar `request.user`
+        return copy.copy(entry[2])
+
+    def generation(self, user_id):
+        """Empieza una lectura de ``user_id`` en la base de datos; hay que cerrarla siempre con ``set()``."""
+        with self._lock:
+            self._in_flight[user_id] = self._in_flight.get(user_id, 0) + 1
+            return self._generations.get(user_id, 0)
+
+    def set(self, user_id, version, user, generation):
+        """
+        Cierra la lectura y guarda el usuario si no es ``None`` y no se ha invalidado desde
+        ``generation`` (leída antes de consultarlo).
+        """
+        with self._lock:
+            readers = self._in_flight.pop(user_id) - 1
+            if readers:
+                self._in_flight[user_id] = readers
+            stale = self._generations.get(user_id, 0) != generation
+            if not readers:
+                self._generations.pop(user_id, None)
+            if user is None or stale:
+                return
+            self._users[user_id] = (version, time.monotonic(), copy.copy(user))
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_size:
+                self._users.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._users.pop(user_id, None)
+            if user_id in self._in_flight:
+                self._generations[user_id] = self._generations.get(user_id, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+            for user_id in self._in_flight:
+                self._generations[user_id] = self._generations.get(user_id, 0) + 1
+
+
+user_cache = AuthenticatedUserCache(ttl=settings.JWT_USER_CACHE_TTL, max_size=settings.JWT_USER_CACHE_MAX_SIZE)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    ``JWTAuthentication`` sin la consulta del usuario en cada petición.
+
+    Solo se guardan usuarios que han pasado las comprobaciones de simplejwt (activo
+    y, si ``CHECK_REVOKE_TOKEN``, contraseña sin cambiar); desactivar al usuario o
+    cambiarle la contraseña lo invalida.
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = user_id_claim(validated_token[api_settings.USER_ID_CLAIM])
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        version = validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) if api_settings.CHECK_REVOKE_TOKEN else None
+        user = user_cache.get(user_id, version)
+        if user is None:
+            generation = user_cache.generation(user_id)
+            try:
+                user = super().get_user(validated_token)
+            finally:
+                # Si la validación falla `user` sigue a None: solo se cierra la lectura
+                user_cache.set(user_id, version, user, generation)
+        return user
+
+
+class RevocableRefreshToken(RefreshToken):
+    """
+    Refresh token con lista negra por JTI (``beDoggo.revoked_tokens``).
+
+    Con ``BLACKLIST_AFTER_ROTATION`` el serializador de refresco llama a
+    ``blacklist()`` al rotar: si el JTI ya estaba revocado (dos rotaciones del mismo
+    token a la vez) la segunda se rechaza.
+    """
+
+    def verify(self):
+        super().verify()
+        if is_revoked(self.payload[api_settings.JTI_CLAIM]):
+            raise TokenError(_("Token is blacklisted"))
+
+    def blacklist(self):
+        if not revoke(self.payload[api_settings.JTI_CLAIM], datetime_from_epoch(self.payload['exp'])):
+            raise TokenError(_("Token is blacklisted"))
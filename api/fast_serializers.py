@@ -0,0 +1,130 @@
+"""
+Lectura rápida para los listados más usados.
+
+``reader_for`` devuelve un ``FastReader`` compilado una sola vez por serializador y
+conjunto de campos (``?fields=``/``?expand=``): los campos de DRF ya construidos se
+reutilizan entre peticiones, así que no se repite la introspección del modelo de
+``ModelSerializer`` ni se crean ``ReturnDict`` por fila. Cada valor se formatea con el
+``to_representation`` del propio campo, de modo que la salida es idéntica a la del
+serializador.
+
+Si todos los campos son columnas (o coordenadas de un punto), las filas se leen con
+``.values()`` y no se construyen instancias del modelo ni geometrías GEOS.
+
+Solo vale para serializadores cuya representación no depende del ``context``.
+"""
+import threading
+
+from django.contrib.gis.db.models import GeometryField
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import F, FloatField, Func
+from rest_framework import serializers
+from rest_framework.fields import SkipField
+from rest_framework.relations import PKOnlyObject
+
+# Combinaciones de ?fields=/?expand= compiladas como mucho; por encima se vacía la caché
+MAX_READERS = 256
+GEOMETRY_COMPONENTS = {'x': 'ST_X', 'y': 'ST_Y'}
+
+_readers = {}
+_lock = threading.Lock()
+
+
+def reader_for(serializer_class, request=None):
+    """Lector compilado de ``serializer_class`` con los campos que pide ``request``."""
+    template = _compiled(serializer_class, None)
+    fields = template.serializer.fields
+    if request is not None and hasattr(serializer_class, 'select_fields'):
+        names = frozenset(serializer_class.select_fields(fields, request))
+    else:
+        names = frozenset(name for name, field in fields.items() if not field.write_only)
+    return _compiled(serializer_class, names)
+
+
+def _compiled(serializer_class, names):
+    key = (serializer_class, names)
+    reader = _readers.get(key)
+    if reader is None:
+        serializer = serializer_class()
+        if names is not None:
+            for name in [name for name, field in serializer.fields.items() if not field.write_only
+                         and name not in names]:
+                serializer.fields.pop(name)
+        reader = FastReader(serializer)
+        with _lock:
+            if len(_readers) >= MAX_READERS:
+                _readers.clear()
+            _readers[key] = reader
+    return reader
+
+
+class FastReader:
+
+    def __init__(self, serializer):
+        self.serializer = serializer
+        self.accessors = []  # (nombre, campo, representación)
+        for field in serializer._readable_fields:
+            if isinstance(field, serializers.BaseSerializer) and not isinstance(field, serializers.ListSerializer):
+                represent = FastReader(field).to_representation
+            else:
+                represent = field.to_representation
+            self.accessors.append((field.field_name, field, represent))
+        self.columns = self._columns(serializer.Meta.model) if hasattr(serializer, 'Meta') else None
+
+    def _columns(self, model):
+        """``[(nombre, clave en .values(), expresión o None, representación)]`` o ``None`` si hacen falta instancias."""
+        columns = []
+        for name, field, represent in self.accessors:
+            if isinstance(field, (serializers.BaseSerializer, serializers.RelatedField, serializers.ManyRelatedField,
+                                  serializers.SerializerMethodField)) or not field.source_attrs:
+                return None
+            try:
+                model_field = model._meta.get_field(field.source_attrs[0])
+            except FieldDoesNotExist:
+                return None
+            if model_field.is_relation:
+                return None
+            if len(field.source_attrs) == 1:
+                columns.append((name, model_field.name, None, represent))
+            elif (len(field.source_attrs) == 2 and isinstance(model_field, GeometryField)
+                  and field.source_attrs[1] in GEOMETRY_COMPONENTS):
+                expression = Func(F(model_field.name), function=GEOMETRY_COMPONENTS[field.source_attrs[1]],
+                                  output_field=FloatField())
+                columns.append((name, f'fast_{name}', expression, represent))
+            else:
+                return None
+        return columns
+
+    def optimize_queryset(self, queryset, *always):
+        return self.serializer.optimize_queryset(queryset, *always)
+
+    def read_queryset(self, queryset, *always):
+        """
+        Queryset listo para ``many()``: filas de ``.values()`` si basta con columnas o
+        el queryset ajustado a los campos en otro caso. ``always`` son columnas que
+        necesita la vista (p. ej. el orden del cursor de paginación).
+        """
+        if self.columns is None:
+            return self.optimize_queryset(queryset, *always)
+        plain = {key for _, key, expression, _ in self.columns if expression is None} | set(always)
+        annotations = {key: expression for _, key, expression, _ in self.columns if expression is not None}
+        return queryset.values(*sorted(plain), **annotations)
+
+    def to_representation(self, instance):
+        if isinstance(instance, dict):
+            return {name: None if instance[key] is None else represent(instance[key])
+                    for name, key, _, represent in self.columns}
+
+        row = {}
+        for name, field, represent in self.accessors:
+            try:
+                attribute = field.get_attribute(instance)
+            except SkipField:
+                continue
+            check_for_none = attribute.pk if isinstance(attribute, PKOnlyObject) else attribute
+            row[name] = None if check_for_none is None else represent(attribute)
+        return row
+
+    def many(self, instances):
+        to_representation = self.to_representation
+        return [to_representation(instance) for instance in instances]
@@ -0,0 +1,137 @@
+"""
+Verificación de los ID tokens de Google con los certificados en memoria.
+
+``google.oauth2.id_token.verify_oauth2_token`` descarga los certificados de
+Google en cada llamada. ``GoogleTokenVerifier`` los guarda durante el ``max-age``
+de su ``Cache-Control``, los renueva en segundo plano antes de que caduquen y
+reutiliza una ``requests.Session`` (pool de conexiones), así que el login solo
+verifica la firma RSA en local. Un ``kid`` desconocido (rotación de claves)
+fuerza una descarga, como mucho una cada ``retry_interval`` segundos. Si Google
+no responde se siguen usando los certificados anteriores: Google publica cada
+clave antes de firmar con ella y la mantiene días después de retirarla.
+Solo se aceptan tokens emitidos para ``audience`` (nuestro client ID de OAuth):
+la firma de Google es válida también en los tokens de cualquier otra app.
+"""
+import logging
+import re
+import threading
+import time
+
+import jwt
+import requests
+from django.conf import settings
+from google.auth import exceptions as google_exceptions
+from google.auth import jwt as google_jwt
+
+from beDoggo import metrics
+
+logger = logging.getLogger(__name__)
+
+GOOGLE_ISSUERS = ('accounts.google.com', 'https://accounts.google.com')
+MAX_AGE_PATTERN = re.compile(r'max-age=(\d+)')
+
+
+def _max_age(response, default):
+    """Segundos que la respuesta sigue fresca según ``Cache-Control`` y ``Age``."""
+    match = MAX_AGE_PATTERN.search(response.headers.get('Cache-Control', ''))
+    if match is None:
+        return default
+    try:
+        age = int(response.headers.get('Age', 0))
+    except ValueError:
+        age = 0
+    return max(int(match.group(1)) - age, 0)
+
+
+class GoogleTokenVerifier:
+
+    def __init__(self, certs_url, audience, default_max_age, refresh_margin, retry_interval, timeout):
+        self.certs_url = certs_url
+        self.audience = audience
+        self.default_max_age = default_max_age
+        self.refresh_margin = refresh_margin
+        self.retry_interval = retry_interval
+        self.timeout = timeout
+        self.session = requests.Session()
+        self._certs = None  # kid -> certificado o clave pública PEM
+        self._refresh_at = 0
+        self._retry_at = 0
+        self._lock = threading.Lock()
+        self._refresh_thread = None
+
+    def _fetch(self):
+        started = time.monotonic()
+        try:
+            response = self.session.get(self.certs_url, timeout=self.timeout)
+            response.raise_for_status()
+            certs = response.json()
+        except (requests.RequestException, ValueError):
+            metrics.incr('google_certs.fetch_errors')
+            self._retry_at = time.monotonic() + self.retry_interval
+            raise
+        metrics.observe('google_certs.fetch_seconds', time.monotonic() - started)
+        self._certs = certs
+        max_age = _max_age(response, self.default_max_age)
+        # Como mucho a mitad de vida: con un margen mayor que el max-age se renovaría en cada verificación
+        self._refresh_at = started + max_age - min(self.refresh_margin, max_age / 2)
+        self._retry_at = time.monotonic() + self.retry_interval
+        return certs
+
+    def _refresh(self):
+        try:
+            self._fetch()
+        except (requests.RequestException, ValueError):
+            logger.warning("No se han podido renovar los certificados de Google", exc_info=True)
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refresh_thread is not None and self._refresh_thread.is_alive():
+                return
+            self._refresh_thread = threading.Thread(target=self._refresh, name='google-certs-refresh', daemon=True)
+            self._refresh_thread.start()
+
+    def get_certs(self, kid=None):
+        """Certificados vigentes; solo se descargan en línea si no hay ninguno o falta ``kid``."""
+        certs = self._certs
+        if certs is None or kid not in certs:
+            with self._lock:
+                certs = self._certs
+                if certs is None or (kid not in certs and time.monotonic() >= self._retry_at):
+                    try:
+                        certs = self._fetch()
+                    except (requests.RequestException, ValueError):
+                        if certs is None:
+                            raise ValueError("No se han podido obtener los certificados de Google.")
+                        logger.warning("No se han podido descargar los certificados de Google", exc_info=True)
+            return certs
+        if time.monotonic() >= self._refresh_at and time.monotonic() >= self._retry_at:
+            self._refresh_in_background()
+        return certs
+
+    def verify(self, token):
+        """Devuelve los claims del ID token o lanza ``ValueError`` si no es válido."""
+        try:
+            kid = jwt.get_unverified_header(token).get('kid')
+        except jwt.PyJWTError:
+            raise ValueError("Token mal formado.")
+        try:
+            idinfo = google_jwt.decode(token, certs=self.get_certs(kid), audience=self.audience,
+                                       clock_skew_in_seconds=10)
+        except google_exceptions.GoogleAuthError as e:
+            raise ValueError(str(e))
+        if idinfo.get('iss') not in GOOGLE_ISSUERS:
+            raise ValueError(f"Emisor no válido: {idinfo.get('iss')}.")
+        return idinfo
+
+    def close(self):
+        self.session.close()
+
+
+google_verifier = GoogleTokenVerifier(
+    certs_url=settings.GOOGLE_CERTS_URL,
+    audience=settings.GOOGLE_CLIENT_ID,
+    default_max_age=settings.GOOGLE_CERTS_DEFAULT_MAX_AGE,
+    refresh_margin=settings.GOOGLE_CERTS_REFRESH_MARGIN,
+    retry_interval=settings.GOOGLE_CERTS_RETRY_INTERVAL,
+    timeout=settings.GOOGLE_CERTS_TIMEOUT,
+)
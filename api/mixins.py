@@ -0,0 +1,77 @@
+import hashlib
+
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.response import Response
+
+from .fast_serializers import reader_for
+
+
+class FieldsetQuerysetMixin:
+    """
+    Ajusta el queryset de las vistas genéricas a ``?fields=``/``?expand=``.
+
+    El serializador (``DynamicFieldsMixin``) decide qué joins y columnas necesita, de
+    modo que las relaciones que no se devuelven no se consultan. ``fieldset_always``
+    son columnas que la vista usa aunque no se devuelvan (p. ej. el orden del cursor).
+    """
+    fieldset_always = ()
+
+    def get_reader(self):
+        return reader_for(self.get_serializer_class(), self.request)
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        # En escritura se carga el objeto entero para no guardar campos diferidos
+        if self.request.method in SAFE_METHODS:
+            queryset = self.get_reader().optimize_queryset(queryset, *self.fieldset_always)
+        return queryset
+
+
+class FastListMixin(FieldsetQuerysetMixin):
+    """``list()`` de solo lectura con el lector compilado de ``api.fast_serializers``."""
+
+    def list(self, request, *args, **kwargs):
+        reader = self.get_reader()
+        queryset = reader.read_queryset(self.filter_queryset(self.get_queryset()), *self.fieldset_always)
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(reader.many(page))
+        return Response(reader.many(queryset))
+
+
+class ConditionalGetMixin:
+    """
+    ``GET`` condicional (``ETag``/``Last-Modified``).
+
+    ``get_validators()`` devuelve ``(versión, última_modificación)`` con una consulta
+    barata, sin cargar ni serializar los datos; ``(None, None)`` desactiva la validación
+    (p. ej. si el objeto no existe, para que la vista responda 404). Si el cliente ya
+    tiene esa versión se responde 304 sin llegar a ``get``.
+    """
+
+    def get_validators(self):
+        raise NotImplementedError
+
+    def get(self, request, *args, **kwargs):
+        version, last_modified = self.get_validators()
+        if version is None:
+            return super().get(request, *args, **kwargs)
+
+        # La misma versión se representa distinto según el usuario, la URL (página, ?fields=...) y el formato
+        etag = quote_etag(hashlib.md5(
+            f'{version}:{request.user.pk}:{request.get_full_path()}:{request.accepted_media_type}'.encode()
+        ).hexdigest())
+        last_modified = int(last_modified.timestamp()) if last_modified else None
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+        response['ETag'] = etag
+        if last_modified:
+            response['Last-Modified'] = http_date(last_modified)
+        # Datos del usuario: no se guardan en cachés compartidas y el cliente revalida siempre
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
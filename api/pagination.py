@@ -0,0 +1,16 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class LocationCursorPagination(CursorPagination):
+    """
+    Paginación por cursor (keyset) del histórico de localizaciones.
+
+    Cada página filtra por el ``timestamp`` del cursor en lugar de usar ``OFFSET``
+    y no ejecuta ``COUNT(*)``, así que el coste es el mismo en la primera página
+    que en la más profunda (usa el índice ``(gps_device, -timestamp)``).
+    """
+    ordering = ('-timestamp', '-id')
+    page_size = settings.LOCATION_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = settings.LOCATION_MAX_PAGE_SIZE
@@ -0,0 +1,42 @@
+"""
+Renderer JSON de la API con ``orjson`` cuando está instalado.
+
+``orjson`` serializa en C los ``dict``/``list`` de los serializadores y convierte de
+forma nativa ``UUID`` y ``datetime`` (con ``Z`` para UTC, igual que DRF). Lo que no
+sabe convertir pasa por el ``JSONEncoder`` de DRF y, si falla o se pide indentación,
+se usa el ``JSONRenderer`` de DRF, que también es el renderer sin ``orjson``.
+"""
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - dependencia opcional
+    orjson = None
+
+_encoder = JSONEncoder()
+LINE_SEPARATOR = '\u2028'.encode()
+PARAGRAPH_SEPARATOR = '\u2029'.encode()
+
+
+def _default(obj):
+    # Decimal, cadenas perezosas, querysets, geometrías... como los trata DRF
+    return _encoder.default(obj)
+
+
+class FastJSONRenderer(JSONRenderer):
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if orjson is None or self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=_default, option=orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            # Enteros de más de 64 bits o tipos que DRF tampoco conoce: se decide con el renderer de DRF
+            return super().render(data, accepted_media_type, renderer_context)
+        # DRF escapa U+2028/U+2029 para que la respuesta sea JavaScript válido
+        if LINE_SEPARATOR in ret or PARAGRAPH_SEPARATOR in ret:
+            ret = ret.replace(LINE_SEPARATOR, b'\\u2028').replace(PARAGRAPH_SEPARATOR, b'\\u2029')
+        return ret
@@ -1,10 +1,130 @@
+from django.conf import settings
+from django.contrib.gis.geos import Point
+from django.core.exceptions import FieldDoesNotExist
 from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
 from drf_spectacular.utils import extend_schema_field
 from beDoggo.models import User, Pet, AccessCode, Location, MedicalRecord, Veterinarian, GPSDevice, SexUserChoices, \
     SexPetChoices
+from beDoggo.ingest import store_locations
+from .authentication import RevocableRefreshToken
+
+
+def _query_list(request, name):
+    return {item.strip() for item in request.query_params.get(name, '').split(',') if item.strip()}
+
+
+class DynamicFieldsMixin:
+    """
+    Campos a la carta en el serializador raíz de la petición.
+
+    ``?fields=a,b`` devuelve solo esos campos y ``?expand=c`` añade los de
+    ``Meta.expandable_fields``, que no se devuelven por defecto. ``Meta.default_fields``
+    (opcional) fija los campos que se devuelven sin ``?fields``. Los campos de solo
+    escritura no se tocan y los serializadores anidados, que se construyen sin
+    ``context``, devuelven siempre todos sus campos. En ``POST``/``PUT``/``PATCH`` se
+    validan todos los campos y la selección solo recorta la respuesta.
+    """
+    _response_fields = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = kwargs.get('context', {}).get('request')
+        if request is None or not hasattr(request, 'query_params'):
+            return
+        selected = self.select_fields(self.fields, request)
+        if request.method not in SAFE_METHODS:
+            # Quitar campos de lectura y escritura descartaría en silencio los datos recibidos
+            self._response_fields = selected
+            return
+        for name in [name for name, field in self.fields.items() if not field.write_only and name not in selected]:
+            self.fields.pop(name)
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if self._response_fields is not None:
+            for name in [name for name in data if name not in self._response_fields]:
+                del data[name]
+        return data
 
-
-class UserSerializer(serializers.ModelSerializer):
+    @classmethod
+    def select_fields(cls, fields, request):
+        """Nombres de los campos legibles de ``fields`` que se devuelven en esta petición."""
+        requested, expand = _query_list(request, 'fields'), _query_list(request, 'expand')
+        readable = [name for name, field in fields.items() if not field.write_only]
+        expandable = set(getattr(cls.Meta, 'expandable_fields', ()))
+        if requested - set(readable):
+            raise serializers.ValidationError(
+                {"fields": f"Campos desconocidos: {', '.join(sorted(requested - set(readable)))}."})
+        if expand - expandable:
+            raise serializers.ValidationError(
+                {"expand": f"Campos expandibles: {', '.join(sorted(expandable)) or 'ninguno'}."})
+
+        selected = (requested or set(getattr(cls.Meta, 'default_fields', readable)) - expandable) | expand
+        return {name for name in readable if name in selected}
+
+    def optimize_queryset(self, queryset, *always):
+        """
+        Ajusta el queryset a los campos que se van a devolver: ``select_related`` y
+        ``prefetch_related`` para las relaciones serializadas y, si no hay joins, ``only()``
+        con las columnas usadas más ``always`` (p. ej. las del orden de la paginación).
+        """
+        columns, related, prefetch = set(always), set(), set()
+        deferrable = _collect_lookups(self, queryset.model, '', columns, related, prefetch)
+        if related:
+            queryset = queryset.select_related(*sorted(related))
+        if prefetch:
+            queryset = queryset.prefetch_related(*sorted(prefetch))
+        if deferrable and not related:
+            queryset = queryset.only(*sorted(columns))
+        return queryset
+
+
+def _collect_lookups(serializer, model, prefix, columns, related, prefetch):
+    """
+    Recorre los campos legibles y anota columnas, relaciones a unir y relaciones a
+    precargar. Devuelve ``False`` si algún campo puede leer columnas que no se
+    conocen (métodos, propiedades, ``source='*'``), en cuyo caso no se usa ``only()``.
+    """
+    deferrable = True
+    method_prefetch = getattr(getattr(serializer, 'Meta', None), 'method_prefetch', {})
+    for name, field in serializer.fields.items():
+        if field.write_only:
+            continue
+        if not field.source_attrs:
+            # Los métodos declaran en ``Meta.method_prefetch`` las relaciones que recorren
+            prefetch.update(prefix + lookup for lookup in method_prefetch.get(name, ()))
+            deferrable = False
+            continue
+        current, path = model, []
+        for attr in field.source_attrs:
+            try:
+                model_field = current._meta.get_field(attr)
+            except FieldDoesNotExist:
+                deferrable = False
+                break
+            path.append(attr)
+            lookup = prefix + '__'.join(path)
+            if model_field.many_to_many or model_field.one_to_many:
+                prefetch.add(lookup)
+                break
+            if not model_field.is_relation:
+                columns.add(lookup)
+                break
+            if attr == field.source_attrs[-1] and not isinstance(field, serializers.BaseSerializer):
+                # Solo se devuelve la clave del relacionado: basta la columna FK
+                (columns if model_field.concrete else related).add(lookup)
+                break
+            related.add(lookup)
+            current = model_field.related_model
+        else:
+            deferrable &= _collect_lookups(field, current, prefix + '__'.join(path) + '__', columns, related,
+                                           prefetch)
+    return deferrable
+
+
+class UserSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['uuid', 'email', 'username', 'first_name', 'last_name', 'birth_date', 'sex', 'phone',
@@ -12,10 +132,10 @@ class UserSerializer(serializers.ModelSerializer):
                   'next_payment_date', 'accept_newsletter']
 
 
-class GPSDeviceSerializer(serializers.ModelSerializer):
+class GPSDeviceSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = GPSDevice
-        fields = '__all__'
+        exclude = ['ingest_key']  # La credencial de ingesta nunca se expone en la API
         update_fields = ['is_active', 'activated_at']
 
 
@@ -41,13 +161,13 @@ class RegisterUserSerializer(serializers.ModelSerializer):
         return user
 
 
-class VeterinarianSerializer(serializers.ModelSerializer):
+class VeterinarianSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Veterinarian
         fields = '__all__'
 
 
-class PetSerializer(serializers.ModelSerializer):
+class PetSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     owner = UserSerializer(read_only=True)
     veterinarian = VeterinarianSerializer(read_only=True)
     gps_device = GPSDeviceSerializer(read_only=True)
@@ -122,40 +242,62 @@ class OnboardingPetSerializer(serializers.ModelSerializer):
         ]
 
 
-class PetSerializerWithShared(serializers.ModelSerializer):
+class PetSerializerWithShared(DynamicFieldsMixin, serializers.ModelSerializer):
     shared_with = serializers.SerializerMethodField()
 
     class Meta:
         model = Pet
         fields = '__all__'
+        method_prefetch = {'shared_with': ['shared_with']}
 
     @extend_schema_field(serializers.ListField(child=serializers.DictField()))
     def get_shared_with(self, obj):
         return [{"uuid": user.uuid, "email": user.email} for user in obj.shared_with.all()]
 
 
-class LocationSerializer(serializers.ModelSerializer):
+class LocationSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     latitude = serializers.FloatField(source='location.y', required=True)  # Para `POST`
     longitude = serializers.FloatField(source='location.x', required=True)  # Para `POST`
     gps_device_code = serializers.CharField(required=True, write_only=True)  # Para `POST`
     # device = GPSDeviceSerializer(source='gps_device', read_only=True)  # Para `GET`
-    pet = PetSerializer(source='gps_device.pet', read_only=True)  # 🔹 Devuelve toda la info de la mascota en `GET`
+    pet = PetSerializer(source='gps_device.pet', read_only=True)  # 🔹 Toda la info de la mascota con `?expand=pet`
 
     class Meta:
         model = Location
         fields = ['uuid', 'timestamp', 'latitude', 'longitude', 'gps_device_code', 'pet']
+        # Un trayecto repite la misma mascota en cada fila: por defecto solo el punto
+        default_fields = ['uuid', 'timestamp', 'latitude', 'longitude']
+        expandable_fields = ['pet']
         extra_kwargs = {
             'gps_device_code': {'write_only': True},  # 🔹 No aparecerá en `GET`, solo en `POST`
             'latitude': {'write_only': True},
             'longitude': {'write_only': True}
         }
 
+    def create(self, validated_data):
+        coordinates = validated_data.pop('location')
+        gps_device_code = validated_data.pop('gps_device_code')
+        try:
+            gps_device = GPSDevice.objects.get(code=gps_device_code)
+        except GPSDevice.DoesNotExist:
+            raise serializers.ValidationError({"gps_device_code": "El dispositivo GPS no existe."})
+
+        location = Location(gps_device=gps_device, **validated_data)
+        location.location = Point(coordinates['x'], coordinates['y'], srid=4326)
+        return store_locations([location])[0]
+
+
+class LocationBatchSerializer(serializers.Serializer):
+    # Cada fix se valida después de forma individual para poder aceptar o rechazar elemento a elemento
+    fixes = serializers.ListField(child=serializers.DictField(), allow_empty=False,
+                                  max_length=settings.LOCATION_BATCH_MAX_SIZE)
+
 
 class AccessCodeRequestSerializer(serializers.Serializer):
     code = serializers.CharField()
 
 
-class AccessCodeSerializer(serializers.ModelSerializer):
+class AccessCodeSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     pet_name = serializers.CharField(source='pet.name', read_only=True)
     created_by_email = serializers.EmailField(source='created_by.email', read_only=True)
 
@@ -165,7 +307,7 @@ class AccessCodeSerializer(serializers.ModelSerializer):
         read_only_fields = ['uuid', 'code', 'created_at', 'is_used', 'created_by_email']
 
 
-class MedicalRecordSerializer(serializers.ModelSerializer):
+class MedicalRecordSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = MedicalRecord
         fields = '__all__'
@@ -180,6 +322,11 @@ class GoogleLoginSerializer(serializers.Serializer):
     # name = serializers.CharField(required=False)
 
 
+class RevocableTokenRefreshSerializer(TokenRefreshSerializer):
+    """Refresco con rotación: el refresh token usado queda revocado y no se puede reutilizar."""
+    token_class = RevocableRefreshToken
+
+
 class LostPetSerializer(serializers.ModelSerializer):
     owner = serializers.SerializerMethodField()
     veterinarian = serializers.SerializerMethodField()
@@ -188,8 +335,8 @@ class LostPetSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Pet
-        fields = ['name', 'sex', 'breed', 'color', 'birth_date', 'weight', 'sterilized', 'observations',
-                  'phone_emergency', 'owner', 'veterinarian', 'latitude', 'longitude']
+        fields = ['uuid', 'name', 'sex', 'breed', 'color', 'birth_date', 'weight', 'sterilized', 'observations',
+                  'phone_emergency', 'is_lost', 'owner', 'veterinarian', 'latitude', 'longitude']
 
     @extend_schema_field(UserSerializer)  # 🔹 Especifica que devuelve un usuario serializado
     def get_owner(self, obj):
@@ -215,12 +362,19 @@ class LostPetSerializer(serializers.ModelSerializer):
             }
         return None
 
+    @staticmethod
+    def _latest_location(obj):
+        """ Última posición del dispositivo (usar `select_related('gps_device__latest_location')`). """
+        return getattr(obj.gps_device, 'latest_location', None) if obj.gps_device else None
+
     @extend_schema_field(serializers.FloatField)  # 🔹 Devuelve un float (latitud)
     def get_latitude(self, obj):
         """ Devuelve la última latitud registrada del dispositivo GPS. """
-        return obj.gps_device.locations.last().location.y if obj.gps_device and obj.gps_device.locations.exists() else None
+        latest = self._latest_location(obj)
+        return latest.location.y if latest else None
 
     @extend_schema_field(serializers.FloatField)  # 🔹 Devuelve un float (longitud)
     def get_longitude(self, obj):
         """ Devuelve la última longitud registrada del dispositivo GPS. """
-        return obj.gps_device.locations.last().location.x if obj.gps_device and obj.gps_device.locations.exists() else None
+        latest = self._latest_location(obj)
+        return latest.location.x if latest else None
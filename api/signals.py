@@ -0,0 +1,12 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework_simplejwt.settings import api_settings
+
+from beDoggo.models import User
+from .authentication import user_cache, user_id_claim
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_authenticated_user(sender, instance, **kwargs):
+    """Cualquier cambio del usuario (contraseña, ``is_active``, perfil...) invalida su entrada en la caché de JWT."""
+    user_cache.invalidate(user_id_claim(getattr(instance, api_settings.USER_ID_FIELD)))
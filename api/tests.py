@@ -1,3 +1,668 @@
-from django.test import TestCase
+import gzip
+import io
+import json
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
 
-# Create your tests here.
+import rsa
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+from django.urls import reverse
+from django.utils.timezone import now
+from google.auth import crypt, jwt as google_jwt
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, APITestCase
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from api.authentication import user_cache
+from api.fast_serializers import reader_for
+from api.google_auth import GoogleTokenVerifier
+from api.parsers import FastJSONParser
+from api.renderers import FastJSONRenderer
+from api.serializers import LocationSerializer, PetSerializer, PetSerializerWithShared
+from beDoggo.ingest import build_location, write_locations
+from beDoggo.lost_pets import cluster_lost_pets, lost_pet_index
+from beDoggo.models import User, AccessCode, GPSDevice, Location, LatestLocation, MedicalRecord, Pet, RevokedToken, \
+    Veterinarian
+from beDoggo.revoked_tokens import revoked_token_filter
+from beDoggo.tiles import tile_cache
+
+
+class LocationBatchTests(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', email='owner@example.com', password='password123')
+        self.device = GPSDevice.objects.create(code='ABC123', is_active=True)
+        self.client.force_authenticate(self.user)
+        self.url = reverse('location-batch-create')
+
+    def test_batch_accepts_and_rejects_per_item(self):
+        fixes = [
+            {"gps_device_code": "ABC123", "latitude": 36.72, "longitude": -4.42,
+             "timestamp": "2025-02-01T10:00:00Z"},
+            {"gps_device_code": "ABC123", "latitude": 120, "longitude": -4.42},
+            {"gps_device_code": "NOPE00", "latitude": 36.72, "longitude": -4.42},
+        ]
+        response = self.client.post(self.url, {"fixes": fixes}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['accepted'], 1)
+        self.assertEqual(response.data['rejected'], 2)
+        self.assertEqual([r['status'] for r in response.data['results']], ['accepted', 'rejected', 'rejected'])
+        self.assertIn('latitude', response.data['results'][1]['errors'])
+        self.assertIn('gps_device_code', response.data['results'][2]['errors'])
+
+        location = Location.objects.get(gps_device=self.device)
+        self.assertEqual(location.timestamp.isoformat(), '2025-02-01T10:00:00+00:00')
+        self.assertEqual(LatestLocation.objects.get(gps_device=self.device).timestamp, location.timestamp)
+
+    def test_latest_location_ignores_older_fixes(self):
+        newer = {"gps_device_code": "ABC123", "latitude": 36.72, "longitude": -4.42,
+                 "timestamp": "2025-02-01T10:05:00Z"}
+        older = {"gps_device_code": "ABC123", "latitude": 36.0, "longitude": -4.0,
+                 "timestamp": "2025-02-01T10:00:00Z"}
+        self.client.post(self.url, [newer], format='json')
+        self.client.post(self.url, [older], format='json')
+
+        latest = LatestLocation.objects.get(gps_device=self.device)
+        self.assertEqual(latest.timestamp.isoformat(), '2025-02-01T10:05:00+00:00')
+        self.assertEqual(latest.location.coords, (-4.42, 36.72))
+
+    def test_batch_uses_constant_queries(self):
+        fixes = [{"gps_device_code": "ABC123", "latitude": 36.7, "longitude": -4.4}] * 50
+        # Resolución de dispositivos + INSERT + última posición (con su SAVEPOINT)
+        with self.assertNumQueries(5):
+            response = self.client.post(self.url, fixes, format='json')
+        self.assertEqual(response.data['accepted'], 50)
+        self.assertEqual(Location.objects.count(), 50)
+
+
+class DeviceIngestTests(APITestCase):
+
+    def setUp(self):
+        self.device = GPSDevice.objects.create(code='DEV001', is_active=True)
+        self.url = reverse('device-ingest')
+
+    def _post(self, payload, ingest_key=None):
+        return self.client.post(self.url, payload, format='json',
+                                HTTP_AUTHORIZATION=f"Device DEV001:{ingest_key or self.device.ingest_key}")
+
+    def test_rejects_invalid_credentials(self):
+        response = self._post({"latitude": 36.7, "longitude": -4.4}, ingest_key='wrong')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertFalse(Location.objects.exists())
+
+    def test_only_writes_touch_the_database(self):
+        self._post({"latitude": 36.7, "longitude": -4.4})  # Carga la caché de credenciales
+        # SAVEPOINT + INSERT + última posición + RELEASE SAVEPOINT
+        with self.assertNumQueries(4):
+            response = self._post({"fixes": [{"latitude": 36.7, "longitude": -4.4}] * 10})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Location.objects.filter(gps_device=self.device).count(), 11)
+
+
+@override_settings(LOST_PETS_CACHE_ENABLED=False)
+class LostPetsNearbyTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        lost_pet_index.reset()
+        self.addCleanup(lost_pet_index.reset)
+        owner = User.objects.create_user(username='owner', email='owner@example.com', password='password123')
+        self.client.force_authenticate(owner)
+        for code, name, latitude in (('NEAR01', 'Cerca', 36.7105), ('FAR001', 'Lejos', 36.75)):
+            device = GPSDevice.objects.create(code=code, is_active=True)
+            Pet.objects.create(name=name, owner=owner, gps_device=device, is_lost=True)
+            # Varios fixes del mismo dispositivo: la mascota debe aparecer una sola vez
+            fixes = [{"gps_device_code": code, "latitude": latitude + offset, "longitude": -4.4407,
+                      "timestamp": f"2025-02-01T10:0{minute}:00Z"} for minute, offset in enumerate((0.01, 0))]
+            self.client.post(reverse('location-batch-create'), fixes, format='json')
+
+    def test_one_row_per_pet_ordered_by_latest_position(self):
+        for index_enabled in (False, True):
+            with self.subTest(index_enabled=index_enabled), override_settings(LOST_PETS_INDEX_ENABLED=index_enabled):
+                response = self.client.get(reverse('lost-pets'),
+                                           {'latitude': 36.7104, 'longitude': -4.4407, 'distance': 10})
+                self.assertEqual([pet['name'] for pet in response.data], ['Cerca', 'Lejos'])
+                self.assertAlmostEqual(response.data[0]['latitude'], 36.7105)
+
+                response = self.client.get(reverse('lost-pets'),
+                                           {'latitude': 36.7104, 'longitude': -4.4407, 'distance': 1})
+                self.assertEqual([pet['name'] for pet in response.data], ['Cerca'])
+
+    @staticmethod
+    def cluster_cells(clusters):
+        return sorted((round(cluster['latitude'], 6), round(cluster['longitude'], 6), cluster['count'])
+                      for cluster in clusters)
+
+    def test_clusters_by_zoom(self):
+        url = reverse('lost-pets')
+        for index_enabled in (False, True):
+            with self.subTest(index_enabled=index_enabled), override_settings(LOST_PETS_INDEX_ENABLED=index_enabled):
+                response = self.client.get(url, {'zoom': 4})
+                self.assertEqual([cluster['count'] for cluster in response.data], [2])
+                self.assertAlmostEqual(response.data[0]['latitude'], (36.7105 + 36.75) / 2)
+
+                response = self.client.get(url, {'zoom': 16, 'bbox': '-4.5,36.7,-4.4,36.72'})
+                self.assertEqual([cluster['count'] for cluster in response.data], [1])
+
+        # Índice en memoria y PostGIS agrupan en las mismas celdas
+        for zoom in range(17):
+            bbox = (-4.5, 36.7, -4.4, 36.8) if zoom > 5 else None
+            with override_settings(LOST_PETS_INDEX_ENABLED=True):
+                from_index = cluster_lost_pets(zoom, bbox)
+            with override_settings(LOST_PETS_INDEX_ENABLED=False):
+                from_database = cluster_lost_pets(zoom, bbox)
+            self.assertEqual(self.cluster_cells(from_index), self.cluster_cells(from_database), zoom)
+
+        # Zoom fuera de rango, y zoom alto sin área visible o con un área que no cabe en la respuesta
+        for params in ({'zoom': 99}, {'zoom': 8}, {'zoom': 16, 'bbox': '-10,30,10,50'}):
+            self.assertEqual(self.client.get(url, params).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bbox_mode_with_limit_and_since(self):
+        url = reverse('lost-pets')
+        response = self.client.get(url, {'bbox': '-4.5,36.7,-4.4,36.8'})
+        self.assertEqual([pet['name'] for pet in response.data['results']], ['Cerca', 'Lejos'])
+        self.assertFalse(response.data['truncated'])
+        self.assertIn('X-Fetched-At', response)
+        response = self.client.get(url, {'bbox': '-4.5,36.7,-4.4,36.8', 'limit': 1})
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertTrue(response.data['truncated'])
+
+        since = now() + timedelta(minutes=1)
+        changed = since + timedelta(minutes=1)
+        bbox = {'bbox': '-4.5,36.7,-4.4,36.8', 'since': since.isoformat()}
+        # Una mascota no perdida del área que cambia no se devuelve de ninguna forma
+        device = GPSDevice.objects.create(code='HOME01', is_active=True)
+        Pet.objects.create(name='Casa', owner=Pet.objects.get(name='Cerca').owner, gps_device=device)
+        self.client.post(reverse('location-batch-create'), [{"gps_device_code": "HOME01", "latitude": 36.72,
+                                                             "longitude": -4.45}], format='json')
+        Pet.objects.filter(name='Casa').update(updated_at=changed)
+        Pet.objects.filter(name='Cerca').update(updated_at=changed)
+        response = self.client.get(url, bbox)
+        self.assertEqual([pet['name'] for pet in response.data['results']], ['Cerca'])
+        self.assertEqual(response.data['removed'], [])
+
+        # Encontrada: solo su uuid, en retiradas
+        Pet.objects.filter(name='Lejos').update(is_lost=False, lost_changed_at=changed, updated_at=changed)
+        response = self.client.get(url, bbox)
+        self.assertEqual([pet['name'] for pet in response.data['results']], ['Cerca'])
+        self.assertEqual(response.data['removed'], [Pet.objects.get(name='Lejos').uuid])
+
+        # Perdida que sale del área o se queda sin dispositivo: retirada
+        response = self.client.get(url, {**bbox, 'bbox': '-4.5,36.72,-4.4,36.8'})
+        self.assertEqual(response.data['results'], [])
+        self.assertEqual(set(response.data['removed']), set(Pet.objects.filter(
+            name__in=['Cerca', 'Lejos']).values_list('uuid', flat=True)))
+        Pet.objects.filter(name='Cerca').update(gps_device=None)
+        response = self.client.get(url, bbox)
+        self.assertEqual(response.data['results'], [])
+        self.assertEqual(len(response.data['removed']), 2)
+
+    def test_saving_lost_state_records_when_it_changed(self):
+        pet = Pet.objects.get(name='Lejos')
+        pet.name = 'Lejos II'
+        pet.save()
+        self.assertIsNone(pet.lost_changed_at)
+        pet.is_lost = False
+        pet.save(update_fields=['is_lost'])
+        pet.refresh_from_db()
+        self.assertIsNotNone(pet.lost_changed_at)
+
+    def test_index_answers_from_memory(self):
+        params = {'latitude': 36.7104, 'longitude': -4.4407, 'distance': 10}
+        self.client.get(reverse('lost-pets'), params)  # Carga el índice
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('lost-pets'), params)
+        self.assertEqual(len(response.data), 2)
+
+    @override_settings(LOST_PETS_CACHE_ENABLED=True, LOST_PETS_INDEX_ENABLED=False)
+    def test_cache_shares_cells_and_invalidates_on_new_fix(self):
+        url = reverse('lost-pets')
+        self.client.get(url, {'latitude': 36.7104, 'longitude': -4.4407, 'distance': 10})
+        # Otro punto de la misma celda y una distancia que redondea igual: respuesta cacheada
+        with self.assertNumQueries(0):
+            response = self.client.get(url, {'latitude': 36.7106, 'longitude': -4.4405, 'distance': 9.8})
+        self.assertEqual([pet['name'] for pet in response.data], ['Cerca', 'Lejos'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('location-batch-create'), [
+                {"gps_device_code": "FAR001", "latitude": 36.7112, "longitude": -4.4422,
+                 "timestamp": "2025-02-01T10:05:00Z"}], format='json')
+        response = self.client.get(url, {'latitude': 36.7104, 'longitude': -4.4407, 'distance': 10})
+        self.assertEqual([pet['name'] for pet in response.data], ['Lejos', 'Cerca'])
+
+
+class LostPetTileTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        patcher = mock.patch.object(tile_cache, 'directory', directory.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_tile_is_cached_and_revalidated_with_etag(self):
+        url = reverse('lost-pets-tile', kwargs={'z': 12, 'x': 2018, 'y': 1603})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/vnd.mapbox-vector-tile')
+
+        with self.assertNumQueries(0):
+            cached = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_out_of_range_tile(self):
+        response = self.client.get(reverse('lost-pets-tile', kwargs={'z': 2, 'x': 4, 'y': 0}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class PetLocationPaginationTests(APITestCase):
+
+    def setUp(self):
+        owner = User.objects.create_user(username='owner', email='owner@example.com', password='password123')
+        self.client.force_authenticate(owner)
+        device = GPSDevice.objects.create(code='TRK001', is_active=True)
+        self.pet = Pet.objects.create(name='Toby', owner=owner, gps_device=device)
+        fixes = [{"gps_device_code": "TRK001", "latitude": 36.7, "longitude": -4.4,
+                  "timestamp": f"2025-02-01T10:0{minute}:00Z"} for minute in range(5)]
+        self.client.post(reverse('location-batch-create'), fixes, format='json')
+
+    def test_cursor_pages_walk_the_track_newest_first(self):
+        url = reverse('pet-locations-all', kwargs={'uuid': self.pet.uuid})
+        timestamps = []
+        while url:
+            response = self.client.get(url, {'page_size': 2} if not timestamps else None)
+            self.assertNotIn('count', response.data)
+            timestamps += [location['timestamp'] for location in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(len(timestamps), 5)
+        self.assertEqual(timestamps, sorted(timestamps, reverse=True))
+
+    def test_export_streams_formats(self):
+        url = reverse('pet-locations-export', kwargs={'uuid': self.pet.uuid})
+        response = self.client.get(url, {'format': 'csv', 'from': '2025-02-01T10:01:00Z'})
+        rows = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(rows[0], 'timestamp,latitude,longitude')
+        self.assertEqual(rows[1], '2025-02-01T10:01:00+00:00,36.7,-4.4')
+        self.assertEqual(len(rows), 5)
+
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        collection = json.loads(gzip.decompress(b''.join(response.streaming_content)))
+        self.assertEqual(len(collection['features']), 5)
+
+        self.assertEqual(self.client.get(url, {'format': 'kml'}).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_max_points_downsamples_and_refreshes_on_new_fix(self):
+        url = reverse('pet-locations-all', kwargs={'uuid': self.pet.uuid})
+        response = self.client.get(url, {'max_points': 2})
+        self.assertEqual([point['timestamp'].isoformat() for point in response.data],
+                         ['2025-02-01T10:00:00+00:00', '2025-02-01T10:03:00+00:00'])
+
+        # La versión sale de la base de datos: no depende de los avisos on_commit del proceso que escribe
+        self.client.post(reverse('location-batch-create'), [{"gps_device_code": "TRK001", "latitude": 36.8,
+                                                             "longitude": -4.5,
+                                                             "timestamp": "2025-02-01T10:09:00Z"}], format='json')
+        response = self.client.get(url, {'max_points': 2})
+        self.assertEqual(response.data[-1]['latitude'], 36.8)
+
+        self.assertEqual(self.client.get(url, {'max_points': 1}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(url, {'simplify': 'x'}).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_polyline_encoding(self):
+        # Sin fecha de inicio solo se codifican los últimos LOCATION_TRACK_MAX_DAYS días
+        url = reverse('pet-locations-all', kwargs={'uuid': self.pet.uuid})
+        self.assertEqual(self.client.get(url, {'encoding': 'polyline'}).data['timestamps'], [])
+        url = reverse('pet-locations-from', kwargs={'uuid': self.pet.uuid, 'from_datetime': '2025-02-01'})
+        response = self.client.get(url, {'encoding': 'polyline'})
+        self.assertEqual(response.data['polyline'], '_~~~E~jzY' + '??' * 4)
+        self.assertEqual(response.data['timestamps'], [1738404000, 60, 60, 60, 60])
+        # Segunda lectura desde la caché por día
+        self.assertEqual(self.client.get(url, {'encoding': 'polyline'}).data, response.data)
+
+    def test_sparse_fieldsets(self):
+        url = reverse('pet-locations-all', kwargs={'uuid': self.pet.uuid})
+        location = self.client.get(url).data['results'][0]
+        self.assertEqual(set(location), {'uuid', 'timestamp', 'latitude', 'longitude'})
+
+        location = self.client.get(url, {'expand': 'pet'}).data['results'][0]
+        self.assertEqual(location['pet']['name'], 'Toby')
+        self.assertEqual(set(self.client.get(url, {'fields': 'timestamp'}).data['results'][0]), {'timestamp'})
+        self.assertEqual(self.client.get(url, {'fields': 'ingest_key'}).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_conditional_get_on_track_and_pet(self):
+        url = reverse('pet-locations-all', kwargs={'uuid': self.pet.uuid})
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+        self.client.post(reverse('location-batch-create'), [{"gps_device_code": "TRK001", "latitude": 36.8,
+                                                             "longitude": -4.5,
+                                                             "timestamp": "2025-02-01T10:09:00Z"}], format='json')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+        # Un fix atrasado no mueve la última posición pero sí cambia el histórico del intervalo
+        url = reverse('pet-locations-from', kwargs={'uuid': self.pet.uuid, 'from_datetime': '2025-02-01'})
+        etag = self.client.get(url)['ETag']
+        self.client.post(reverse('location-batch-create'), [{"gps_device_code": "TRK001", "latitude": 36.9,
+                                                             "longitude": -4.6,
+                                                             "timestamp": "2025-02-01T10:00:30Z"}], format='json')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+        url = reverse('pet-list-create')
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+        self.pet.name = 'Toby II'
+        self.pet.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+
+class FastSerializerParityTests(APITestCase):
+
+    def setUp(self):
+        owner = User.objects.create_user(username='owner', email='owner@example.com', password='password123')
+        friend = User.objects.create_user(username='friend', email='friend@example.com', password='password123')
+        vet_user = User.objects.create_user(username='vet', email='vet@example.com', password='password123')
+        veterinarian = Veterinarian.objects.create(user=vet_user, vet_license_number='VET-1', clinic_name='Clínica')
+        device = GPSDevice.objects.create(code='FST001', is_active=True)
+        pet = Pet.objects.create(name='Luna', owner=owner, gps_device=device, veterinarian=veterinarian,
+                                 birth_date='2020-05-01', weight=12.5)
+        pet.shared_with.add(friend)
+        Pet.objects.create(name='Coco', owner=owner)
+        self.client.post(reverse('location-batch-create'), [
+            {"gps_device_code": "FST001", "latitude": 36.7213028, "longitude": -4.4216366,
+             "timestamp": f"2025-02-01T10:0{minute}:00.123456Z"} for minute in range(3)], format='json')
+
+    def assertSameJSON(self, serializer_class, queryset, params=None):
+        request = Request(APIRequestFactory().get('/', params or {}))
+        expected = serializer_class(queryset, many=True, context={'request': request}).data
+        reader = reader_for(serializer_class, request)
+        actual = reader.many(reader.read_queryset(queryset))
+        self.assertEqual(JSONRenderer().render(actual), JSONRenderer().render(expected))
+
+    def test_fast_reader_matches_drf_output(self):
+        pets = Pet.objects.order_by('id')
+        self.assertSameJSON(PetSerializer, pets)
+        self.assertSameJSON(PetSerializerWithShared, pets)
+        self.assertSameJSON(PetSerializer, pets, {'fields': 'uuid,owner'})
+
+        locations = Location.objects.order_by('-timestamp')
+        self.assertSameJSON(LocationSerializer, locations)
+        self.assertSameJSON(LocationSerializer, locations, {'expand': 'pet'})
+
+    def test_fields_param_only_trims_write_responses(self):
+        self.client.force_authenticate(User.objects.get(username='owner'))
+        pet = Pet.objects.get(name='Luna')
+        response = self.client.patch(reverse('pet-detail', args=[pet.uuid]) + '?fields=name',
+                                     {'name': 'Nala', 'breed': 'Mestizo'}, format='json')
+        self.assertEqual(response.data, {'name': 'Nala'})
+        pet.refresh_from_db()
+        self.assertEqual((pet.name, pet.breed), ('Nala', 'Mestizo'))
+
+        response = self.client.post(reverse('location-list-create') + '?fields=uuid', {
+            "gps_device_code": "FST001", "latitude": 36.72, "longitude": -4.42,
+            "timestamp": "2025-02-01T11:00:00Z"}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(list(response.data), ['uuid'])
+
+
+class FastJSONTests(SimpleTestCase):
+
+    def test_renderer_and_parser_match_drf(self):
+        payload = {
+            "uuid": uuid.UUID('12345678-1234-5678-1234-567812345678'),
+            "timestamp": datetime(2025, 2, 1, 10, 0, 0, 123456, tzinfo=dt_timezone.utc),
+            "local": datetime(2025, 2, 1, 11, tzinfo=dt_timezone(timedelta(hours=1))),
+            "weight": Decimal('12.5'),
+            "points": [{"latitude": 36.7213028, "longitude": -4.4216366, "name": "Málaga"}],
+            "empty": None,
+        }
+        rendered = FastJSONRenderer().render(payload)
+        self.assertEqual(rendered, JSONRenderer().render(payload))
+        self.assertEqual(FastJSONParser().parse(io.BytesIO(rendered)), json.loads(rendered))
+        # La indentación (API navegable) la sigue resolviendo DRF
+        self.assertEqual(FastJSONRenderer().render(payload, 'application/json; indent=2'),
+                         JSONRenderer().render(payload, 'application/json; indent=2'))
+
+
+@override_settings(LOST_PETS_INDEX_ENABLED=False, LOST_PETS_CACHE_ENABLED=False)
+class QueryCountTests(APITestCase):
+    """
+    Consultas exactas por petición en los listados y detalles de la API. Cada endpoint
+    se mide dos veces, la segunda con el doble de mascotas: si alguien añade un N+1,
+    el número cambia y el test falla.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user(username='owner', email='owner@example.com', password='password123')
+        self.friends = [User.objects.create_user(username=f'friend{number}', email=f'friend{number}@example.com',
+                                                 password='password123') for number in range(2)]
+        vet_user = User.objects.create_user(username='vet', email='vet@example.com', password='password123')
+        self.veterinarian = Veterinarian.objects.create(user=vet_user, vet_license_number='VET-1',
+                                                        clinic_name='Clínica')
+        self.pets = []
+        self.add_pets(3)
+
+    def add_pets(self, count):
+        for _ in range(count):
+            number = len(self.pets)
+            device = GPSDevice.objects.create(code=f'QRY{number:03d}', is_active=True)
+            pet = Pet.objects.create(name=f'Mascota {number}', owner=self.owner, veterinarian=self.veterinarian,
+                                     gps_device=device, chip_number=f'CHIP{number:03d}', is_lost=True)
+            pet.shared_with.add(*self.friends)
+            MedicalRecord.objects.create(pet=pet, veterinarian=self.veterinarian, visit_reason='Revisión')
+            write_locations([build_location(device.pk, {
+                "latitude": 36.71 + number * 1e-3, "longitude": -4.44,
+                "timestamp": datetime(2025, 2, 1, 10, minute, tzinfo=dt_timezone.utc)}) for minute in range(3)])
+            self.pets.append(pet)
+
+    def assertQueries(self, expected, url, params=None, user=None):
+        self.client.force_authenticate(user or self.owner)
+        for _ in range(2):
+            with self.assertNumQueries(expected):
+                response = self.client.get(url, params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.add_pets(3)
+
+    def test_pets(self):
+        # Validador del ETag, COUNT de la página, página con dueño/veterinario/GPS y `shared_with`
+        self.assertQueries(4, reverse('pet-list-create'))
+        self.assertQueries(3, reverse('pet-detail', kwargs={'uuid': self.pets[0].uuid}))
+        self.assertQueries(2, reverse('shared-pets'), user=self.friends[0])
+        self.assertQueries(2, reverse('pet-search'), {'email': self.owner.email})
+
+    def test_locations(self):
+        url = reverse('pet-locations-all', kwargs={'uuid': self.pets[0].uuid})
+        # Validador del ETag (mascota y versión de sus fixes), mascota y página
+        self.assertQueries(4, url)
+        self.assertQueries(5, url, {'expand': 'pet'})
+        self.assertQueries(1, reverse('location-list-create'))
+        self.assertQueries(2, reverse('location-list-create'), {'expand': 'pet'})
+        self.assertQueries(1, reverse('lost-pets'), {'latitude': 36.71, 'longitude': -4.44, 'distance': 50})
+
+    def test_devices_and_medical_records(self):
+        self.assertQueries(2, reverse('gps-device-list-create'))
+        self.assertQueries(1, reverse('gps-device-detail', kwargs={'code': 'QRY000'}))
+        self.assertQueries(3, reverse('medical-record-list-create', kwargs={'pet_id': self.pets[0].uuid}))
+        record = MedicalRecord.objects.filter(pet=self.pets[0]).get()
+        self.assertQueries(1, reverse('medical-record-detail', kwargs={'record_id': record.uuid}))
+
+
+class PetAccessTests(APITestCase):
+
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner', email='owner@example.com', password='password123')
+        self.friend = User.objects.create_user(username='friend', email='friend@example.com', password='password123')
+        vet_user = User.objects.create_user(username='vet', email='vet@example.com', password='password123')
+        self.veterinarian = Veterinarian.objects.create(user=vet_user, vet_license_number='VET-1')
+        self.pet = Pet.objects.create(name='Luna', owner=self.owner)
+        self.detail = reverse('pet-detail', kwargs={'uuid': self.pet.uuid})
+
+    def test_sharing_follows_access_codes(self):
+        self.client.force_authenticate(self.friend)
+        self.assertEqual(self.client.get(self.detail).status_code, status.HTTP_404_NOT_FOUND)
+
+        code = AccessCode.objects.create(pet=self.pet, created_by=self.owner)
+        self.client.post(reverse('use-access-code'), {'code': code.code}, format='json')
+        self.assertEqual(self.client.get(self.detail).status_code, status.HTTP_200_OK)
+        self.assertEqual([str(pet['uuid']) for pet in self.client.get(reverse('shared-pets')).data],
+                         [str(self.pet.uuid)])
+
+        self.pet.shared_with.clear()
+        self.assertEqual(self.client.get(self.detail).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_veterinarian_and_owner_changes(self):
+        records = reverse('medical-record-list-create', kwargs={'pet_id': self.pet.uuid})
+        self.client.force_authenticate(self.veterinarian.user)
+        self.assertEqual(self.client.post(records, {'visit_reason': 'Vacuna'}, format='json').status_code,
+                         status.HTTP_403_FORBIDDEN)
+
+        self.pet.veterinarian = self.veterinarian
+        self.pet.save()
+        self.assertEqual(self.client.get(self.detail).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.post(records, {'visit_reason': 'Vacuna'}, format='json').status_code,
+                         status.HTTP_201_CREATED)
+        self.assertEqual(len(self.client.get(records).data), 1)
+        # Ve la ficha y el historial, pero la mascota no aparece en su listado
+        self.assertEqual(self.client.get(reverse('pet-list-create')).data['results'], [])
+
+        self.pet.owner = self.friend
+        self.pet.save()
+        self.client.force_authenticate(self.owner)
+        self.assertEqual(self.client.get(self.detail).status_code, status.HTTP_404_NOT_FOUND)
+        self.client.force_authenticate(self.friend)
+        self.assertEqual(self.client.get(self.detail).status_code, status.HTTP_200_OK)
+
+
+class CachedJWTAuthenticationTests(APITestCase):
+
+    def setUp(self):
+        user_cache.clear()
+        self.user = User.objects.create_user(username='owner', email='owner@example.com', password='password123')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+
+    def test_user_is_cached_until_it_changes(self):
+        url = reverse('user-profile')
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url).data['email'], 'owner@example.com')
+
+        self.user.first_name = 'Ana'
+        self.user.save()
+        self.assertEqual(self.client.get(url).data['first_name'], 'Ana')
+
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_generations_only_for_reads_in_flight(self):
+        for user_id in range(1000, 1100):
+            user_cache.invalidate(user_id)
+        self.assertEqual(user_cache._generations, {})
+
+        # Un cambio durante la lectura impide guardar el usuario leído
+        generation = user_cache.generation(self.user.pk)
+        user_cache.invalidate(self.user.pk)
+        user_cache.set(self.user.pk, None, self.user, generation)
+        self.assertIsNone(user_cache.get(self.user.pk, None))
+        self.assertEqual((user_cache._generations, user_cache._in_flight), ({}, {}))
+
+
+class RefreshTokenRotationTests(APITestCase):
+
+    def setUp(self):
+        revoked_token_filter.reset()
+        self.addCleanup(revoked_token_filter.reset)
+        self.user = User.objects.create_user(username='owner', email='owner@example.com', password='password123')
+
+    def test_rotated_refresh_token_cannot_be_reused(self):
+        url = reverse('token_refresh')
+        refresh = str(RefreshToken.for_user(self.user))
+        response = self.client.post(url, {'refresh': refresh}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response.data['refresh'], refresh)
+        self.assertTrue(RevokedToken.objects.filter(jti=RefreshToken(refresh)['jti']).exists())
+
+        self.assertEqual(self.client.post(url, {'refresh': refresh}, format='json').status_code,
+                         status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(self.client.post(url, {'refresh': response.data['refresh']}, format='json').status_code,
+                         status.HTTP_200_OK)
+
+
+class GoogleTokenVerifierTests(SimpleTestCase):
+    """Contra un servidor local que hace de Google con claves propias."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.keys = {kid: rsa.newkeys(1024) for kid in ('key-1', 'key-2')}  # (pública, privada)
+
+    def setUp(self):
+        self.published, self.max_age, self.requests = ['key-1'], 3600, []
+        test = self
+
+        class CertsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                test.requests.append(self.path)
+                body = json.dumps({kid: test.keys[kid][0].save_pkcs1().decode() for kid in test.published}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Cache-Control', f'public, max-age={test.max_age}, must-revalidate')
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), CertsHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.verifier = GoogleTokenVerifier(f'http://127.0.0.1:{server.server_port}/certs', audience='bedoggo-client',
+                                            default_max_age=300, refresh_margin=60, retry_interval=0, timeout=5)
+        self.addCleanup(self.verifier.close)
+
+    def token(self, kid='key-1', **claims):
+        issued_at = int(time.time())
+        payload = {'iss': 'https://accounts.google.com', 'aud': 'bedoggo-client', 'sub': '42',
+                   'email': 'ana@example.com', 'iat': issued_at, 'exp': issued_at + 3600, **claims}
+        signer = crypt.RSASigner.from_string(self.keys[kid][1].save_pkcs1(), key_id=kid)
+        return google_jwt.encode(signer, payload).decode()
+
+    def test_verifies_locally_with_cached_certs(self):
+        for _ in range(3):
+            self.assertEqual(self.verifier.verify(self.token())['email'], 'ana@example.com')
+        self.assertEqual(len(self.requests), 1)
+
+        # Emisor ajeno, caducado, firma alterada, mal formado y emitido para otra app
+        for token in (self.token(iss='https://example.com'), self.token(exp=int(time.time()) - 3600),
+                      self.token()[:-4] + 'AAAA', 'no-es-un-jwt', self.token(aud='otra-app')):
+            with self.assertRaises(ValueError):
+                self.verifier.verify(token)
+
+        # Rotación: un `kid` nuevo obliga a descargar los certificados
+        self.published.append('key-2')
+        self.assertEqual(self.verifier.verify(self.token('key-2'))['sub'], '42')
+        self.assertEqual(len(self.requests), 2)
+
+    def test_refreshes_in_background_before_expiry(self):
+        # Max-age menor que el margen: se renueva a mitad de vida, no en cada verificación
+        self.max_age = 30
+        self.verifier.verify(self.token())
+        self.verifier.verify(self.token())
+        self.assertEqual(len(self.requests), 1)
+
+        self.verifier._refresh_at = 0  # Mitad de vida alcanzada
+        self.verifier.verify(self.token())
+        self.verifier._refresh_thread.join(timeout=5)
+        self.assertEqual(len(self.requests), 2)
@@ -7,7 +7,8 @@ from .views import (
     LostPetsNearbyView, LocationListCreateView, VeterinarianListCreateView, VeterinarianDetailView,
     MedicalRecordListCreateView, MedicalRecordDetailView, PetSearchView, SharedPetsView, OnboardingView,
     GPSDeviceListCreateView, GPSDeviceDetailView, AssociateGPSDeviceView, UserProfileView, UseAccessCodeView,
-    PetLocationView, CustomTokenObtainPairView, CustomTokenRefreshView
+    PetLocationView, CustomTokenObtainPairView, CustomTokenRefreshView, LocationBatchCreateView,
+    device_ingest_view, MetricsView, lost_pets_tile_view, PetLocationExportView
 )
 
 urlpatterns = [
@@ -29,6 +30,7 @@ urlpatterns = [
     path('pets/<uuid:uuid>/', PetDetailView.as_view(), name='pet-detail'),
     path('pets/<uuid:uuid>/locations/all/', PetLocationView.as_view(), name='pet-locations-all'),
     path('pets/<uuid:uuid>/locations/from/<str:from_datetime>/', PetLocationView.as_view(), name='pet-locations-from'),
+    path('pets/<uuid:uuid>/locations/export/', PetLocationExportView.as_view(), name='pet-locations-export'),
     path('pets/<uuid:pet_uuid>/access-code/', PetAccessCodeView.as_view(), name='pet-access-code'),
     path('pets/access-code/validate/', AccessCodeValidationView.as_view(), name='access-code-validate'),
     path('pets/search/', PetSearchView.as_view(), name='pet-search'),
@@ -42,8 +44,11 @@ urlpatterns = [
 
     # Ubicaciones
     path('locations/', LocationListCreateView.as_view(), name='location-list-create'),
+    path('locations/batch/', LocationBatchCreateView.as_view(), name='location-batch-create'),
+    path('ingest/locations/', device_ingest_view, name='device-ingest'),
     # path('locations/<uuid:uuid>/', LocationDetailView.as_view(), name='location-detail'),
     path('locations/lost-pets/', LostPetsNearbyView.as_view(), name='lost-pets'),
+    path('tiles/lost-pets/<int:z>/<int:x>/<int:y>.mvt', lost_pets_tile_view, name='lost-pets-tile'),
 
     # Veterinarios
     path('veterinarians/', VeterinarianListCreateView.as_view(), name='veterinarian-list-create'),
@@ -51,7 +56,10 @@ urlpatterns = [
 
     # Historial Médico
     path('medical-records/<uuid:pet_id>/', MedicalRecordListCreateView.as_view(), name='medical-record-list-create'),
-    path('medical-records/<uuid:record_id>/', MedicalRecordDetailView.as_view(), name='medical-record-detail'),
+    path('medical-records/record/<uuid:record_id>/', MedicalRecordDetailView.as_view(), name='medical-record-detail'),
+
+    # Administración
+    path('metrics/', MetricsView.as_view(), name='metrics'),
 
     # JWT Tokens (actualizado con las vistas personalizadas)
     path('token/', CustomTokenObtainPairView.as_view(), name='token_obtain_pair'),
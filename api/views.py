@@ -1,25 +1,43 @@
-import jwt
-from django.db.models import Q
+import json
+import os
+
+from django.conf import settings
+from django.db.models import Count, Max
+from django.db.models.functions import Greatest
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import redirect
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from django.utils.dateparse import parse_date, parse_datetime
 from django.utils.timezone import now, make_aware
-from google.auth.transport.requests import Request as GoogleRequest
-from google.oauth2 import id_token
 from rest_framework import generics, status
 from rest_framework.exceptions import ValidationError, PermissionDenied
 from rest_framework.generics import get_object_or_404
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
-from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework_simplejwt.tokens import RefreshToken
 from beDoggo.models import User, Pet, AccessCode, Location, MedicalRecord, Veterinarian, GPSDevice
+from .authentication import CachedJWTAuthentication
+from .fast_serializers import reader_for
+from .google_auth import google_verifier
+from .mixins import ConditionalGetMixin, FastListMixin, FieldsetQuerysetMixin
+from .pagination import LocationCursorPagination
 from .serializers import UserSerializer, PetSerializer, LostPetSerializer, \
     GoogleLoginSerializer, RegisterUserSerializer, AccessCodeSerializer, LocationSerializer, MedicalRecordSerializer, \
     VeterinarianSerializer, GPSDeviceSerializer, AssociateGPSDeviceSerializer, AccessCodeRequestSerializer, \
-    PetSerializerWithShared, OnboardingPetSerializer
+    PetSerializerWithShared, OnboardingPetSerializer, LocationBatchSerializer
+from beDoggo import metrics
+from beDoggo.access import ALL_ROLES, MEMBER_ROLES, OWNER_ROLES, SHARED_ROLES, VETERINARIAN_ROLES, accessible_pets, \
+    has_pet_access, with_pet_access
+from beDoggo.buffer import BufferFull
+from beDoggo.ingest import ingest_fixes, ingest_device_fixes, summarize_results, authenticate_device, is_buffered
+from beDoggo.lost_pets import cached_lost_pets, cluster_lost_pets, find_lost_pets, lost_pets_in_bbox, \
+    parse_cluster_params, parse_viewport_params
+from beDoggo.tiles import tile_cache, tile_version
+from beDoggo.tracks import EXPORT_FORMATS, encode_track, encoded_track, gzip_stream, simplified_track, \
+    track_points, track_version
 from django.contrib.gis.geos import Point
-from django.contrib.gis.measure import D  # Distancia
-from django.contrib.gis.db.models.functions import Distance
 from drf_spectacular.utils import extend_schema, OpenApiParameter
 from datetime import datetime
 from zoneinfo import ZoneInfo
@@ -47,54 +65,37 @@ class GoogleLoginView(APIView):
         if serializer.is_valid():
             token = serializer.validated_data.get('id_token')
 
-            # Extraer el email del token sin verificarlo con Google
+            # Firma verificada en local con los certificados de Google en caché
             try:
-                payload = jwt.decode(token, options={"verify_signature": False})
-                email = payload.get("email")
-            except jwt.DecodeError:
+                idinfo = google_verifier.verify(token)
+            except ValueError:
+                return Response({"error": "Token inválido o expirado."}, status=status.HTTP_400_BAD_REQUEST)
+            email = idinfo.get("email")
+            if not email:
                 return Response({"error": "Token inválido."}, status=status.HTTP_400_BAD_REQUEST)
 
             # Verificar si el usuario ya existe con ese email
             user = User.objects.filter(email=email).first()
-            if user:
-                # Si ya tiene un token almacenado, simplemente devolver los JWT
-                refresh = RefreshToken.for_user(user)
-                return Response({
-                    "access": str(refresh.access_token),
-                    "refresh": str(refresh),
-                    "user": UserSerializer(user).data,
-                })
-
-            # Si no tiene un email, verificar con Google y guardarlo
-            try:
-                google_request = GoogleRequest()
-                idinfo = id_token.verify_oauth2_token(token, google_request)
-                email_verified = idinfo.get("email_verified", True)
-                first_name = idinfo.get("given_name", "")
-                last_name = idinfo.get("family_name", "")
-                picture = idinfo.get("picture", "")
-
-                # Crear o actualizar el usuario con su `email`
+            if user is None:
+                # Crear el usuario con los datos de Google
                 user, created = User.objects.update_or_create(
                     email=email,
                     defaults={
-                        "email_verified": email_verified,
+                        "email_verified": idinfo.get("email_verified", True),
                         "username": email.split('@')[0],
-                        "first_name": first_name,
-                        "last_name": last_name,
-                        "profile_picture": picture,
+                        "first_name": idinfo.get("given_name", ""),
+                        "last_name": idinfo.get("family_name", ""),
+                        "profile_picture": idinfo.get("picture", ""),
                     },
                 )
 
-                # Generar tokens de acceso (JWT)
-                refresh = RefreshToken.for_user(user)
-                return Response({
-                    "access": str(refresh.access_token),
-                    "refresh": str(refresh),
-                    "user": UserSerializer(user).data,
-                })
-            except ValueError:
-                return Response({"error": "Token inválido o expirado."}, status=status.HTTP_400_BAD_REQUEST)
+            # Generar tokens de acceso (JWT)
+            refresh = RefreshToken.for_user(user)
+            return Response({
+                "access": str(refresh.access_token),
+                "refresh": str(refresh),
+                "user": UserSerializer(user).data,
+            })
 
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -134,7 +135,7 @@ class RegisterUserView(APIView):
 
 
 class UserProfileView(generics.RetrieveAPIView):
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
     permission_classes = [IsAuthenticated]
     serializer_class = UserSerializer
 
@@ -224,15 +225,22 @@ class OnboardingView(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class PetListCreateView(generics.ListCreateAPIView):
+# Última modificación de lo que devuelve `PetSerializer`: la mascota (incluido `shared_with`), su dueño,
+# su veterinario y su GPS
+PET_MODIFIED = Greatest('updated_at', 'owner__updated_at', 'veterinarian__updated_at', 'gps_device__updated_at')
+
+
+class PetListCreateView(ConditionalGetMixin, FastListMixin, generics.ListCreateAPIView):
     serializer_class = PetSerializer
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        return Pet.objects.filter(
-            Q(owner=self.request.user) |
-            Q(shared_with=self.request.user)
-        ).distinct()
+        return accessible_pets(self.request.user, MEMBER_ROLES)
+
+    def get_validators(self):
+        # Cuántas mascotas ve el usuario y cuándo cambió la última (o su dueño, veterinario o GPS)
+        pets = self.get_queryset().aggregate(count=Count('pk'), modified=Max(PET_MODIFIED))
+        return f"{pets['count']}:{pets['modified'] and pets['modified'].isoformat()}", None
 
     @extend_schema(
         summary="Listar mascotas",
@@ -255,19 +263,19 @@ class PetListCreateView(generics.ListCreateAPIView):
         serializer.save(owner=self.request.user)  # 🔹 Asignar el owner explícitamente
 
 
-class PetDetailView(generics.RetrieveUpdateDestroyAPIView):
+class PetDetailView(ConditionalGetMixin, FieldsetQuerysetMixin, generics.RetrieveUpdateDestroyAPIView):
     serializer_class = PetSerializer
     permission_classes = [IsAuthenticated]
     lookup_field = 'uuid'
 
     def get_queryset(self):
-        user = self.request.user  # Usuario autenticado
+        # Dueño, usuarios con los que se comparte y su veterinario
+        return accessible_pets(self.request.user)
 
-        return Pet.objects.filter(
-            Q(owner=user) |
-            Q(shared_with=user) |
-            Q(veterinarian__user=user)  # Permitir acceso si el usuario es el veterinario
-        ).distinct()
+    def get_validators(self):
+        modified = self.get_queryset().filter(uuid=self.kwargs['uuid']).annotate(modified=PET_MODIFIED) \
+            .values_list('modified', flat=True).first()
+        return (modified.isoformat(), modified) if modified else (None, None)
 
     @extend_schema(
         summary="Obtener detalles de mascota",
@@ -316,7 +324,7 @@ class PetAccessCodeView(generics.CreateAPIView):
     @extend_schema(summary="Generar un código de acceso", request=AccessCodeSerializer,
                    responses={201: AccessCodeSerializer})
     def post(self, request, pet_uuid):
-        pet = get_object_or_404(Pet, uuid=pet_uuid, owner=request.user)
+        pet = get_object_or_404(accessible_pets(request.user, OWNER_ROLES), uuid=pet_uuid)
         expiration_time = request.data.get("expires_at")
 
         access_code = AccessCode.objects.create(
@@ -326,37 +334,61 @@ class PetAccessCodeView(generics.CreateAPIView):
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
-class PetLocationView(generics.ListAPIView):
+class PetLocationView(ConditionalGetMixin, FastListMixin, generics.ListAPIView):
     permission_classes = [IsAuthenticated]
     serializer_class = LocationSerializer
+    pagination_class = LocationCursorPagination
+    fieldset_always = ('timestamp',)  # Orden del cursor
 
-    def get_queryset(self):
-        pet_uuid = self.kwargs.get('uuid')
-        from_datetime = self.kwargs.get('from_datetime')
-        
+    def get_pet(self):
         # Verificar que el usuario tiene acceso a la mascota
-        pet = get_object_or_404(Pet, 
-            Q(uuid=pet_uuid) & (Q(owner=self.request.user) | Q(shared_with=self.request.user))
-        )
+        return get_object_or_404(accessible_pets(self.request.user, MEMBER_ROLES), uuid=self.kwargs.get('uuid'))
+
+    def get_validators(self):
+        # Versión de los fixes del intervalo pedido (cualquier página del cursor cae dentro): cambia también con
+        # los fixes atrasados del spool o de los lotes, que no mueven la última posición. La mascota, por `?expand=pet`.
+        row = accessible_pets(self.request.user, MEMBER_ROLES).filter(uuid=self.kwargs.get('uuid')) \
+            .annotate(modified=PET_MODIFIED).values_list('gps_device_id', 'modified').first()
+        if row is None:
+            return None, None
+        device_id, modified = row
+        if device_id is None:
+            return modified.isoformat(), modified
+        version, written = track_version(device_id, self.get_from_datetime())
+        return f'{modified.isoformat()}:{version}', max(modified, written or modified)
+
+    def get_from_datetime(self):
+        from_datetime = self.kwargs.get('from_datetime')
+        if not from_datetime:
+            return None
+        try:
+            # Convertir la fecha string a datetime consciente de la zona horaria
+            return make_aware(datetime.strptime(from_datetime, '%Y-%m-%d'), timezone=ZoneInfo("UTC"))
+        except ValueError:
+            raise ValidationError("Formato de fecha inválido. Use YYYY-MM-DD")
+
+    def get_queryset(self):
+        pet = self.get_pet()
         
-        queryset = Location.objects.filter(gps_device__pet=pet)
+        # Filtrar por el dispositivo directamente para que el índice (gps_device, -timestamp) sirva la paginación
+        queryset = Location.objects.filter(gps_device_id=pet.gps_device_id) if pet.gps_device_id \
+            else Location.objects.none()
         
+        from_datetime = self.get_from_datetime()
         if from_datetime:
-            try:
-                # Convertir la fecha string a datetime
-                date_obj = datetime.strptime(from_datetime, '%Y-%m-%d')
-                # Hacer la fecha consciente de la zona horaria
-                aware_date = make_aware(date_obj, timezone=ZoneInfo("UTC"))
-                queryset = queryset.filter(timestamp__gte=aware_date)
-            except ValueError:
-                raise ValidationError("Formato de fecha inválido. Use YYYY-MM-DD")
+            queryset = queryset.filter(timestamp__gte=from_datetime)
         
-        return queryset.order_by('-timestamp')
+        return queryset.order_by('-timestamp', '-id')
 
     @extend_schema(
         tags=['locations'],
         summary="Obtener todas las ubicaciones de una mascota",
-        description="Devuelve todas las ubicaciones registradas de una mascota específica.",
+        description="Devuelve todas las ubicaciones registradas de una mascota específica, de la más reciente a la "
+                    "más antigua, paginadas por cursor (`next`/`previous`). `page_size` admite hasta "
+                    "LOCATION_MAX_PAGE_SIZE para descargar trayectos. Con `simplify` y/o `max_points` devuelve "
+                    "el trayecto reducido en orden cronológico y sin paginar, pensado para dibujar la línea; "
+                    "`encoding=polyline` lo devuelve además como polilínea codificada; sin `simplify`/`max_points` "
+                    "y sin fecha de inicio abarca los últimos LOCATION_TRACK_MAX_DAYS días.",
         parameters=[
             OpenApiParameter(
                 name="uuid",
@@ -364,7 +396,14 @@ class PetLocationView(generics.ListAPIView):
                 description="UUID de la mascota",
                 required=True,
                 type=str
-            )
+            ),
+            OpenApiParameter(name="simplify", description="Tolerancia en metros de la simplificación "
+                                                          "Douglas-Peucker", required=False, type=float),
+            OpenApiParameter(name="max_points", description="Máximo de puntos: un fix por cada tramo de tiempo "
+                                                            "de igual duración", required=False, type=int),
+            OpenApiParameter(name="encoding", description="`polyline`: polilínea codificada de Google y "
+                                                          "marcas de tiempo en deltas de segundos",
+                             required=False, type=str, enum=['polyline']),
         ],
         responses={
             200: LocationSerializer(many=True),
@@ -372,7 +411,100 @@ class PetLocationView(generics.ListAPIView):
         }
     )
     def get(self, request, *args, **kwargs):
-        return super().get(request, *args, **kwargs)
+        encoding = request.query_params.get('encoding')
+        if encoding not in (None, 'polyline'):
+            raise ValidationError({"encoding": "Codificaciones disponibles: polyline."})
+        reduced = 'simplify' in request.query_params or 'max_points' in request.query_params
+        if not reduced and encoding is None:
+            return super().get(request, *args, **kwargs)
+
+        tolerance, max_points = self._parse_reduction(request.query_params)
+        pet = self.get_pet()
+        if not reduced:
+            return Response(encoded_track(pet.gps_device_id, start=self.get_from_datetime())
+                            if pet.gps_device_id else encode_track([]))
+        points = simplified_track(pet.gps_device_id, start=self.get_from_datetime(), tolerance=tolerance,
+                                  max_points=max_points) if pet.gps_device_id else []
+        if encoding == 'polyline':
+            return Response(encode_track(points))
+        return Response([
+            {"timestamp": timestamp, "latitude": latitude, "longitude": longitude}
+            for timestamp, latitude, longitude in points
+        ])
+
+    @staticmethod
+    def _parse_reduction(params):
+        tolerance = max_points = None
+        if 'simplify' in params:
+            try:
+                tolerance = float(params['simplify'])
+            except ValueError:
+                tolerance = 0
+            if not 0 < tolerance < float('inf'):
+                raise ValidationError({"simplify": "Debe ser una tolerancia en metros mayor que 0."})
+        if 'max_points' in params:
+            try:
+                max_points = int(params['max_points'])
+            except ValueError:
+                max_points = 0
+            if not 2 <= max_points <= settings.LOCATION_TRACK_MAX_POINTS:
+                raise ValidationError(
+                    {"max_points": f"Debe estar entre 2 y {settings.LOCATION_TRACK_MAX_POINTS}."})
+        return tolerance, max_points
+
+
+class PetLocationExportView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def perform_content_negotiation(self, request, force=False):
+        # `format` es el formato del fichero exportado, no un renderer de DRF
+        return super().perform_content_negotiation(request, force=True)
+
+    @extend_schema(
+        tags=['locations'],
+        summary="Exportar el trayecto de una mascota",
+        description="Descarga en streaming todas las ubicaciones de la mascota (o las del intervalo `from`-`to`) en "
+                    "GeoJSON, GPX o CSV. La respuesta se comprime en gzip si el cliente lo acepta.",
+        parameters=[
+            OpenApiParameter(name="format", description="geojson, gpx o csv (por defecto: geojson)",
+                             required=False, type=str, enum=list(EXPORT_FORMATS)),
+            OpenApiParameter(name="from", description="Fecha u hora ISO 8601 de inicio (incluida)",
+                             required=False, type=str),
+            OpenApiParameter(name="to", description="Fecha u hora ISO 8601 de fin (excluida)",
+                             required=False, type=str),
+        ],
+        responses={200: {"description": "Fichero del trayecto"}, 404: {"description": "Mascota no encontrada"}}
+    )
+    def get(self, request, uuid):
+        pet = get_object_or_404(accessible_pets(request.user, MEMBER_ROLES), uuid=uuid)
+        export_format = request.query_params.get('format', 'geojson')
+        if export_format not in EXPORT_FORMATS:
+            raise ValidationError({"format": f"Formatos disponibles: {', '.join(EXPORT_FORMATS)}."})
+        start = self._parse_bound(request.query_params.get('from'), 'from')
+        end = self._parse_bound(request.query_params.get('to'), 'to')
+
+        stream, content_type, extension = EXPORT_FORMATS[export_format]
+        points = track_points(pet.gps_device_id, start, end) if pet.gps_device_id else iter(())
+        content = stream(points, pet.name)
+        gzipped = settings.LOCATION_EXPORT_GZIP and 'gzip' in request.headers.get('Accept-Encoding', '')
+        response = StreamingHttpResponse(gzip_stream(content) if gzipped else content, content_type=content_type)
+        if gzipped:
+            response['Content-Encoding'] = 'gzip'
+        response['Vary'] = 'Accept-Encoding'
+        response['Content-Disposition'] = f'attachment; filename="{pet.uuid}.{extension}"'
+        return response
+
+    @staticmethod
+    def _parse_bound(value, name):
+        if not value:
+            return None
+        parsed = parse_datetime(value)
+        if parsed is None:
+            day = parse_date(value)
+            if day is None:
+                raise ValidationError({name: "Use una fecha u hora ISO 8601."})
+            parsed = datetime.combine(day, datetime.min.time())
+        return make_aware(parsed, timezone=ZoneInfo("UTC")) if parsed.tzinfo is None else parsed
 
 
 class AccessCodeValidationView(generics.GenericAPIView):
@@ -455,15 +587,15 @@ class PetSearchView(APIView):
         else:
             return Response({"error": "Debe proporcionar un email o un número de chip."},
                             status=status.HTTP_400_BAD_REQUEST)
-        serializer = PetSerializer(pets, many=True)
-        return Response(serializer.data)
+        reader = reader_for(PetSerializer, request)
+        return Response(reader.many(reader.read_queryset(pets)))
 
 
 class SharedPetsView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        return Pet.objects.filter(shared_with=self.request.user)
+        return accessible_pets(self.request.user, SHARED_ROLES)
 
     @extend_schema(
         summary="Listar mascotas compartidas",
@@ -471,17 +603,30 @@ class SharedPetsView(APIView):
         responses={200: PetSerializerWithShared(many=True)}
     )
     def get(self, request):
-        shared_pets = self.get_queryset()
-        serializer = PetSerializerWithShared(shared_pets, many=True)
-        return Response(serializer.data)
+        reader = reader_for(PetSerializerWithShared, request)
+        return Response(reader.many(reader.optimize_queryset(self.get_queryset())))
+
+
+INGEST_UNAVAILABLE_MESSAGE = "La cola de ingesta está llena. Reintente en unos segundos."
+INGEST_RETRY_AFTER = '1'
+MVT_CONTENT_TYPE = 'application/vnd.mapbox-vector-tile'
+
 
+def _ingest_status(summary):
+    """201 si los fixes se han escrito, 202 si solo se han encolado y 400 si no se ha aceptado ninguno."""
+    if not summary['accepted']:
+        return status.HTTP_400_BAD_REQUEST
+    return status.HTTP_202_ACCEPTED if is_buffered() else status.HTTP_201_CREATED
 
-class LocationListCreateView(generics.ListCreateAPIView):
+
+class LocationListCreateView(FastListMixin, generics.ListCreateAPIView):
     serializer_class = LocationSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = LocationCursorPagination
+    fieldset_always = ('timestamp',)  # Orden del cursor
 
     def get_queryset(self):
-        return Location.objects.filter(gps_device__pet__owner=self.request.user)
+        return with_pet_access(Location.objects.all(), self.request.user, OWNER_ROLES, pet='gps_device__pet')
 
     @extend_schema(
         summary="Listar ubicaciones",
@@ -498,15 +643,85 @@ class LocationListCreateView(generics.ListCreateAPIView):
         responses={201: LocationSerializer}
     )
     def post(self, request, *args, **kwargs):
-        return super().post(request, *args, **kwargs)
+        try:
+            return super().post(request, *args, **kwargs)
+        except BufferFull:
+            return Response({"error": INGEST_UNAVAILABLE_MESSAGE}, status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            headers={'Retry-After': INGEST_RETRY_AFTER})
+
+
+class LocationBatchCreateView(APIView):
+    permission_classes = [IsAuthenticated]
 
+    @extend_schema(
+        tags=['locations'],
+        summary="Registrar ubicaciones en lote",
+        description="Registra de una sola vez los fixes acumulados por uno o varios dispositivos GPS. "
+                    "Cada fix se acepta o rechaza de forma individual y todos los aceptados se guardan "
+                    "con una única inserción.",
+        request=LocationBatchSerializer,
+        responses={
+            201: {"accepted": 2, "rejected": 0, "results": [{"index": 0, "status": "accepted", "uuid": "..."}]},
+            400: {"description": "Lote inválido o ningún fix aceptado"}
+        }
+    )
+    def post(self, request):
+        data = {"fixes": request.data} if isinstance(request.data, list) else request.data
+        serializer = LocationBatchSerializer(data=data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-class LocationDetailView(generics.RetrieveUpdateDestroyAPIView):
+        try:
+            summary = summarize_results(ingest_fixes(serializer.validated_data['fixes']))
+        except BufferFull:
+            return Response({"error": INGEST_UNAVAILABLE_MESSAGE}, status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            headers={'Retry-After': INGEST_RETRY_AFTER})
+        return Response(summary, status=_ingest_status(summary))
+
+
+@csrf_exempt
+@require_POST
+def device_ingest_view(request):
+    """
+    Ingesta ligera para los propios dispositivos GPS.
+
+    Se autentica con ``Authorization: Device <code>:<ingest_key>`` contra la caché
+    en memoria de dispositivos activos, sin JWT ni vistas genéricas de DRF, de modo
+    que la base de datos solo se usa para escribir los fixes. Acepta un fix, una
+    lista de fixes o ``{"fixes": [...]}``.
+    """
+    device_id = authenticate_device(request.headers.get('Authorization'))
+    if device_id is None:
+        return JsonResponse({"error": "Credenciales de dispositivo inválidas."}, status=status.HTTP_401_UNAUTHORIZED)
+
+    try:
+        payload = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({"error": "JSON inválido."}, status=status.HTTP_400_BAD_REQUEST)
+
+    if isinstance(payload, dict):
+        payload = payload['fixes'] if 'fixes' in payload else [payload]
+    if not isinstance(payload, list) or not payload:
+        return JsonResponse({"error": "Se esperaba al menos un fix."}, status=status.HTTP_400_BAD_REQUEST)
+    if len(payload) > settings.LOCATION_BATCH_MAX_SIZE:
+        return JsonResponse({"error": f"Máximo {settings.LOCATION_BATCH_MAX_SIZE} fixes por petición."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        summary = summarize_results(ingest_device_fixes(device_id, payload))
+    except BufferFull:
+        response = JsonResponse({"error": INGEST_UNAVAILABLE_MESSAGE}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        response['Retry-After'] = INGEST_RETRY_AFTER
+        return response
+    return JsonResponse(summary, status=_ingest_status(summary))
+
+
+class LocationDetailView(FieldsetQuerysetMixin, generics.RetrieveUpdateDestroyAPIView):
     serializer_class = LocationSerializer
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        return Location.objects.filter(gps_device__pet__owner=self.request.user)
+        return with_pet_access(Location.objects.all(), self.request.user, OWNER_ROLES, pet='gps_device__pet')
 
     @extend_schema(
         summary="Obtener detalles de ubicación",
@@ -566,10 +781,58 @@ class LostPetsNearbyView(APIView):
                 type=float,
                 default=2
             ),
+            OpenApiParameter(
+                name="zoom",
+                description="Nivel de zoom del mapa. Si se indica, devuelve grupos de mascotas "
+                            "(latitud y longitud del centroide y número de mascotas) en lugar de cada mascota. "
+                            "Salvo en los zooms más bajos requiere bbox",
+                required=False,
+                type=int
+            ),
+            OpenApiParameter(
+                name="bbox",
+                description="Área visible 'oeste,sur,este,norte'. Con zoom limita los grupos; sin zoom devuelve "
+                            "las mascotas perdidas del área en 'results' en lugar de buscar por distancia",
+                required=False,
+                type=str
+            ),
+            OpenApiParameter(
+                name="since",
+                description="Solo con bbox: devuelve únicamente las mascotas perdidas cuyo estado o posición ha "
+                            "cambiado desde esa fecha (usar la cabecera X-Fetched-At de la respuesta anterior); "
+                            "'removed' lista los uuid de las encontradas y de las que han salido del área. Si "
+                            "'truncated' es true, hay que volver a pedir el área sin since",
+                required=False,
+                type=str
+            ),
+            OpenApiParameter(
+                name="limit",
+                description="Solo con bbox: número máximo de mascotas (como mucho LOST_PETS_BBOX_MAX_RESULTS)",
+                required=False,
+                type=int
+            ),
         ],
         responses={200: LostPetSerializer(many=True)}
     )
     def get(self, request, *args, **kwargs):
+        if 'zoom' in request.query_params:
+            try:
+                zoom, bbox = parse_cluster_params(request.query_params['zoom'], request.query_params.get('bbox'))
+            except ValueError as e:
+                raise ValidationError({"error": str(e)})
+            return Response(cluster_lost_pets(zoom, bbox))
+
+        if 'bbox' in request.query_params:
+            params = request.query_params
+            try:
+                bbox, since, limit = parse_viewport_params(params['bbox'], params.get('since'), params.get('limit'))
+            except ValueError as e:
+                raise ValidationError({"error": str(e)})
+            fetched_at = now()
+            pets, removed, truncated = lost_pets_in_bbox(bbox, since, limit)
+            return Response({'results': LostPetSerializer(pets, many=True).data, 'removed': removed,
+                             'truncated': truncated}, headers={'X-Fetched-At': fetched_at.isoformat()})
+
         latitude = float(request.query_params.get('latitude'))
         longitude = float(request.query_params.get('longitude'))
         distance = float(request.query_params.get('distance'))
@@ -577,20 +840,37 @@ class LostPetsNearbyView(APIView):
         # Crear el punto de ubicación del usuario
         user_location = Point(longitude, latitude, srid=4326)
 
-        # Filtrar mascotas perdidas dentro de la distancia especificada
-        lost_pets = Pet.objects.filter(
-            is_lost=True,
-            gps_device__isnull=False,  # Solo mascotas con GPS
-            gps_device__locations__location__distance_lte=(user_location, D(km=distance))
-        ).annotate(
-            distance=Distance('gps_device__locations__location', user_location)
-        ).select_related('owner', 'gps_device').prefetch_related('gps_device__locations').order_by('distance')
-        # Serializar los resultados
-        serializer = LostPetSerializer(lost_pets, many=True)
-        return Response(serializer.data)
+        # Mascotas perdidas dentro de la distancia especificada, serializadas y cacheadas por celda
+        data = cached_lost_pets('api', user_location, distance, self._serialize_lost_pets)
+        return Response(data)
 
+    @staticmethod
+    def _serialize_lost_pets(user_location, distance):
+        return LostPetSerializer(find_lost_pets(user_location, distance), many=True).data
+
+
+@require_GET
+def lost_pets_tile_view(request, z, x, y):
+    """
+    Tesela vectorial (MVT) con las mascotas perdidas de la tesela ``z/x/y``.
 
-class VeterinarianListCreateView(generics.ListCreateAPIView):
+    Responde 304 si el cliente ya tiene la versión actual (``If-None-Match``);
+    la versión solo cambia cuando cambia una mascota perdida de la zona.
+    """
+    if z > settings.LOST_PETS_TILE_MAX_ZOOM or x >= 2 ** z or y >= 2 ** z:
+        raise Http404("Tesela fuera de rango.")
+    version = tile_version(z, x, y)
+    etag = f'"{version}"'
+    if etag in request.headers.get('If-None-Match', ''):
+        response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+    else:
+        response = HttpResponse(tile_cache.get(z, x, y, version), content_type=MVT_CONTENT_TYPE)
+    response['ETag'] = etag
+    response['Cache-Control'] = f'public, max-age={settings.LOST_PETS_TILE_MAX_AGE}'
+    return response
+
+
+class VeterinarianListCreateView(FieldsetQuerysetMixin, generics.ListCreateAPIView):
     queryset = Veterinarian.objects.all()
     serializer_class = VeterinarianSerializer
     permission_classes = [IsAdminUser]  # Solo el admin puede ver y registrar veterinarios
@@ -613,7 +893,7 @@ class VeterinarianListCreateView(generics.ListCreateAPIView):
         return super().post(request, *args, **kwargs)
 
 
-class VeterinarianDetailView(generics.RetrieveUpdateDestroyAPIView):
+class VeterinarianDetailView(FieldsetQuerysetMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = Veterinarian.objects.all()
     serializer_class = VeterinarianSerializer
     permission_classes = [IsAdminUser]
@@ -647,18 +927,15 @@ class VeterinarianDetailView(generics.RetrieveUpdateDestroyAPIView):
 class MedicalRecordListCreateView(APIView):
     permission_classes = [IsAuthenticated]
 
+    def get_pet(self, roles):
+        pet = get_object_or_404(Pet, uuid=self.kwargs.get('pet_id'))
+        if not has_pet_access(self.request.user, pet, roles):
+            raise PermissionDenied("No tienes permiso sobre el historial médico de esta mascota.")
+        return pet
+
     def get_queryset(self):
-        pet_id = self.kwargs.get('pet_id')
-        pet = get_object_or_404(Pet, uuid=pet_id)
-        
-        # Verificar permisos
-        if not (pet.owner == self.request.user or 
-                pet.shared_with.filter(id=self.request.user.id).exists() or
-                (hasattr(self.request.user, 'veterinarian_profile') and 
-                 pet.veterinarian_set.filter(user=self.request.user).exists())):
-            raise PermissionDenied("No tienes permiso para ver este historial médico.")
-            
-        return MedicalRecord.objects.filter(pet=pet)
+        # Dueño, usuarios con los que se comparte y su veterinario
+        return MedicalRecord.objects.filter(pet=self.get_pet(ALL_ROLES))
 
     @extend_schema(
         summary="Listar historial médico de una mascota",
@@ -666,24 +943,21 @@ class MedicalRecordListCreateView(APIView):
         responses={200: MedicalRecordSerializer(many=True)}
     )
     def get(self, request, pet_id):
-        pet = Pet.objects.get(uuid=pet_id)
-        if pet.owner != request.user and not pet.shared_with.filter(id=request.user.id).exists():
-            raise PermissionDenied("No tienes permiso para ver este historial.")
         medical_records = self.get_queryset()
         serializer = MedicalRecordSerializer(medical_records, many=True)
         return Response(serializer.data)
 
     @extend_schema(
         summary="Crear un registro médico",
-        description="Permite a un veterinario añadir información médica a una mascota.",
+        description="Permite al veterinario de la mascota añadir información médica.",
         request=MedicalRecordSerializer,
         responses={201: MedicalRecordSerializer}
     )
     def post(self, request, pet_id):
-        pet = Pet.objects.get(uuid=pet_id)
         if not hasattr(request.user, 'veterinarian_profile'):
             return Response({"error": "Solo los veterinarios pueden añadir registros médicos."},
                             status=status.HTTP_403_FORBIDDEN)
+        pet = self.get_pet(VETERINARIAN_ROLES)
         data = request.data.copy()
         data['pet'] = pet.id
         data['veterinarian'] = request.user.veterinarian_profile.id
@@ -694,22 +968,15 @@ class MedicalRecordListCreateView(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class MedicalRecordDetailView(generics.RetrieveAPIView):
+class MedicalRecordDetailView(FieldsetQuerysetMixin, generics.RetrieveAPIView):
     serializer_class = MedicalRecordSerializer
     permission_classes = [IsAuthenticated]
+    lookup_field = 'uuid'
+    lookup_url_kwarg = 'record_id'
 
     def get_queryset(self):
-        record_id = self.kwargs.get('record_id')
-        record = get_object_or_404(MedicalRecord, id=record_id)
-        
-        # Verificar permisos
-        if not (record.pet.owner == self.request.user or 
-                record.pet.shared_with.filter(id=self.request.user.id).exists() or
-                (hasattr(self.request.user, 'veterinarian_profile') and 
-                 record.pet.veterinarian_set.filter(user=self.request.user).exists())):
-            raise PermissionDenied("No tienes permiso para ver este registro médico.")
-            
-        return MedicalRecord.objects.filter(id=record_id)
+        # Solo los registros de mascotas que ve el usuario (dueño, compartida o su veterinario)
+        return with_pet_access(MedicalRecord.objects.all(), self.request.user, pet='pet')
 
     @extend_schema(
         summary="Obtener un registro médico",
@@ -720,7 +987,7 @@ class MedicalRecordDetailView(generics.RetrieveAPIView):
         return super().get(request, *args, **kwargs)
 
 
-class GPSDeviceListCreateView(generics.ListCreateAPIView):
+class GPSDeviceListCreateView(FieldsetQuerysetMixin, generics.ListCreateAPIView):
     queryset = GPSDevice.objects.all()
     serializer_class = GPSDeviceSerializer
     permission_classes = [IsAuthenticated]
@@ -744,7 +1011,7 @@ class GPSDeviceListCreateView(generics.ListCreateAPIView):
         return super().post(request, *args, **kwargs)
 
 
-class GPSDeviceDetailView(generics.RetrieveUpdateDestroyAPIView):
+class GPSDeviceDetailView(FieldsetQuerysetMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = GPSDevice.objects.all()
     serializer_class = GPSDeviceSerializer
     permission_classes = [IsAuthenticated]
@@ -788,7 +1055,7 @@ class AssociateGPSDeviceView(APIView):
     def post(self, request, pet_id):
         # Obtenemos la mascota a través del pet_id y validamos que el usuario sea el dueño
         try:
-            pet = Pet.objects.get(uuid=pet_id, owner=request.user)
+            pet = accessible_pets(request.user, OWNER_ROLES).get(uuid=pet_id)
         except Exception as e:
             return Response({"detail": "Pet not found. " + str(e)}, status=status.HTTP_404_NOT_FOUND)
 
@@ -811,6 +1078,19 @@ class AssociateGPSDeviceView(APIView):
         return Response(serializer.data, status=status.HTTP_200_OK)
 
 
+class MetricsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    @extend_schema(
+        tags=['admin'],
+        summary="Métricas internas del worker",
+        description="Devuelve los contadores, tiempos y gauges del proceso que atiende la petición.",
+        responses={200: {"pid": 1, "counters": {}, "timings": {}, "gauges": {}}}
+    )
+    def get(self, request):
+        return Response({"pid": os.getpid(), **metrics.snapshot()})
+
+
 # Para los endpoints de JWT Token
 class CustomTokenObtainPairView(TokenObtainPairView):
     @extend_schema(
@@ -835,15 +1115,17 @@ class CustomTokenRefreshView(TokenRefreshView):
     @extend_schema(
         tags=['auth'],
         summary="Refrescar token JWT",
-        description="Obtiene un nuevo token de acceso usando un token de actualización válido.",
+        description="Obtiene un nuevo token de acceso y un nuevo token de actualización usando un token de "
+                    "actualización válido. El token usado queda revocado.",
         responses={
             200: {
                 "type": "object",
                 "properties": {
-                    "access": {"type": "string", "description": "Nuevo token de acceso JWT"}
+                    "access": {"type": "string", "description": "Nuevo token de acceso JWT"},
+                    "refresh": {"type": "string", "description": "Nuevo token de actualización JWT"}
                 }
             },
-            401: {"description": "Token de actualización inválido o expirado"}
+            401: {"description": "Token de actualización inválido, expirado o ya usado"}
         }
     )
     def post(self, request, *args, **kwargs):
@@ -0,0 +1,78 @@
+"""
+Autorización por mascota con la tabla ``PetAccess``.
+
+Cada fila dice que un usuario ve una mascota como dueño, como usuario con el que
+se comparte o como su veterinario. Las señales de ``beDoggo.signals`` la mantienen
+al crear o cambiar la mascota (``owner``, ``veterinarian``), al cambiar
+``shared_with`` (también al usar un ``AccessCode``) y al cambiar el usuario de un
+veterinario. Las vistas solo autorizan con ``accessible_pets``/``has_pet_access``:
+un ``EXISTS`` sobre el índice ``(user, pet, role)`` en lugar de unir el M2M y el
+veterinario con ``DISTINCT``.
+"""
+from django.db.models import Exists, OuterRef
+
+from .models import Pet, PetAccess
+
+Role = PetAccess.RoleChoices
+ALL_ROLES = tuple(Role)
+OWNER_ROLES = (Role.OWNER,)
+SHARED_ROLES = (Role.SHARED,)
+VETERINARIAN_ROLES = (Role.VETERINARIAN,)
+# Quien tiene la mascota en la app (listado, localizaciones); el veterinario la consulta por su ficha
+MEMBER_ROLES = (Role.OWNER, Role.SHARED)
+
+
+def _access(user, roles):
+    return PetAccess.objects.filter(user=user, role__in=roles)
+
+
+def with_pet_access(queryset, user, roles=ALL_ROLES, pet='pk'):
+    """Filas de ``queryset`` cuya mascota (``pet``: ruta hasta su pk) ve ``user`` con alguno de ``roles``."""
+    return queryset.filter(Exists(_access(user, roles).filter(pet=OuterRef(pet))))
+
+
+def accessible_pets(user, roles=ALL_ROLES):
+    return with_pet_access(Pet.objects.all(), user, roles)
+
+
+def has_pet_access(user, pet, roles=ALL_ROLES):
+    """Si ``user`` ve la mascota ``pet`` (instancia o pk) con alguno de ``roles``."""
+    return _access(user, roles).filter(pet=pet).exists()
+
+
+def sync_pet_access(pet, owner_changed=True, veterinarian_changed=True):
+    """Reescribe las filas de dueño y/o veterinario de ``pet`` según sus campos actuales."""
+    wanted = {}
+    if owner_changed:
+        wanted[Role.OWNER] = pet.owner_id
+    if veterinarian_changed:
+        wanted[Role.VETERINARIAN] = pet.veterinarian.user_id if pet.veterinarian_id else None
+    if not wanted:
+        return
+    PetAccess.objects.filter(pet=pet, role__in=list(wanted)).delete()
+    PetAccess.objects.bulk_create([PetAccess(user_id=user_id, pet=pet, role=role)
+                                   for role, user_id in wanted.items() if user_id is not None],
+                                  ignore_conflicts=True)
+
+
+def sync_veterinarian_access(veterinarian):
+    """Mueve las filas de veterinario de sus mascotas al usuario actual de ``veterinarian``."""
+    pet_ids = list(veterinarian.pets.values_list('pk', flat=True))
+    PetAccess.objects.filter(pet_id__in=pet_ids, role=Role.VETERINARIAN).delete()
+    PetAccess.objects.bulk_create([PetAccess(user_id=veterinarian.user_id, pet_id=pet_id, role=Role.VETERINARIAN)
+                                   for pet_id in pet_ids], ignore_conflicts=True)
+
+
+def grant_shared_access(pet_ids, user_ids):
+    PetAccess.objects.bulk_create([PetAccess(user_id=user_id, pet_id=pet_id, role=Role.SHARED)
+                                   for pet_id in pet_ids for user_id in user_ids], ignore_conflicts=True)
+
+
+def revoke_shared_access(pet_ids=None, user_ids=None):
+    """Quita el rol compartido de esas mascotas y/o usuarios (``None`` es sin filtro)."""
+    access = PetAccess.objects.filter(role=Role.SHARED)
+    if pet_ids is not None:
+        access = access.filter(pet_id__in=pet_ids)
+    if user_ids is not None:
+        access = access.filter(user_id__in=user_ids)
+    access.delete()
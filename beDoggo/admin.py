@@ -59,6 +59,7 @@ admin.site.register(Veterinarian, VeterinarianAdmin)
 class GPSDeviceAdmin(admin.ModelAdmin):
     list_display = ('code', 'is_active', 'activated_at', 'created_at', 'updated_at')
     search_fields = ('code',)
+    readonly_fields = ('ingest_key',)
     ordering = ('created_at',)
 
 
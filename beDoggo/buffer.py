@@ -0,0 +1,128 @@
+"""
+Escritura diferida de localizaciones con commits agrupados.
+
+Con ``LOCATION_INGEST_MODE = 'buffered'`` los fixes aceptados se encolan en
+memoria y un hilo en segundo plano los vuelca a la base de datos en bloques,
+cuando se alcanza ``flush_size`` o pasa ``flush_interval``. Si la cola está
+llena se rechaza la petición (503) en lugar de bloquear al worker.
+"""
+import atexit
+import logging
+import os
+import signal
+import threading
+import time
+
+from django.db import close_old_connections
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class BufferFull(Exception):
+    """La cola de escritura no admite más fixes en este momento."""
+
+
+class LocationWriteBuffer:
+
+    def __init__(self, writer, max_size, flush_size, flush_interval, drain_timeout=10):
+        self.writer = writer
+        self.max_size = max_size
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.drain_timeout = drain_timeout
+        self._items = []
+        # Reentrante: el manejador de SIGTERM se ejecuta en el hilo principal y puede interrumpir un `put`
+        self._cond = threading.Condition(threading.RLock())
+        self._thread = None
+        self._stopping = False
+        metrics.register_gauge('location_buffer.depth', lambda: len(self._items))
+
+    def put(self, locations):
+        """Encola los fixes de una petición completa o ninguno (lanza ``BufferFull``)."""
+        self._ensure_started()
+        with self._cond:
+            if self._stopping or len(self._items) + len(locations) > self.max_size:
+                metrics.incr('location_buffer.rejected', len(locations))
+                raise BufferFull()
+            self._items.extend(locations)
+            if len(self._items) >= self.flush_size:
+                self._cond.notify()
+        metrics.incr('location_buffer.enqueued', len(locations))
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='location-buffer-writer', daemon=True)
+            self._thread.start()
+            atexit.register(self.drain)
+            self._install_sigterm_handler()
+
+    def _install_sigterm_handler(self):
+        # Solo se puede instalar desde el hilo principal; en otro caso queda el `atexit`
+        if threading.current_thread() is not threading.main_thread():
+            return
+        previous = signal.getsignal(signal.SIGTERM)
+
+        def handle_sigterm(signum, frame):
+            self.drain()
+            if callable(previous):
+                previous(signum, frame)
+            else:
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                os.kill(os.getpid(), signal.SIGTERM)
+
+        signal.signal(signal.SIGTERM, handle_sigterm)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._stopping or len(self._items) >= self.flush_size,
+                                    timeout=self.flush_interval)
+                batch, self._items = self._items, []
+                stopping = self._stopping
+            if batch:
+                self._flush(batch)
+            if stopping:
+                with self._cond:
+                    if not self._items:
+                        return
+
+    def _flush(self, batch):
+        close_old_connections()
+        started = time.monotonic()
+        try:
+            self.writer(batch)
+        except Exception:
+            logger.exception("Error al volcar %d localizaciones del buffer", len(batch))
+            metrics.incr('location_buffer.flush_errors')
+            self._requeue(batch)
+            time.sleep(self.flush_interval)
+            return
+        metrics.observe('location_buffer.flush_seconds', time.monotonic() - started)
+        metrics.incr('location_buffer.written', len(batch))
+
+    def _requeue(self, batch):
+        with self._cond:
+            room = self.max_size - len(self._items)
+            if room < len(batch):
+                logger.error("Buffer de localizaciones lleno: se descartan %d fixes", len(batch) - room)
+                metrics.incr('location_buffer.dropped', len(batch) - room)
+            self._items[:0] = batch[:max(room, 0)]
+
+    def drain(self):
+        """Detiene el hilo escritor tras volcar todo lo pendiente (apagado ordenado)."""
+        with self._cond:
+            if self._thread is None or self._stopping:
+                return
+            self._stopping = True
+            self._cond.notify_all()
+        self._thread.join(self.drain_timeout)
+        with self._cond:
+            pending = len(self._items)
+        if pending:
+            logger.error("Apagado con %d localizaciones sin volcar", pending)
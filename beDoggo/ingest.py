@@ -0,0 +1,354 @@
+"""
+Ingesta de posiciones (fixes) enviadas por los dispositivos GPS.
+
+Todos los caminos de entrada de localizaciones (alta individual, lotes, ...)
+pasan por aquí para compartir la validación y la escritura en ``Location``.
+"""
+import hmac
+import logging
+import threading
+import time
+from datetime import timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.contrib.gis.geos import Point
+from django.db import InterfaceError, OperationalError, connection, transaction
+from django.utils.dateparse import parse_datetime
+from django.utils.timezone import is_naive, make_aware, now
+
+from . import metrics
+from .buffer import LocationWriteBuffer
+from .lost_pets import invalidate_lost_pets_cache
+from .models import GPSDevice, LatestLocation, Location, Pet
+from .spool import LocationSpool
+
+logger = logging.getLogger(__name__)
+
+# Tolerancia para fixes con la hora del dispositivo ligeramente adelantada
+MAX_CLOCK_SKEW = timedelta(minutes=5)
+
+
+def _parse_coordinate(value, minimum, maximum):
+    if isinstance(value, bool):
+        return None
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    if not minimum <= value <= maximum:
+        return None
+    return value
+
+
+def validate_fix(item, require_device_code=True):
+    """
+    Valida un fix individual sin pasar por un serializer de DRF.
+
+    Devuelve una tupla ``(fix, errores)``; ``fix`` es un diccionario con
+    ``gps_device_code``, ``latitude``, ``longitude`` y ``timestamp`` (o None).
+    """
+    if not isinstance(item, dict):
+        return None, {"non_field_errors": ["Se esperaba un objeto con latitude y longitude."]}
+
+    errors = {}
+    code = item.get('gps_device_code')
+    if require_device_code and (not isinstance(code, str) or not code.strip()):
+        errors['gps_device_code'] = ["Este campo es obligatorio."]
+
+    latitude = _parse_coordinate(item.get('latitude'), -90, 90)
+    if latitude is None:
+        errors['latitude'] = ["Latitud inválida. Debe estar entre -90 y 90."]
+    longitude = _parse_coordinate(item.get('longitude'), -180, 180)
+    if longitude is None:
+        errors['longitude'] = ["Longitud inválida. Debe estar entre -180 y 180."]
+
+    timestamp = item.get('timestamp')
+    if timestamp not in (None, ''):
+        timestamp = parse_datetime(timestamp) if isinstance(timestamp, str) else None
+        if timestamp is None:
+            errors['timestamp'] = ["Formato de fecha inválido. Use ISO 8601."]
+        else:
+            if is_naive(timestamp):
+                timestamp = make_aware(timestamp, timezone=dt_timezone.utc)
+            if timestamp > now() + MAX_CLOCK_SKEW:
+                errors['timestamp'] = ["La fecha no puede estar en el futuro."]
+    else:
+        timestamp = None
+
+    if errors:
+        return None, errors
+    return {
+        'gps_device_code': code.strip() if isinstance(code, str) else None,
+        'latitude': latitude,
+        'longitude': longitude,
+        'timestamp': timestamp,
+    }, None
+
+
+def resolve_devices(codes):
+    """Resuelve un conjunto de códigos de dispositivo con una sola consulta: ``{code: device_id}``."""
+    codes = set(codes)
+    if not codes:
+        return {}
+    return dict(GPSDevice.objects.filter(code__in=codes).values_list('code', 'id'))
+
+
+def build_location(device_id, fix):
+    location = Location(
+        gps_device_id=device_id,
+        location=Point(fix['longitude'], fix['latitude'], srid=4326),
+    )
+    if fix.get('timestamp'):
+        location.timestamp = fix['timestamp']
+    return location
+
+
+def write_locations(locations, ignore_conflicts=False, statement_timeout=None):
+    """
+    Inserta las localizaciones con un único INSERT por lote.
+
+    ``ignore_conflicts`` descarta los fixes cuyo ``uuid`` ya existe (reinyección
+    idempotente del spool) y ``statement_timeout`` (ms) limita la espera a la
+    base de datos.
+    """
+    if not locations:
+        return []
+    with transaction.atomic():
+        if statement_timeout:
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL statement_timeout = %s", [statement_timeout])
+        Location.objects.bulk_create(locations, batch_size=settings.LOCATION_BULK_INSERT_BATCH_SIZE,
+                                     ignore_conflicts=ignore_conflicts)
+        moved = upsert_latest_locations(locations)
+        if moved:
+            transaction.on_commit(lambda: invalidate_lost_pets_cache(moved))
+    return locations
+
+
+def upsert_latest_locations(locations):
+    """
+    Actualiza ``LatestLocation`` con el fix más reciente de cada dispositivo del lote.
+
+    Un único ``INSERT ... ON CONFLICT`` que solo sobrescribe si el fix es más
+    nuevo que el guardado, ya que los dispositivos pueden enviar fixes atrasados.
+    Devuelve las posiciones ``(latitud, longitud)`` anterior y nueva de las
+    mascotas perdidas que se han movido, para invalidar la caché de búsquedas.
+    """
+    latest = {}
+    for location in locations:
+        current = latest.get(location.gps_device_id)
+        if location.gps_device_id and (current is None or location.timestamp > current.timestamp):
+            latest[location.gps_device_id] = location
+    if not latest:
+        return []
+
+    qn = connection.ops.quote_name
+    table = qn(LatestLocation._meta.db_table)
+    params = list(latest)
+    for device_id, location in latest.items():
+        params.extend([device_id, bytes(location.location.ewkb), location.timestamp])
+    with connection.cursor() as cursor:
+        # La CTE `previous` ve la tabla antes del upsert: una sola sentencia devuelve ambas posiciones
+        cursor.execute(
+            f'WITH previous AS ('
+            f'SELECT "gps_device_id", ST_Y("location"::geometry) AS latitude, ST_X("location"::geometry) AS longitude '
+            f'FROM {table} WHERE "gps_device_id" IN ({", ".join(["%s"] * len(latest))})'
+            f'), upserted AS ('
+            f'INSERT INTO {table} ("gps_device_id", "location", "timestamp", "updated_at") '
+            f'VALUES {", ".join(["(%s, ST_GeomFromEWKB(%s)::geography, %s, now())"] * len(latest))} '
+            f'ON CONFLICT ("gps_device_id") DO UPDATE SET "location" = EXCLUDED."location", '
+            f'"timestamp" = EXCLUDED."timestamp", "updated_at" = EXCLUDED."updated_at" '
+            f'WHERE {table}."timestamp" <= EXCLUDED."timestamp" '
+            f'RETURNING "gps_device_id", ST_Y("location"::geometry) AS latitude, ST_X("location"::geometry) AS longitude'
+            f') SELECT upserted.latitude, upserted.longitude, previous.latitude, previous.longitude '
+            f'FROM upserted JOIN {qn(Pet._meta.db_table)} pet '
+            f'ON pet."gps_device_id" = upserted."gps_device_id" AND pet."is_lost" '
+            f'LEFT JOIN previous ON previous."gps_device_id" = upserted."gps_device_id"',
+            params,
+        )
+        rows = cursor.fetchall()
+    moved = []
+    for latitude, longitude, previous_latitude, previous_longitude in rows:
+        moved.append((latitude, longitude))
+        if previous_latitude is not None:
+            moved.append((previous_latitude, previous_longitude))
+    return moved
+
+
+location_spool = LocationSpool(
+    directory=settings.LOCATION_SPOOL_DIR,
+    segment_max_bytes=settings.LOCATION_SPOOL_SEGMENT_MAX_BYTES,
+    segment_max_age=settings.LOCATION_SPOOL_SEGMENT_MAX_AGE,
+    fsync_interval=settings.LOCATION_SPOOL_FSYNC_INTERVAL,
+    fsync_batch=settings.LOCATION_SPOOL_FSYNC_BATCH,
+)
+
+# Mientras la base de datos se considera caída, los fixes van directamente al spool hasta esta marca
+_database_retry_at = 0
+
+
+def persist_locations(locations):
+    """
+    Escribe los fixes en la base de datos o, si el spool está activado y la base
+    de datos falla o tarda más de ``LOCATION_WRITE_TIMEOUT_MS``, en el spool.
+
+    Tras un fallo se deja de intentar la escritura en base de datos durante
+    ``LOCATION_DATABASE_RETRY_INTERVAL`` segundos para no acumular esperas.
+    """
+    global _database_retry_at
+    if not settings.LOCATION_SPOOL_ENABLED:
+        return write_locations(locations)
+
+    if time.monotonic() < _database_retry_at:
+        location_spool.append(locations)
+        return locations
+    try:
+        write_locations(locations, statement_timeout=settings.LOCATION_WRITE_TIMEOUT_MS)
+    except (OperationalError, InterfaceError):
+        logger.warning("Base de datos no disponible; %d fixes van al spool", len(locations), exc_info=True)
+        metrics.incr('location_spool.database_failures')
+        _database_retry_at = time.monotonic() + settings.LOCATION_DATABASE_RETRY_INTERVAL
+        location_spool.append(locations)
+        return locations
+    if _database_retry_at:
+        # La base de datos vuelve a responder: el segmento en curso ya se puede drenar
+        _database_retry_at = 0
+        location_spool.seal()
+    return locations
+
+
+location_buffer = LocationWriteBuffer(
+    writer=persist_locations,
+    max_size=settings.LOCATION_BUFFER_MAX_SIZE,
+    flush_size=settings.LOCATION_BUFFER_FLUSH_SIZE,
+    flush_interval=settings.LOCATION_BUFFER_FLUSH_INTERVAL,
+)
+
+
+def is_buffered():
+    return settings.LOCATION_INGEST_MODE == 'buffered'
+
+
+def store_locations(locations):
+    """
+    Guarda los fixes según ``LOCATION_INGEST_MODE``: en línea (``sync``) o
+    encolándolos para el escritor en segundo plano (``buffered``). En ambos
+    casos se usa ``persist_locations``, con su respaldo en el spool.
+
+    En modo ``buffered`` lanza ``BufferFull`` si la cola no admite más fixes.
+    """
+    if is_buffered():
+        location_buffer.put(locations)
+    else:
+        persist_locations(locations)
+    return locations
+
+
+def _validate_all(items, require_device_code=True):
+    results = [None] * len(items)
+    valid = []
+    for index, item in enumerate(items):
+        fix, errors = validate_fix(item, require_device_code=require_device_code)
+        if errors:
+            results[index] = {"index": index, "status": "rejected", "errors": errors}
+        else:
+            valid.append((index, fix))
+    return results, valid
+
+
+def _store(results, pending):
+    store_locations([location for _, location in pending])
+    for index, location in pending:
+        results[index] = {"index": index, "status": "accepted", "uuid": str(location.uuid)}
+    return results
+
+
+def ingest_fixes(items):
+    """
+    Valida y guarda una lista de fixes de uno o varios dispositivos.
+
+    Cada código de dispositivo se resuelve una única vez y todos los fixes
+    válidos se escriben juntos. Devuelve un resultado por elemento, en el
+    mismo orden de entrada.
+    """
+    results, valid = _validate_all(items)
+
+    devices = resolve_devices(fix['gps_device_code'] for _, fix in valid)
+
+    pending = []
+    for index, fix in valid:
+        device_id = devices.get(fix['gps_device_code'])
+        if device_id is None:
+            results[index] = {"index": index, "status": "rejected",
+                              "errors": {"gps_device_code": ["El dispositivo GPS no existe."]}}
+            continue
+        pending.append((index, build_location(device_id, fix)))
+
+    return _store(results, pending)
+
+
+def ingest_device_fixes(device_id, items):
+    """Igual que ``ingest_fixes`` para fixes de un dispositivo ya autenticado (sin ``gps_device_code``)."""
+    results, valid = _validate_all(items, require_device_code=False)
+    return _store(results, [(index, build_location(device_id, fix)) for index, fix in valid])
+
+
+def summarize_results(results):
+    accepted = sum(1 for result in results if result['status'] == 'accepted')
+    return {"accepted": accepted, "rejected": len(results) - accepted, "results": results}
+
+
+class DeviceCredentialCache:
+    """
+    Caché en proceso de las credenciales de ingesta de los dispositivos activos.
+
+    Permite autenticar a los dispositivos sin consultar la base de datos en cada
+    petición. Se recarga completa cada ``ttl`` segundos (para ver los cambios
+    hechos desde otros procesos) y se invalida con las señales de ``GPSDevice``.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._devices = None
+        self._loaded_at = 0
+        self._lock = threading.Lock()
+
+    def _get_devices(self):
+        devices = self._devices
+        if devices is None or time.monotonic() - self._loaded_at > self.ttl:
+            with self._lock:
+                if self._devices is None or time.monotonic() - self._loaded_at > self.ttl:
+                    self._devices = {
+                        code: (device_id, ingest_key)
+                        for device_id, code, ingest_key in GPSDevice.objects.filter(is_active=True)
+                        .exclude(ingest_key='').values_list('id', 'code', 'ingest_key')
+                    }
+                    self._loaded_at = time.monotonic()
+                devices = self._devices
+        return devices
+
+    def authenticate(self, code, ingest_key):
+        """Devuelve el id del dispositivo si las credenciales son válidas, o None."""
+        entry = self._get_devices().get(code)
+        if entry is None or not hmac.compare_digest(entry[1].encode(), ingest_key.encode()):
+            return None
+        return entry[0]
+
+    def invalidate(self):
+        self._devices = None
+
+
+device_credentials = DeviceCredentialCache(ttl=settings.DEVICE_CREDENTIALS_CACHE_TTL)
+
+
+def authenticate_device(authorization):
+    """
+    Autentica la cabecera ``Authorization: Device <code>:<ingest_key>``.
+
+    Devuelve el id del ``GPSDevice`` o None si las credenciales no son válidas.
+    """
+    scheme, _, credentials = (authorization or '').partition(' ')
+    code, _, ingest_key = credentials.strip().partition(':')
+    if scheme != 'Device' or not code or not ingest_key:
+        return None
+    return device_credentials.authenticate(code, ingest_key)
@@ -0,0 +1,500 @@
+"""
+Búsqueda de mascotas perdidas cercanas a un punto.
+
+La posición de cada mascota es la de ``LatestLocation`` (una fila por
+dispositivo), guardada como ``geography``: el filtro es un ``ST_DWithin`` en
+metros que usa el índice GiST y el orden es KNN (``<->``), así que cada mascota
+aparece una sola vez y la consulta no recorre el histórico de localizaciones.
+
+Como el endpoint es público y lo consulta cualquier visitante del mapa, por
+defecto se responde desde ``LostPetIndex``: una rejilla en memoria con las
+mascotas perdidas y su última posición. Cada proceso la carga una vez y después
+solo lee de la base de datos lo que ha cambiado (señales de ``Pet`` y un sondeo
+periódico de ``updated_at``), con una recarga completa cada cierto tiempo para
+recoger borrados y cambios que no actualizan ``updated_at``.
+"""
+import math
+import threading
+import time
+from collections import defaultdict
+from datetime import timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.contrib.gis.db.models import PointField
+from django.contrib.gis.db.models.functions import Distance, GeometryDistance
+from django.contrib.gis.geos import Point, Polygon
+from django.contrib.gis.measure import D
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Q, Value
+from django.utils.dateparse import parse_datetime
+from django.utils.timezone import is_naive, make_aware, now
+
+from . import metrics
+from .models import LatestLocation, Pet
+
+LATEST_POSITION = 'gps_device__latest_location__location'
+EARTH_RADIUS_M = 6371008.8
+KM_PER_DEGREE = 111.32
+# Margen del sondeo incremental para no perder transacciones que confirman tarde
+POLL_OVERLAP = timedelta(seconds=5)
+
+
+def lost_pets_nearby(point, distance_km):
+    """Mascotas perdidas a menos de ``distance_km`` de ``point``, de la más cercana a la más lejana."""
+    origin = Value(point, output_field=PointField(geography=True))
+    return Pet.objects.filter(
+        is_lost=True,
+        **{f'{LATEST_POSITION}__dwithin': (point, D(km=distance_km))},
+    ).annotate(
+        distance=Distance(LATEST_POSITION, origin)
+    ).select_related(
+        'owner', 'veterinarian', 'gps_device__latest_location'
+    ).order_by(GeometryDistance(LATEST_POSITION, origin))
+
+
+def lost_pets_nearby_legacy(point, distance_km):
+    """Consulta anterior sobre todo el histórico (solo para comparar planes en ``benchmark_lost_pets_query``)."""
+    return Pet.objects.filter(
+        is_lost=True,
+        gps_device__isnull=False,
+        gps_device__locations__location__distance_lte=(point, D(km=distance_km))
+    ).annotate(
+        distance=Distance('gps_device__locations__location', point)
+    ).select_related('owner', 'gps_device').order_by('distance')
+
+
+def find_lost_pets(point, distance_km):
+    """Punto de entrada de las vistas: índice en memoria si está activo, PostGIS en otro caso."""
+    if settings.LOST_PETS_INDEX_ENABLED:
+        return lost_pet_index.nearby(point.y, point.x, distance_km)
+    return lost_pets_nearby(point, distance_km)
+
+
+def haversine(latitude1, longitude1, latitude2, longitude2):
+    """Distancia en metros sobre la esfera entre dos puntos en grados."""
+    phi1, phi2 = math.radians(latitude1), math.radians(latitude2)
+    a = (math.sin((phi2 - phi1) / 2) ** 2
+         + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(longitude2 - longitude1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+
+def _indexable_pets():
+    return Pet.objects.filter(is_lost=True, gps_device__latest_location__isnull=False).select_related(
+        'owner', 'veterinarian', 'gps_device__latest_location')
+
+
+class LostPetIndex:
+
+    def __init__(self, cell_degrees, poll_interval, reload_interval):
+        self.cell_degrees = cell_degrees
+        self.poll_interval = poll_interval
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()  # Protege el contenido del índice
+        self._refresh_lock = threading.Lock()  # Una sola consulta de refresco a la vez
+        self._pets = {}  # pet_id -> (pet, latitud, longitud, celda)
+        self._cells = defaultdict(set)  # celda -> {pet_id}
+        self._dirty = set()
+        self._loaded_at = None
+        self._polled_at = 0
+        self._watermark = None
+        metrics.register_gauge('lost_pet_index.size', lambda: len(self._pets))
+
+    def nearby(self, latitude, longitude, distance_km):
+        """Mascotas perdidas a menos de ``distance_km``, ordenadas por distancia, sin tocar la base de datos."""
+        self._refresh()
+        radius = distance_km * 1000
+        found = []
+        with self._lock:
+            for pet_id in self._candidates(latitude, longitude, distance_km):
+                pet, pet_latitude, pet_longitude, _ = self._pets[pet_id]
+                meters = haversine(latitude, longitude, pet_latitude, pet_longitude)
+                if meters <= radius:
+                    found.append((meters, pet_id, pet))
+        metrics.incr('lost_pet_index.queries')
+        return [pet for _, _, pet in sorted(found, key=lambda item: item[:2])]
+
+    def positions(self):
+        """Posiciones ``(latitud, longitud)`` de todas las mascotas perdidas indexadas."""
+        self._refresh()
+        with self._lock:
+            return [(latitude, longitude) for _, latitude, longitude, _ in self._pets.values()]
+
+    def pet_changed(self, pet_id):
+        """Marca una mascota para releerla en la próxima consulta (alta, baja o cambio de estado)."""
+        with self._lock:
+            self._dirty.add(pet_id)
+
+    def device_removed(self, device_id):
+        """Quita la mascota del dispositivo borrado (``SET_NULL`` no actualiza ``Pet.updated_at``)."""
+        with self._lock:
+            for pet_id, (pet, *_) in list(self._pets.items()):
+                if pet.gps_device_id == device_id:
+                    self._dirty.add(pet_id)
+
+    def reset(self):
+        """Vacía el índice; la próxima consulta lo recarga entero."""
+        with self._lock:
+            self._pets, self._cells, self._dirty = {}, defaultdict(set), set()
+            self._loaded_at = None
+
+    def _cell(self, latitude, longitude):
+        return math.floor(latitude / self.cell_degrees), math.floor(longitude / self.cell_degrees)
+
+    def _candidates(self, latitude, longitude, distance_km):
+        delta_latitude = distance_km / KM_PER_DEGREE
+        delta_longitude = distance_km / (KM_PER_DEGREE * max(math.cos(math.radians(latitude)), 0.01))
+        low = self._cell(latitude - delta_latitude, longitude - delta_longitude)
+        high = self._cell(latitude + delta_latitude, longitude + delta_longitude)
+        if (high[0] - low[0] + 1) * (high[1] - low[1] + 1) > len(self._cells):
+            return list(self._pets)  # Radio enorme: sale más barato recorrer todas las mascotas
+        return [pet_id
+                for row in range(low[0], high[0] + 1)
+                for column in range(low[1], high[1] + 1)
+                for pet_id in self._cells.get((row, column), ())]
+
+    def _refresh(self):
+        if (self._loaded_at is not None and not self._dirty
+                and time.monotonic() - self._polled_at < self.poll_interval):
+            return
+        # Si otro hilo ya está refrescando se sirve lo que hay, salvo que el índice no esté cargado
+        if not self._refresh_lock.acquire(blocking=self._loaded_at is None):
+            return
+        try:
+            started = time.monotonic()
+            if self._loaded_at is None or started - self._loaded_at >= self.reload_interval:
+                self._reload(started)
+            else:
+                self._update(started)
+            metrics.observe('lost_pet_index.refresh_seconds', time.monotonic() - started)
+        finally:
+            self._refresh_lock.release()
+
+    def _reload(self, started):
+        watermark = now() - POLL_OVERLAP
+        pets, cells = {}, defaultdict(set)
+        for pet in _indexable_pets():
+            entry = self._entry(pet)
+            pets[pet.pk] = entry
+            cells[entry[3]].add(pet.pk)
+        with self._lock:
+            self._pets, self._cells, self._dirty = pets, cells, set()
+        self._loaded_at = self._polled_at = started
+        self._watermark = watermark
+        metrics.incr('lost_pet_index.reloads')
+
+    def _update(self, started):
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+        watermark = now() - POLL_OVERLAP
+        changed = Q(pk__in=dirty) if dirty else Q()
+        if started - self._polled_at >= self.poll_interval:
+            changed |= Q(updated_at__gte=self._watermark) | Q(
+                gps_device__latest_location__updated_at__gte=self._watermark)
+            self._polled_at = started
+            self._watermark = watermark
+        if not changed:
+            return
+
+        checked = set(dirty)
+        updated = list(Pet.objects.filter(changed).select_related(
+            'owner', 'veterinarian', 'gps_device__latest_location'))
+        with self._lock:
+            for pet in updated:
+                checked.add(pet.pk)
+                self._remove(pet.pk)
+                latest = getattr(pet.gps_device, 'latest_location', None) if pet.gps_device else None
+                if pet.is_lost and latest is not None:
+                    entry = self._entry(pet)
+                    self._pets[pet.pk] = entry
+                    self._cells[entry[3]].add(pet.pk)
+            # Las mascotas marcadas que ya no existen se han borrado
+            for pet_id in checked - {pet.pk for pet in updated}:
+                self._remove(pet_id)
+        metrics.incr('lost_pet_index.updates', len(updated))
+
+    def _entry(self, pet):
+        position = pet.gps_device.latest_location.location
+        return pet, position.y, position.x, self._cell(position.y, position.x)
+
+    def _remove(self, pet_id):
+        entry = self._pets.pop(pet_id, None)
+        if entry is not None:
+            self._cells[entry[3]].discard(pet_id)
+            if not self._cells[entry[3]]:
+                del self._cells[entry[3]]
+
+
+lost_pet_index = LostPetIndex(
+    cell_degrees=settings.LOST_PETS_INDEX_CELL_DEGREES,
+    poll_interval=settings.LOST_PETS_INDEX_POLL_INTERVAL,
+    reload_interval=settings.LOST_PETS_INDEX_RELOAD_INTERVAL,
+)
+
+
+# --- Caché de respuestas ------------------------------------------------------------------------------------------
+# Las coordenadas de la búsqueda se ajustan al centro de una celda de LOST_PETS_CACHE_CELL_DEGREES y la distancia al
+# múltiplo superior de LOST_PETS_CACHE_DISTANCE_STEP, de modo que los clientes que desplazan el mapa comparten clave.
+# Cada región (celda de LOST_PETS_CACHE_REGION_DEGREES) tiene un número de generación que forma parte de la clave de
+# todas las búsquedas que la cubren; cambiar una mascota perdida de esa región incrementa su generación.
+
+CACHE_PREFIX = 'lost-pets'
+GLOBAL_GENERATION_KEY = f'{CACHE_PREFIX}:gen:global'
+
+
+def snap_search(latitude, longitude, distance_km):
+    """Centro de celda y distancia redondeada que se usan como clave (y para la consulta)."""
+    cell = settings.LOST_PETS_CACHE_CELL_DEGREES
+    step = settings.LOST_PETS_CACHE_DISTANCE_STEP
+    return ((math.floor(latitude / cell) + 0.5) * cell,
+            (math.floor(longitude / cell) + 0.5) * cell,
+            max(math.ceil(distance_km / step), 1) * step)
+
+
+def _region(latitude, longitude):
+    size = settings.LOST_PETS_CACHE_REGION_DEGREES
+    return math.floor(latitude / size), math.floor(longitude / size)
+
+
+def _generation_key(region):
+    return f'{CACHE_PREFIX}:gen:{region[0]}:{region[1]}'
+
+
+def _search_bbox(latitude, longitude, distance_km):
+    delta_latitude = distance_km / KM_PER_DEGREE
+    delta_longitude = distance_km / (KM_PER_DEGREE * max(math.cos(math.radians(latitude)), 0.01))
+    return latitude - delta_latitude, longitude - delta_longitude, latitude + delta_latitude, longitude + delta_longitude
+
+
+def generation_token(south, west, north, east):
+    """
+    Versión de las regiones que cubre el rectángulo: cambia en cuanto se invalida cualquiera de ellas.
+
+    Si son demasiadas se usa la generación global, que se incrementa con cualquier cambio.
+    """
+    low, high = _region(south, west), _region(north, east)
+    if (high[0] - low[0] + 1) * (high[1] - low[1] + 1) > settings.LOST_PETS_CACHE_MAX_REGIONS:
+        return global_generation_token()
+    return _generation_token([_generation_key((row, column))
+                              for row in range(low[0], high[0] + 1) for column in range(low[1], high[1] + 1)])
+
+
+def global_generation_token():
+    """Versión de todo el mapa: cambia con cualquier invalidación."""
+    return _generation_token([GLOBAL_GENERATION_KEY])
+
+
+def _generation_token(keys):
+    generations = cache.get_many(keys)
+    missing = [key for key in keys if key not in generations]
+    if missing:
+        # Una generación nueva no puede coincidir con una anterior que se haya expulsado de la caché
+        for key in missing:
+            cache.add(key, time.time_ns(), timeout=None)
+        generations.update(cache.get_many(missing))
+    return '.'.join(str(generations.get(key, 0)) for key in keys)
+
+
+def search_version(point, distance_km):
+    """
+    Versión de la respuesta de una búsqueda: celda, distancia ajustada y generación de
+    las regiones que cubre. Sirve de clave de caché y de ETag; ``None`` sin caché.
+    """
+    if not settings.LOST_PETS_CACHE_ENABLED:
+        return None
+    latitude, longitude, distance_km = snap_search(point.y, point.x, distance_km)
+    version = generation_token(*_search_bbox(latitude, longitude, distance_km))
+    return f'{latitude:.6f}:{longitude:.6f}:{distance_km:g}:{version}'
+
+
+def cached_lost_pets(view, point, distance_km, build):
+    """
+    Devuelve la respuesta serializada de una búsqueda, calculándola con
+    ``build(punto, distancia_km)`` sobre la búsqueda ajustada si no está en caché.
+    """
+    latitude, longitude, distance_km = snap_search(point.y, point.x, distance_km)
+    snapped = Point(longitude, latitude, srid=4326)
+    if not settings.LOST_PETS_CACHE_ENABLED:
+        return build(snapped, distance_km)
+
+    key = f'{CACHE_PREFIX}:{view}:{search_version(point, distance_km)}'
+    cached = cache.get(key)
+    if cached is not None:
+        created_at, data = cached
+        metrics.incr('lost_pets_cache.hits')
+        metrics.observe('lost_pets_cache.age_seconds', time.time() - created_at)
+        return data
+    metrics.incr('lost_pets_cache.misses')
+    data = build(snapped, distance_km)
+    cache.set(key, (time.time(), data), settings.LOST_PETS_CACHE_TIMEOUT)
+    return data
+
+
+def invalidate_lost_pets_cache(positions):
+    """Invalida las búsquedas cacheadas que cubren alguna de las posiciones ``(latitud, longitud)``."""
+    keys = {_generation_key(_region(latitude, longitude)) for latitude, longitude in positions}
+    for key in keys | {GLOBAL_GENERATION_KEY}:
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, time.time_ns(), timeout=None)
+    metrics.incr('lost_pets_cache.invalidations')
+
+
+def _cache_hit_rate():
+    counters = metrics.snapshot_counters()
+    lookups = counters.get('lost_pets_cache.hits', 0) + counters.get('lost_pets_cache.misses', 0)
+    return counters.get('lost_pets_cache.hits', 0) / lookups if lookups else None
+
+
+metrics.register_gauge('lost_pets_cache.hit_rate', _cache_hit_rate)
+# Cotas de desfase: antigüedad máxima de una entrada y error máximo de posición introducido por el ajuste a celda
+metrics.register_gauge('lost_pets_cache.max_staleness_seconds', lambda: settings.LOST_PETS_CACHE_TIMEOUT)
+metrics.register_gauge('lost_pets_cache.max_snap_error_meters',
+                       lambda: round(settings.LOST_PETS_CACHE_CELL_DEGREES / 2 * math.sqrt(2) * KM_PER_DEGREE * 1000))
+
+
+# --- Agrupación por nivel de zoom ---------------------------------------------------------------------------------
+# Las mascotas se agrupan en celdas de rejilla cuyo lado es una fracción (LOST_PETS_CLUSTER_CELLS_PER_TILE) del ancho
+# de una tesela en ese zoom, así que el número de grupos de una pantalla está acotado aunque haya miles de perdidas.
+# Los grupos de cada zoom se calculan para todo el mapa y se cachean con la generación global; la respuesta se limita
+# a un área de como mucho LOST_PETS_CLUSTER_MAX_CELLS celdas de lado (sin bbox, el mundo entero, solo en zooms bajos).
+
+def cluster_cell_degrees(zoom):
+    return 360 / 2 ** zoom / settings.LOST_PETS_CLUSTER_CELLS_PER_TILE
+
+
+def _clusters_from_positions(positions, cell):
+    groups = defaultdict(lambda: [0, 0.0, 0.0])
+    for latitude, longitude in positions:
+        group = groups[math.floor(latitude / cell), math.floor(longitude / cell)]
+        group[0] += 1
+        group[1] += latitude
+        group[2] += longitude
+    return [(latitude / count, longitude / count, count) for count, latitude, longitude in groups.values()]
+
+
+def _clusters_from_database(cell):
+    qn = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT avg(ST_Y(geom)), avg(ST_X(geom)), count(*) FROM ('
+            f'SELECT latest."location"::geometry AS geom FROM {qn(Pet._meta.db_table)} pet '
+            f'JOIN {qn(LatestLocation._meta.db_table)} latest ON latest."gps_device_id" = pet."gps_device_id" '
+            f'WHERE pet."is_lost") positions '
+            # Las mismas celdas que `_clusters_from_positions` (floor), no el punto de rejilla más cercano
+            f'GROUP BY floor(ST_Y(geom) / %s), floor(ST_X(geom) / %s)', [cell, cell])
+        return [(latitude, longitude, count) for latitude, longitude, count in cursor.fetchall()]
+
+
+def parse_bbox(value):
+    """Convierte "oeste,sur,este,norte" en tupla de floats; lanza ``ValueError`` si no es válido."""
+    try:
+        bbox = tuple(float(coordinate) for coordinate in value.split(','))
+    except ValueError:
+        bbox = ()
+    if len(bbox) != 4 or bbox[0] > bbox[2] or bbox[1] > bbox[3]:
+        raise ValueError("bbox debe ser 'oeste,sur,este,norte'.")
+    return bbox
+
+
+def parse_cluster_params(zoom, bbox):
+    """
+    Valida ``zoom`` y ``bbox`` de la petición; lanza ``ValueError`` si no son válidos o si el
+    área (sin ``bbox``, el mundo) mide más de ``LOST_PETS_CLUSTER_MAX_CELLS`` celdas de lado.
+    """
+    try:
+        zoom = int(zoom)
+    except ValueError:
+        raise ValueError("El zoom debe ser un número entero.")
+    if not 0 <= zoom <= settings.LOST_PETS_TILE_MAX_ZOOM:
+        raise ValueError(f"El zoom debe estar entre 0 y {settings.LOST_PETS_TILE_MAX_ZOOM}.")
+    bbox = parse_bbox(bbox) if bbox else None
+    west, south, east, north = bbox or (-180, -90, 180, 90)
+    if max(east - west, north - south) / cluster_cell_degrees(zoom) > settings.LOST_PETS_CLUSTER_MAX_CELLS:
+        raise ValueError("El área es demasiado grande para este zoom." if bbox
+                         else "Con este zoom hay que indicar el área visible (bbox).")
+    return zoom, bbox
+
+
+def cluster_lost_pets(zoom, bbox=None):
+    """
+    Grupos ``{latitude, longitude, count}`` de mascotas perdidas en el nivel de ``zoom``,
+    limitados a ``bbox = (oeste, sur, este, norte)`` si se indica.
+    """
+    cell = cluster_cell_degrees(zoom)
+    key = f'{CACHE_PREFIX}:clusters:{zoom}:{global_generation_token()}'
+    clusters = cache.get(key) if settings.LOST_PETS_CACHE_ENABLED else None
+    if clusters is None:
+        metrics.incr('lost_pets_clusters.misses')
+        if settings.LOST_PETS_INDEX_ENABLED:
+            clusters = _clusters_from_positions(lost_pet_index.positions(), cell)
+        else:
+            clusters = _clusters_from_database(cell)
+        if settings.LOST_PETS_CACHE_ENABLED:
+            cache.set(key, clusters, settings.LOST_PETS_CACHE_TIMEOUT)
+    else:
+        metrics.incr('lost_pets_clusters.hits')
+
+    if bbox is not None:
+        # Con una celda de margen: el centroide de una celda que asoma al borde puede quedar fuera del área
+        west, south, east, north = bbox
+        clusters = [cluster for cluster in clusters
+                    if south - cell <= cluster[0] <= north + cell and west - cell <= cluster[1] <= east + cell]
+    return [{'latitude': latitude, 'longitude': longitude, 'count': count} for latitude, longitude, count in clusters]
+
+
+# --- Consulta por área visible --------------------------------------------------------------------------------------
+
+def parse_viewport_params(bbox, since=None, limit=None):
+    """
+    Valida ``bbox``, ``since`` (ISO 8601) y ``limit`` de la petición; lanza ``ValueError`` si no son válidos.
+
+    ``limit`` nunca supera ``LOST_PETS_BBOX_MAX_RESULTS``.
+    """
+    bbox = parse_bbox(bbox)
+    if since:
+        parsed = parse_datetime(since)
+        if parsed is None:
+            raise ValueError("since debe ser una fecha ISO 8601.")
+        since = make_aware(parsed, dt_timezone.utc) if is_naive(parsed) else parsed
+    try:
+        limit = int(limit) if limit else settings.LOST_PETS_BBOX_MAX_RESULTS
+    except ValueError:
+        raise ValueError("limit debe ser un número entero.")
+    if limit < 1:
+        raise ValueError("limit debe ser mayor que 0.")
+    return bbox, since or None, min(limit, settings.LOST_PETS_BBOX_MAX_RESULTS)
+
+
+def lost_pets_in_bbox(bbox, since=None, limit=None):
+    """
+    Mascotas perdidas cuya última posición cae en ``bbox`` (operador ``&&``, indexado), en orden estable.
+
+    Devuelve ``(mascotas, retiradas, truncado)``. Con ``since`` las mascotas son solo las perdidas
+    del área cuyo estado o posición ha cambiado después de esa fecha, y ``retiradas`` son los uuid
+    de las que el cliente debe quitar del mapa: las encontradas desde entonces y las perdidas que
+    han salido del área o ya no tienen dispositivo con posición. De las que no están perdidas nunca
+    se devuelve nada más que el uuid. ``truncado`` indica que alguna de las dos listas tenía más de
+    ``limit`` filas; con ``since`` el cliente debe volver a pedir el área entera.
+    """
+    limit = limit or settings.LOST_PETS_BBOX_MAX_RESULTS
+    envelope = Polygon.from_bbox(bbox)
+    envelope.srid = 4326
+    in_bbox = Q(**{f'{LATEST_POSITION}__bboverlaps': envelope})
+    lost = Pet.objects.filter(is_lost=True)
+    removed = []
+    if since is None:
+        queryset = lost.filter(in_bbox)
+    else:
+        # Con margen: `updated_at` de LatestLocation es la hora de inicio de la transacción que lo escribió
+        since -= POLL_OVERLAP
+        changed = lost.filter(Q(updated_at__gt=since) | Q(gps_device__latest_location__updated_at__gt=since))
+        queryset = changed.filter(in_bbox)
+        left = changed.exclude(pk__in=queryset.values('pk'))
+        removed = list(Pet.objects.filter(Q(pk__in=left.values('pk')) | Q(is_lost=False, lost_changed_at__gt=since))
+                       .order_by('pk').values_list('uuid', flat=True)[:limit + 1])
+    pets = list(queryset.select_related('owner', 'veterinarian', 'gps_device__latest_location')
+                .order_by('pk')[:limit + 1])
+    truncated = len(pets) > limit or len(removed) > limit
+    return pets[:limit], removed[:limit], truncated
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from beDoggo.models import LatestLocation, Location
+
+
+class Command(BaseCommand):
+    help = "Recalcula la última posición de cada dispositivo (LatestLocation) a partir del histórico de Location."
+
+    def handle(self, *args, **options):
+        qn = connection.ops.quote_name
+        latest_table = qn(LatestLocation._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {latest_table} ("gps_device_id", "location", "timestamp", "updated_at") '
+                f'SELECT DISTINCT ON ("gps_device_id") "gps_device_id", "location"::geography, "timestamp", now() '
+                f'FROM {qn(Location._meta.db_table)} WHERE "gps_device_id" IS NOT NULL '
+                f'ORDER BY "gps_device_id", "timestamp" DESC '
+                f'ON CONFLICT ("gps_device_id") DO UPDATE SET "location" = EXCLUDED."location", '
+                f'"timestamp" = EXCLUDED."timestamp", "updated_at" = EXCLUDED."updated_at" '
+                f'WHERE {latest_table}."timestamp" <= EXCLUDED."timestamp"'
+            )
+            updated = cursor.rowcount
+        self.stdout.write(self.style.SUCCESS(f"Últimas posiciones actualizadas: {updated} dispositivos."))
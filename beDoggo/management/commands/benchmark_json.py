@@ -0,0 +1,93 @@
+import io
+import time
+import uuid
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.timezone import now
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from api.parsers import FastJSONParser
+from api.renderers import FastJSONRenderer, orjson
+
+
+def pet_payload(pets):
+    """Lista con la forma de la salida de ``PetSerializer`` (dueño, veterinario y GPS anidados)."""
+    created = now().isoformat().replace('+00:00', 'Z')
+    owner = {"uuid": str(uuid.uuid4()), "email": "owner@example.com", "username": "owner", "first_name": "Ana",
+             "last_name": "García", "birth_date": "1990-01-01", "sex": "Female", "phone": "600000000",
+             "email_verified": True, "address": "Calle Larios 1, Málaga", "prefix_phone": "+34",
+             "acquisition_channel": None, "points": 0, "onboarding_completed": True, "next_payment_date": None,
+             "accept_newsletter": False}
+    veterinarian = {"id": 1, "vet_license_number": "VET-1", "clinic_name": "Clínica", "clinic_address": "Málaga",
+                    "clinic_phone": "951000000", "available_hours": "9-14", "created_at": created,
+                    "updated_at": created, "user": 2}
+    return [{
+        "id": number, "owner": owner, "veterinarian": veterinarian,
+        "gps_device": {"id": number, "code": f"DEV{number:03d}", "is_active": True, "activated_at": created,
+                       "created_at": created, "updated_at": created},
+        "uuid": str(uuid.uuid4()), "name": f"Mascota {number}", "sex": "Male", "breed": "Mestizo",
+        "color": "Marrón", "birth_date": "2020-05-01", "weight": 12.5, "chip_number": f"CHIP{number}",
+        "chip_position": "Cuello", "observations": "Muy sociable con otros perros.", "sterilized": True,
+        "is_lost": False, "phone_emergency": "600000000", "passport": None, "image": None,
+        "created_at": created, "updated_at": created, "shared_with": [3, 4],
+    } for number in range(pets)]
+
+
+def location_payload(locations):
+    """Página del histórico (campos por defecto de ``LocationSerializer``)."""
+    started = now()
+    return {"next": None, "previous": None, "results": [{
+        "uuid": str(uuid.uuid4()),
+        "timestamp": (started - timedelta(seconds=10 * number)).isoformat().replace('+00:00', 'Z'),
+        "latitude": 36.7213028 + number * 1e-6, "longitude": -4.4216366 - number * 1e-6,
+    } for number in range(locations)]}
+
+
+def track_payload(points):
+    """Trayecto simplificado: ``datetime`` sin serializar, que el renderer tiene que convertir."""
+    started = now()
+    return [{"timestamp": started - timedelta(seconds=10 * number), "latitude": 36.7213028 + number * 1e-6,
+             "longitude": -4.4216366 - number * 1e-6} for number in range(points)]
+
+
+class Command(BaseCommand):
+    help = "Compara el renderer y el parser JSON de DRF con los de api.renderers/api.parsers."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pets', type=int, default=100, help='Mascotas de la respuesta (default: 100)')
+        parser.add_argument('--locations', type=int, default=10_000,
+                            help='Localizaciones de la respuesta (default: 10000)')
+        parser.add_argument('--repeat', type=int, default=20, help='Repeticiones; se usa la mejor (default: 20)')
+
+    def handle(self, *args, **options):
+        if min(options['pets'], options['locations'], options['repeat']) < 1:
+            raise CommandError("--pets, --locations y --repeat deben ser mayores que 0.")
+        if orjson is None:
+            self.stdout.write(self.style.WARNING("orjson no está instalado: se miden las dos rutas de DRF."))
+
+        repeat = options['repeat']
+        self.stdout.write(f"{'Carga':<40}{'KB':>8}{'DRF ms':>10}{'Rápido ms':>12}{'Mejora':>9}")
+        for label, payload in (('PetSerializer (render)', pet_payload(options['pets'])),
+                               ('Histórico de localizaciones (render)', location_payload(options['locations'])),
+                               ('Trayecto con datetime (render)', track_payload(options['locations']))):
+            body = JSONRenderer().render(payload)
+            self._report(label, len(body), lambda: JSONRenderer().render(payload),
+                         lambda: FastJSONRenderer().render(payload), repeat)
+            self._report(label.replace('render', 'parse'), len(body),
+                         lambda: JSONParser().parse(io.BytesIO(body)),
+                         lambda: FastJSONParser().parse(io.BytesIO(body)), repeat)
+
+    def _report(self, label, size, before, after, repeat):
+        before, after = self._best(before, repeat) * 1000, self._best(after, repeat) * 1000
+        self.stdout.write(f"{label:<40}{size / 1024:>8.0f}{before:>10.2f}{after:>12.2f}{before / after:>8.1f}x")
+
+    @staticmethod
+    def _best(function, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            function()
+            timings.append(time.perf_counter() - started)
+        return min(timings)
@@ -0,0 +1,90 @@
+import time
+
+from django.contrib.gis.geos import Point
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from beDoggo.lost_pets import lost_pets_nearby, lost_pets_nearby_legacy
+from beDoggo.models import GPSDevice, LatestLocation, Location, Pet, User
+
+# Centro de Málaga, igual que los datos de `load_data`
+ORIGIN = Point(-4.4406662, 36.7104034, srid=4326)
+
+
+class Command(BaseCommand):
+    help = ("Compara los planes (EXPLAIN ANALYZE) de la búsqueda de mascotas perdidas sobre el histórico de "
+            "Location y sobre LatestLocation con datos sintéticos. Todo se deshace al terminar.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+', default=[1_000_000, 10_000_000],
+                            help='Tamaños del histórico de localizaciones a medir (default: 1000000 10000000)')
+        parser.add_argument('--devices', type=int, default=10_000,
+                            help='Dispositivos sintéticos, cada uno con una mascota (default: 10000)')
+        parser.add_argument('--lost-ratio', type=float, default=0.1,
+                            help='Proporción de mascotas marcadas como perdidas (default: 0.1)')
+        parser.add_argument('--distance', type=float, default=2, help='Radio de búsqueda en km (default: 2)')
+
+    def handle(self, *args, **options):
+        if not 0 < options['devices'] < 100_000:
+            raise CommandError("--devices debe estar entre 1 y 99999.")
+
+        with transaction.atomic():
+            owner = User.objects.create(username='benchmark', email='benchmark@bedoggo.invalid')
+            self._create_devices(owner, options['devices'], options['lost_ratio'])
+
+            seeded = 0
+            for rows in sorted(options['rows']):
+                self.stdout.write(f"Generando localizaciones hasta {rows}...")
+                self._create_locations(seeded, rows, options['devices'])
+                seeded = rows
+                call_command('backfill_latest_locations', stdout=self.stdout)
+                with connection.cursor() as cursor:
+                    cursor.execute(f'ANALYZE {connection.ops.quote_name(Location._meta.db_table)}')
+                    cursor.execute(f'ANALYZE {connection.ops.quote_name(LatestLocation._meta.db_table)}')
+
+                self.stdout.write(self.style.MIGRATE_HEADING(f"\n=== {rows} localizaciones ==="))
+                for label, build in (('Histórico (distance_lte sobre Location)', lost_pets_nearby_legacy),
+                                     ('Última posición (ST_DWithin + KNN sobre LatestLocation)', lost_pets_nearby)):
+                    self._report(label, build(ORIGIN, options['distance']))
+
+            transaction.set_rollback(True)
+        self.stdout.write(self.style.SUCCESS("Benchmark terminado; los datos sintéticos se han descartado."))
+
+    def _create_devices(self, owner, devices, lost_ratio):
+        qn = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {qn(GPSDevice._meta.db_table)} ("code", "is_active", "ingest_key", "created_at", '
+                f'"updated_at") SELECT \'BENCH\' || lpad(g::text, 5, \'0\'), true, \'\', now(), now() '
+                f'FROM generate_series(1, %s) g', [devices])
+            cursor.execute(
+                f'CREATE TEMPORARY TABLE benchmark_devices ON COMMIT DROP AS '
+                f'SELECT row_number() OVER (ORDER BY "id") - 1 AS n, "id" FROM {qn(GPSDevice._meta.db_table)} '
+                f'WHERE "code" LIKE %s', ['BENCH%'])
+            cursor.execute(
+                f'INSERT INTO {qn(Pet._meta.db_table)} ("uuid", "name", "sterilized", "is_lost", "owner_id", '
+                f'"gps_device_id", "created_at", "updated_at") '
+                f'SELECT gen_random_uuid(), \'Bench \' || n, false, random() < %s, %s, "id", now(), now() '
+                f'FROM benchmark_devices', [lost_ratio, owner.pk])
+
+    def _create_locations(self, start, end, devices):
+        # Puntos repartidos por la provincia de Málaga durante los últimos 90 días
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {connection.ops.quote_name(Location._meta.db_table)} '
+                f'("uuid", "location", "timestamp", "gps_device_id", "created_at", "updated_at") '
+                f'SELECT gen_random_uuid(), '
+                f'ST_SetSRID(ST_MakePoint(-4.9 + random() * 0.7, 36.5 + random() * 0.4), 4326), '
+                f'now() - random() * interval \'90 days\', d."id", now(), now() '
+                f'FROM generate_series(%s, %s) g JOIN benchmark_devices d ON d.n = g %% %s',
+                [start + 1, end, devices])
+
+    def _report(self, label, queryset):
+        self.stdout.write(self.style.HTTP_INFO(f"\n-- {label}"))
+        self.stdout.write(queryset.explain(analyze=True, buffers=True))
+        started = time.perf_counter()
+        results = list(queryset)
+        elapsed = (time.perf_counter() - started) * 1000
+        pets = len({pet.pk for pet in results})
+        self.stdout.write(f"{len(results)} filas ({pets} mascotas distintas) en {elapsed:.1f} ms")
@@ -0,0 +1,86 @@
+import time
+from datetime import timedelta
+
+from django.contrib.gis.geos import Point
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils.timezone import now
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from api.fast_serializers import reader_for
+from api.serializers import LocationSerializer, PetSerializer, PetSerializerWithShared
+from beDoggo.models import GPSDevice, Location, Pet, User
+
+
+class Command(BaseCommand):
+    help = ("Mide el coste por fila de los serializadores de DRF frente al lector compilado de "
+            "api.fast_serializers en los listados de mascotas y de localizaciones. Los datos sintéticos se "
+            "deshacen al terminar.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pets', type=int, default=500, help='Mascotas sintéticas (default: 500)')
+        parser.add_argument('--locations', type=int, default=10_000,
+                            help='Localizaciones del trayecto medido (default: 10000)')
+        parser.add_argument('--repeat', type=int, default=5, help='Repeticiones; se usa la mejor (default: 5)')
+
+    def handle(self, *args, **options):
+        if options['pets'] < 1 or options['locations'] < 1 or options['repeat'] < 1:
+            raise CommandError("--pets, --locations y --repeat deben ser mayores que 0.")
+
+        with transaction.atomic():
+            owner, device = self._seed(options['pets'], options['locations'])
+            pets = Pet.objects.filter(owner=owner).order_by('id')
+            locations = Location.objects.filter(gps_device=device).order_by('-timestamp', '-id')
+
+            self.stdout.write(f"{'Caso':<40}{'DRF µs/fila':>14}{'Rápido µs/fila':>16}{'Mejora':>9}")
+            for label, serializer_class, queryset, params in (
+                    ('PetSerializer', PetSerializer, pets, {}),
+                    ('PetSerializerWithShared', PetSerializerWithShared, pets, {}),
+                    ('LocationSerializer', LocationSerializer, locations, {}),
+                    ('LocationSerializer ?expand=pet', LocationSerializer, locations, {'expand': 'pet'})):
+                self._report(label, serializer_class, queryset, params, options['repeat'])
+
+            transaction.set_rollback(True)
+        self.stdout.write(self.style.SUCCESS("Benchmark terminado; los datos sintéticos se han descartado."))
+
+    def _seed(self, pets, locations):
+        owner = User.objects.create(username='benchmark', email='benchmark@bedoggo.invalid')
+        friend = User.objects.create(username='benchmark-friend', email='benchmark-friend@bedoggo.invalid')
+        devices = GPSDevice.objects.bulk_create(
+            [GPSDevice(code=f'SER{number:05d}', is_active=True, ingest_key='x') for number in range(pets)])
+        created = Pet.objects.bulk_create(
+            [Pet(name=f'Bench {number}', owner=owner, gps_device=device, breed='Mestizo', weight=10.5)
+             for number, device in enumerate(devices)])
+        Pet.shared_with.through.objects.bulk_create(
+            [Pet.shared_with.through(pet_id=pet.pk, user_id=friend.pk) for pet in created])
+        started = now()
+        Location.objects.bulk_create(
+            [Location(gps_device=devices[0], location=Point(-4.42 + number * 1e-5, 36.72, srid=4326),
+                      timestamp=started - timedelta(seconds=10 * number)) for number in range(locations)],
+            batch_size=5000)
+        return owner, devices[0]
+
+    def _report(self, label, serializer_class, queryset, params, repeat):
+        request = Request(APIRequestFactory().get('/', params))
+        rows = queryset.count()
+
+        def drf():
+            # Lo que hacían las vistas: el serializador de DRF sobre el queryset sin ajustar
+            return serializer_class(queryset.all(), many=True, context={'request': request}).data
+
+        def fast():
+            reader = reader_for(serializer_class, request)
+            return reader.many(reader.read_queryset(queryset.all()))
+
+        before, after = self._best(drf, repeat) / rows * 1e6, self._best(fast, repeat) / rows * 1e6
+        self.stdout.write(f"{label:<40}{before:>14.1f}{after:>16.1f}{before / after:>8.1f}x")
+
+    @staticmethod
+    def _best(function, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            function()
+            timings.append(time.perf_counter() - started)
+        return min(timings)
@@ -0,0 +1,97 @@
+import time
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from api.serializers import RevocableTokenRefreshSerializer
+from beDoggo.models import RevokedToken, User
+from beDoggo.revoked_tokens import is_revoked, revoked_token_filter
+
+
+class Command(BaseCommand):
+    help = ("Mide el refresco de tokens con la lista negra llena de tokens rotados: comprobación por JTI solo "
+            "contra la base de datos frente al filtro de Bloom, refrescos por segundo y tasa de falsos "
+            "positivos del filtro. Los datos sintéticos se deshacen al terminar.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--revoked', type=int, nargs='+', default=[1_000_000, 5_000_000],
+                            help='Tamaños de la lista negra a medir (default: 1000000 5000000)')
+        parser.add_argument('--refreshes', type=int, default=2000,
+                            help='Refrescos medidos en cada tamaño (default: 2000)')
+
+    def handle(self, *args, **options):
+        if options['refreshes'] < 1 or min(options['revoked']) < 0:
+            raise CommandError("--refreshes debe ser mayor que 0 y --revoked no puede ser negativo.")
+
+        revoked_token_filter.reset()
+        try:
+            with transaction.atomic():
+                user = User.objects.create(username='benchmark', email='benchmark@bedoggo.invalid')
+                seeded = 0
+                for rows in sorted(options['revoked']):
+                    self.stdout.write(f"Generando tokens revocados hasta {rows}...")
+                    self._seed(seeded, rows)
+                    seeded = rows
+                    self.stdout.write(self.style.MIGRATE_HEADING(f"\n=== {rows} tokens revocados ==="))
+                    self._report(user, options['refreshes'])
+
+                transaction.set_rollback(True)
+        finally:
+            # El filtro ha visto JTIs que ya no existen
+            revoked_token_filter.reset()
+        self.stdout.write(self.style.SUCCESS("Benchmark terminado; los datos sintéticos se han descartado."))
+
+    def _seed(self, start, end):
+        # Tokens rotados en los últimos 30 días con refresh de 30 días: caducan en los próximos 30
+        table = connection.ops.quote_name(RevokedToken._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} ("jti", "expires_at", "revoked_at") '
+                f'SELECT md5(\'benchmark\' || g), now() + random() * interval \'30 days\', '
+                f'now() - random() * interval \'30 days\' FROM generate_series(%s, %s) g',
+                [start + 1, end])
+            cursor.execute(f'ANALYZE {table}')
+
+    def _report(self, user, refreshes):
+        revoked_token_filter.reset()
+        started = time.perf_counter()
+        revoked_token_filter.might_be_revoked('')
+        self.stdout.write(f"Carga del filtro: {time.perf_counter() - started:.2f} s")
+
+        jtis = [uuid.uuid4().hex for _ in range(refreshes)]
+        database = self._per_check(lambda jti: RevokedToken.objects.filter(jti=jti).exists(), jtis)
+        bloom = self._per_check(is_revoked, jtis)
+        self.stdout.write(f"{'Comprobación de JTI':<34}{'µs/token':>10}")
+        self.stdout.write(f"{'Solo base de datos':<34}{database:>10.1f}")
+        self.stdout.write(f"{'Filtro de Bloom':<34}{bloom:>10.1f}")
+
+        positives = sum(revoked_token_filter.might_be_revoked(jti) for jti in jtis)
+        self.stdout.write(f"Falsos positivos del filtro: {positives / refreshes:.3%} "
+                          f"(objetivo {revoked_token_filter.error_rate:.3%})")
+
+        tokens = [str(RefreshToken.for_user(user)) for _ in range(refreshes)]
+        started = time.perf_counter()
+        for token in tokens:
+            # Verificación, consulta del usuario, revocación del token usado y emisión del nuevo par
+            RevocableTokenRefreshSerializer(data={'refresh': token}).is_valid(raise_exception=True)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f"Refresco completo: {refreshes / elapsed:.0f} refrescos/s "
+                          f"({elapsed / refreshes * 1e6:.0f} µs/refresco)")
+
+        rejected = 0
+        for token in tokens[:100]:
+            try:
+                RevocableTokenRefreshSerializer(data={'refresh': token}).is_valid(raise_exception=True)
+            except TokenError:
+                rejected += 1
+        self.stdout.write(f"Reutilizaciones rechazadas: {rejected}/{min(refreshes, 100)}")
+
+    @staticmethod
+    def _per_check(function, jtis):
+        started = time.perf_counter()
+        for jti in jtis:
+            function(jti)
+        return (time.perf_counter() - started) / len(jtis) * 1e6
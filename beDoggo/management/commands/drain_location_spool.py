@@ -0,0 +1,45 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from beDoggo.ingest import location_spool, write_locations
+from beDoggo.models import GPSDevice
+from beDoggo.spool import read_segment
+
+
+class Command(BaseCommand):
+    help = "Reinyecta en la base de datos los fixes guardados en el spool de localizaciones."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--include-orphaned', action='store_true',
+                            help='Drena también los segmentos abiertos de procesos que ya no existen en este host')
+        parser.add_argument('--keep', action='store_true',
+                            help='No borra los segmentos tras reinyectarlos')
+
+    def handle(self, *args, **options):
+        segments = location_spool.segments(include_orphaned=options['include_orphaned'])
+        if not segments:
+            self.stdout.write("No hay segmentos pendientes en %s." % settings.LOCATION_SPOOL_DIR)
+            return
+
+        total = skipped = corrupt_total = 0
+        for path in segments:
+            locations, corrupt = read_segment(path)
+            existing = set(GPSDevice.objects.filter(id__in={location.gps_device_id for location in locations})
+                           .values_list('id', flat=True))
+            valid = [location for location in locations if location.gps_device_id in existing]
+
+            # Los fixes ya insertados (mismo uuid) se ignoran: el drenado se puede repetir sin duplicar
+            write_locations(valid, ignore_conflicts=True)
+            if not options['keep']:
+                os.remove(path)
+
+            total += len(valid)
+            skipped += len(locations) - len(valid)
+            corrupt_total += corrupt
+            self.stdout.write(f"{os.path.basename(path)}: {len(valid)} fixes reinyectados"
+                              f" ({len(locations) - len(valid)} de dispositivos eliminados, {corrupt} corruptos)")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Spool drenado: {len(segments)} segmentos, {total} fixes, {skipped} descartados, {corrupt_total} corruptos."))
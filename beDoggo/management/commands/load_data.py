@@ -2,11 +2,13 @@ import random
 import string
 import time
 
+from django.contrib.gis.geos import Point
 from django.core.management.base import BaseCommand
 from django.db import transaction
 from django.utils import timezone
 from faker import Faker
 
+from beDoggo.ingest import write_locations
 from beDoggo.models import User, GPSDevice, Pet, Location, SexUserChoices, SexPetChoices
 
 
@@ -99,13 +101,15 @@ class Command(BaseCommand):
                         pet.gps_device = gps_device
                         pet.save()
 
+                        locations = []
                         for _ in range(locations_per_device):
                             latitude, longitude = generate_malaga_coordinates()
-                            Location.objects.create(
+                            locations.append(Location(
                                 gps_device=gps_device,
-                                location=f"SRID=4326;POINT({longitude} {latitude})",
+                                location=Point(longitude, latitude, srid=4326),
                                 timestamp=timezone.now()
-                            )
+                            ))
+                        write_locations(locations)  # Mantiene también la última posición del dispositivo
 
                     # Compartir mascotas con otros usuarios aleatoriamente
                     if random.random() < 0.1 and len(created_users) > 1:
@@ -0,0 +1,104 @@
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils.timezone import now
+
+from beDoggo.models import Location
+
+PARENT_TABLE = Location._meta.db_table
+PARTITION_PREFIX = f'{PARENT_TABLE}_p'
+DEFAULT_PARTITION = f'{PARENT_TABLE}_default'
+
+
+def add_months(month, months):
+    """Suma meses a una fecha que representa el inicio de un mes."""
+    index = month.year * 12 + month.month - 1 + months
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+def partition_name(month):
+    return f'{PARTITION_PREFIX}{month:%Y%m}'
+
+
+class Command(BaseCommand):
+    help = ("Crea por adelantado las particiones mensuales de Location y desengancha (o borra) "
+            "las que superan la retención.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ahead', type=int, default=3,
+                            help='Meses futuros que deben tener partición creada (default: 3)')
+        parser.add_argument('--retention-months', type=int, default=settings.LOCATION_RETENTION_MONTHS,
+                            help='Meses de histórico a conservar; 0 conserva todo '
+                                 '(default: LOCATION_RETENTION_MONTHS)')
+        parser.add_argument('--drop', action='store_true',
+                            help='Borra las particiones caducadas en lugar de solo desengancharlas')
+        parser.add_argument('--dry-run', action='store_true', help='Muestra los cambios sin aplicarlos')
+
+    def handle(self, *args, **options):
+        current = now().astimezone(dt_timezone.utc).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        existing = self._partitions()
+
+        for offset in range(options['ahead'] + 1):
+            month = add_months(current, offset)
+            if month not in existing:
+                self._create_partition(month, options['dry_run'])
+
+        if options['retention_months'] > 0:
+            cutoff = add_months(current, -options['retention_months'])
+            for month, name in sorted(existing.items()):
+                if add_months(month, 1) <= cutoff:
+                    self._expire_partition(name, options['drop'], options['dry_run'])
+            if not options['dry_run']:
+                # Fixes antiguos que cayeron en la partición por defecto
+                with connection.cursor() as cursor:
+                    cursor.execute(f'DELETE FROM {connection.ops.quote_name(DEFAULT_PARTITION)} WHERE "timestamp" < %s',
+                                   [cutoff])
+                    if cursor.rowcount:
+                        self.stdout.write(f"Borrados {cursor.rowcount} fixes caducados de {DEFAULT_PARTITION}")
+
+        self.stdout.write(self.style.SUCCESS("Particiones de Location al día."))
+
+    def _partitions(self):
+        """Particiones mensuales enganchadas a la tabla padre: ``{inicio_de_mes: nombre}``."""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                "WHERE i.inhparent = %s::regclass",
+                [connection.ops.quote_name(PARENT_TABLE)],
+            )
+            names = [row[0] for row in cursor.fetchall()]
+        partitions = {}
+        for name in names:
+            if name.startswith(PARTITION_PREFIX):
+                month = datetime.strptime(name[len(PARTITION_PREFIX):], '%Y%m').replace(tzinfo=dt_timezone.utc)
+                partitions[month] = name
+        return partitions
+
+    def _create_partition(self, month, dry_run):
+        name = partition_name(month)
+        self.stdout.write(f"Creando {name} [{month:%Y-%m-%d}, {add_months(month, 1):%Y-%m-%d})")
+        if dry_run:
+            return
+        qn = connection.ops.quote_name
+        bounds = [month, add_months(month, 1)]
+        with transaction.atomic(), connection.cursor() as cursor:
+            # Si la partición por defecto tiene filas de ese rango hay que moverlas antes de crearla
+            cursor.execute(
+                f'CREATE TEMPORARY TABLE location_partition_move ON COMMIT DROP AS '
+                f'SELECT * FROM {qn(DEFAULT_PARTITION)} WHERE "timestamp" >= %s AND "timestamp" < %s', bounds)
+            cursor.execute(f'DELETE FROM {qn(DEFAULT_PARTITION)} WHERE "timestamp" >= %s AND "timestamp" < %s', bounds)
+            cursor.execute(f'CREATE TABLE {qn(name)} PARTITION OF {qn(PARENT_TABLE)} FOR VALUES FROM (%s) TO (%s)',
+                           bounds)
+            cursor.execute(f'INSERT INTO {qn(PARENT_TABLE)} SELECT * FROM location_partition_move')
+
+    def _expire_partition(self, name, drop, dry_run):
+        self.stdout.write(f"{'Borrando' if drop else 'Desenganchando'} {name}")
+        if dry_run:
+            return
+        qn = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            cursor.execute(f'ALTER TABLE {qn(PARENT_TABLE)} DETACH PARTITION {qn(name)}')
+            if drop:
+                cursor.execute(f'DROP TABLE {qn(name)}')
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils.timezone import now
+
+from beDoggo.models import RevokedToken
+
+
+class Command(BaseCommand):
+    help = ("Borra de la lista negra los refresh tokens ya caducados, que no se pueden volver a usar. "
+            "Borra por lotes para no bloquear la tabla durante las rotaciones.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10_000,
+                            help='Filas borradas por sentencia (default: 10000)')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size debe ser mayor que 0.")
+
+        table = connection.ops.quote_name(RevokedToken._meta.db_table)
+        cutoff = now()
+        deleted = 0
+        while True:
+            # Cada lote es su propia transacción (autocommit) y usa el índice de expires_at
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f'DELETE FROM {table} WHERE "jti" IN '
+                    f'(SELECT "jti" FROM {table} WHERE "expires_at" < %s LIMIT %s)',
+                    [cutoff, options['batch_size']]
+                )
+                rows = cursor.rowcount
+            deleted += rows
+            if rows < options['batch_size']:
+                break
+        self.stdout.write(self.style.SUCCESS(f"Tokens revocados caducados borrados: {deleted}."))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from beDoggo.models import Pet, PetAccess, Veterinarian
+
+
+class Command(BaseCommand):
+    help = ("Reconstruye PetAccess a partir de Pet.owner, Pet.shared_with y Pet.veterinarian (p. ej. tras cambios "
+            "masivos con QuerySet.update(), que no envían las señales que la mantienen).")
+
+    def handle(self, *args, **options):
+        qn = connection.ops.quote_name
+        access_table = qn(PetAccess._meta.db_table)
+        pet_table = qn(Pet._meta.db_table)
+        role = PetAccess.RoleChoices
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {access_table}')
+            cursor.execute(
+                f'INSERT INTO {access_table} ("user_id", "pet_id", "role") '
+                f'SELECT "owner_id", "id", %s FROM {pet_table} '
+                f'UNION SELECT "user_id", "pet_id", %s FROM {qn(Pet.shared_with.through._meta.db_table)} '
+                f'UNION SELECT vet."user_id", pet."id", %s FROM {pet_table} pet '
+                f'JOIN {qn(Veterinarian._meta.db_table)} vet ON vet."id" = pet."veterinarian_id"',
+                [role.OWNER.value, role.SHARED.value, role.VETERINARIAN.value]
+            )
+            rows = cursor.rowcount
+        self.stdout.write(self.style.SUCCESS(f"Accesos reconstruidos: {rows} filas."))
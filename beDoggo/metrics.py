@@ -0,0 +1,50 @@
+"""
+Métricas sencillas en proceso (contadores, tiempos y gauges).
+
+Cada worker mantiene sus propios valores; ``snapshot()`` los devuelve tal cual
+para exponerlos desde la API de administración.
+"""
+import threading
+from collections import defaultdict
+
+_lock = threading.Lock()
+_counters = defaultdict(int)
+_timings = {}
+_gauges = {}
+
+
+def incr(name, value=1):
+    with _lock:
+        _counters[name] += value
+
+
+def observe(name, seconds):
+    """Registra una duración: número de muestras, total y máximo."""
+    with _lock:
+        timing = _timings.setdefault(name, {'count': 0, 'total': 0.0, 'max': 0.0})
+        timing['count'] += 1
+        timing['total'] += seconds
+        timing['max'] = max(timing['max'], seconds)
+
+
+def snapshot_counters():
+    with _lock:
+        return dict(_counters)
+
+
+def register_gauge(name, func):
+    """Registra una función que devuelve el valor actual de un gauge (p. ej. la profundidad de una cola)."""
+    _gauges[name] = func
+
+
+def snapshot():
+    with _lock:
+        counters = dict(_counters)
+        timings = {name: dict(timing) for name, timing in _timings.items()}
+    for timing in timings.values():
+        timing['avg'] = timing['total'] / timing['count'] if timing['count'] else 0.0
+    return {
+        'counters': counters,
+        'timings': timings,
+        'gauges': {name: func() for name, func in _gauges.items()},
+    }
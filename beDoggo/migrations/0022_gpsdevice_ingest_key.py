@@ -0,0 +1,29 @@
+# Generated by Django 5.1.5 on 2026-10-18 10:30
+
+import secrets
+
+from django.db import migrations, models
+
+
+def generate_ingest_keys(apps, schema_editor):
+    GPSDevice = apps.get_model('beDoggo', 'GPSDevice')
+    devices = list(GPSDevice.objects.filter(ingest_key=''))
+    for device in devices:
+        device.ingest_key = secrets.token_urlsafe(32)
+    GPSDevice.objects.bulk_update(devices, ['ingest_key'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('beDoggo', '0021_alter_location_timestamp'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gpsdevice',
+            name='ingest_key',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.RunPython(generate_ingest_keys, migrations.RunPython.noop),
+    ]
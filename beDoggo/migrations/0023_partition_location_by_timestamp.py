@@ -0,0 +1,109 @@
+# Generated by Django 5.1.5 on 2026-10-18 11:30
+
+import uuid
+
+from django.db import migrations, models
+
+# Convierte beDoggo_location en una tabla particionada por rango mensual de `timestamp`.
+# PostgreSQL exige que las claves únicas incluyan la clave de partición, así que la PK pasa a ser
+# (id, timestamp) y el uuid es único junto con el timestamp. Las particiones futuras y la retención
+# se gestionan con `manage.py manage_location_partitions`.
+PARTITION_SQL = """
+ALTER TABLE "beDoggo_location" RENAME TO "beDoggo_location_unpartitioned";
+ALTER TABLE "beDoggo_location_unpartitioned" ALTER COLUMN "id" DROP IDENTITY IF EXISTS;
+
+CREATE SEQUENCE "beDoggo_location_id_seq";
+CREATE TABLE "beDoggo_location" (
+    "id" bigint NOT NULL DEFAULT nextval('"beDoggo_location_id_seq"'),
+    "uuid" uuid NOT NULL,
+    "location" geometry(POINT, 4326) NOT NULL,
+    "timestamp" timestamp with time zone NOT NULL,
+    "gps_device_id" bigint NULL
+        REFERENCES "beDoggo_gpsdevice" ("id") DEFERRABLE INITIALLY DEFERRED,
+    "created_at" timestamp with time zone NOT NULL,
+    "updated_at" timestamp with time zone NOT NULL,
+    PRIMARY KEY ("id", "timestamp"),
+    CONSTRAINT "location_uuid_timestamp_uniq" UNIQUE ("uuid", "timestamp")
+) PARTITION BY RANGE ("timestamp");
+ALTER SEQUENCE "beDoggo_location_id_seq" OWNED BY "beDoggo_location"."id";
+
+CREATE INDEX "beDoggo_location_uuid_idx" ON "beDoggo_location" ("uuid");
+CREATE INDEX "beDoggo_location_gps_device_id_idx" ON "beDoggo_location" ("gps_device_id");
+CREATE INDEX "beDoggo_location_location_gist" ON "beDoggo_location" USING GIST ("location");
+
+CREATE TABLE "beDoggo_location_default" PARTITION OF "beDoggo_location" DEFAULT;
+
+DO $$
+DECLARE
+    month_start timestamptz;
+    last_month timestamptz := date_trunc('month', now() AT TIME ZONE 'UTC') AT TIME ZONE 'UTC' + interval '3 months';
+BEGIN
+    SELECT date_trunc('month', COALESCE(MIN("timestamp"), now()) AT TIME ZONE 'UTC') AT TIME ZONE 'UTC'
+      INTO month_start FROM "beDoggo_location_unpartitioned";
+    WHILE month_start <= last_month LOOP
+        EXECUTE format('CREATE TABLE %I PARTITION OF "beDoggo_location" FOR VALUES FROM (%L) TO (%L)',
+                       'beDoggo_location_p' || to_char(month_start AT TIME ZONE 'UTC', 'YYYYMM'),
+                       month_start, month_start + interval '1 month');
+        month_start := month_start + interval '1 month';
+    END LOOP;
+END $$;
+
+INSERT INTO "beDoggo_location" ("id", "uuid", "location", "timestamp", "gps_device_id", "created_at", "updated_at")
+SELECT "id", "uuid", "location", "timestamp", "gps_device_id", "created_at", "updated_at"
+FROM "beDoggo_location_unpartitioned";
+SELECT setval('"beDoggo_location_id_seq"', COALESCE((SELECT MAX("id") FROM "beDoggo_location"), 0) + 1, false);
+
+DROP TABLE "beDoggo_location_unpartitioned";
+"""
+
+UNPARTITION_SQL = """
+ALTER TABLE "beDoggo_location" RENAME TO "beDoggo_location_partitioned";
+
+CREATE TABLE "beDoggo_location" (
+    "id" bigint NOT NULL PRIMARY KEY GENERATED BY DEFAULT AS IDENTITY,
+    "uuid" uuid NOT NULL UNIQUE,
+    "location" geometry(POINT, 4326) NOT NULL,
+    "timestamp" timestamp with time zone NOT NULL,
+    "gps_device_id" bigint NULL
+        REFERENCES "beDoggo_gpsdevice" ("id") DEFERRABLE INITIALLY DEFERRED,
+    "created_at" timestamp with time zone NOT NULL,
+    "updated_at" timestamp with time zone NOT NULL
+);
+CREATE INDEX "beDoggo_location_gps_device_id_idx" ON "beDoggo_location" ("gps_device_id");
+CREATE INDEX "beDoggo_location_location_gist" ON "beDoggo_location" USING GIST ("location");
+
+INSERT INTO "beDoggo_location" ("id", "uuid", "location", "timestamp", "gps_device_id", "created_at", "updated_at")
+SELECT "id", "uuid", "location", "timestamp", "gps_device_id", "created_at", "updated_at"
+FROM "beDoggo_location_partitioned";
+SELECT setval(pg_get_serial_sequence('"beDoggo_location"', 'id'),
+              COALESCE((SELECT MAX("id") FROM "beDoggo_location"), 0) + 1, false);
+
+DROP TABLE "beDoggo_location_partitioned" CASCADE;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('beDoggo', '0022_gpsdevice_ingest_key'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(PARTITION_SQL, UNPARTITION_SQL),
+            ],
+            state_operations=[
+                migrations.AlterField(
+                    model_name='location',
+                    name='uuid',
+                    field=models.UUIDField(db_index=True, default=uuid.uuid4, editable=False),
+                ),
+                migrations.AddConstraint(
+                    model_name='location',
+                    constraint=models.UniqueConstraint(fields=('uuid', 'timestamp'),
+                                                       name='location_uuid_timestamp_uniq'),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.5 on 2026-10-18 12:30
+
+import django.contrib.gis.db.models.fields
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('beDoggo', '0024_latestlocation'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='latestlocation',
+            name='location',
+            field=django.contrib.gis.db.models.fields.PointField(geography=True, srid=4326),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.5 on 2026-10-18 13:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('beDoggo', '0025_latestlocation_geography'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='location',
+            index=models.Index(fields=['gps_device', '-timestamp'], name='location_device_timestamp_idx'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.1.5 on 2026-10-18 17:00
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+
+
+def populate_pet_access(apps, schema_editor):
+    Pet = apps.get_model('beDoggo', 'Pet')
+    PetAccess = apps.get_model('beDoggo', 'PetAccess')
+    rows = [PetAccess(user_id=user_id, pet_id=pet_id, role='Owner')
+            for pet_id, user_id in Pet.objects.values_list('pk', 'owner_id').iterator()]
+    rows += [PetAccess(user_id=user_id, pet_id=pet_id, role='Shared')
+             for pet_id, user_id in Pet.shared_with.through.objects.values_list('pet_id', 'user_id').iterator()]
+    rows += [PetAccess(user_id=user_id, pet_id=pet_id, role='Veterinarian')
+             for pet_id, user_id in Pet.objects.filter(veterinarian__isnull=False)
+             .values_list('pk', 'veterinarian__user_id').iterator()]
+    PetAccess.objects.bulk_create(rows, batch_size=BATCH_SIZE, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('beDoggo', '0027_user_updated_at'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PetAccess',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('role', models.CharField(choices=[('Owner', 'Dueño'), ('Shared', 'Compartida'), ('Veterinarian', 'Veterinario')], max_length=20)),
+                ('pet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='access', to='beDoggo.pet')),
+                ('user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='pet_access', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'pet', 'role'), name='pet_access_user_pet_role_uniq')],
+            },
+        ),
+        migrations.RunPython(populate_pet_access, migrations.RunPython.noop),
+    ]
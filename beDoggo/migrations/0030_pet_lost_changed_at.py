@@ -0,0 +1,18 @@
+# Generated by Django 5.1.5 on 2026-10-18 21:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('beDoggo', '0029_revokedtoken'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pet',
+            name='lost_changed_at',
+            field=models.DateTimeField(blank=True, db_index=True, editable=False, null=True),
+        ),
+    ]
@@ -1,5 +1,6 @@
 import hashlib
 import random
+import secrets
 import string
 import uuid
 from datetime import timedelta
@@ -51,6 +52,7 @@ class User(AbstractUser):
     onboarding_completed = models.BooleanField(default=False)
     next_payment_date = models.DateTimeField(blank=True, null=True)
     accept_newsletter = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)  # Versión de las respuestas que anidan al usuario (ETag)
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username']
 
@@ -84,9 +86,15 @@ def generate_device_code():
     return ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
 
 
+def generate_ingest_key():
+    """Genera la clave secreta con la que el dispositivo se autentica al enviar posiciones."""
+    return secrets.token_urlsafe(32)
+
+
 class GPSDevice(models.Model):
     code = models.CharField(max_length=10, unique=True, db_index=True, blank=False, null=False)
     is_active = models.BooleanField(default=False)
+    ingest_key = models.CharField(max_length=64, blank=True, default='')  # Credencial de ingesta del dispositivo
     activated_at = models.DateTimeField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -97,6 +105,8 @@ class GPSDevice(models.Model):
             self.code = generate_device_code()
             while GPSDevice.objects.filter(code=self.code).exists():
                 self.code = generate_device_code()
+        if not self.ingest_key:
+            self.ingest_key = generate_ingest_key()
         super().save(*args, **kwargs)
 
     def __str__(self):
@@ -117,6 +127,8 @@ class Pet(models.Model):
     observations = models.TextField(blank=True, null=True)
     sterilized = models.BooleanField(default=False)
     is_lost = models.BooleanField(default=False)
+    # Último cambio de `is_lost` (lo mantiene `save()`): la consulta incremental del mapa retira las encontradas
+    lost_changed_at = models.DateTimeField(null=True, blank=True, editable=False, db_index=True)
     phone_emergency = models.CharField(max_length=20, blank=True, null=True)
     passport = models.CharField(max_length=50, unique=True, null=True, blank=True)
 
@@ -131,10 +143,43 @@ class Pet(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    def save(self, *args, **kwargs):
+        # `_was_lost` lo guarda la señal post_init; sin leer `is_lost` si está diferido
+        update_fields = kwargs.get('update_fields')
+        if ('is_lost' in self.__dict__ and self.is_lost != getattr(self, '_was_lost', None)
+                and (update_fields is None or 'is_lost' in update_fields)):
+            self.lost_changed_at = now()
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'lost_changed_at'}
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return f"{self.name} ({'Lost' if self.is_lost else 'Not Lost'})"
 
 
+# Quién puede ver cada mascota y con qué rol: tabla derivada de `Pet.owner`, `Pet.shared_with` y
+# `Pet.veterinarian` que mantienen las señales (ver beDoggo.access). Es lo único que consultan las
+# vistas para autorizar, así que comprobar el acceso es una búsqueda por índice sin joins ni DISTINCT.
+class PetAccess(models.Model):
+    class RoleChoices(models.TextChoices):
+        OWNER = 'Owner', _('Dueño')
+        SHARED = 'Shared', _('Compartida')
+        VETERINARIAN = 'Veterinarian', _('Veterinario')
+
+    # El índice de `user` es el de la restricción única, que empieza por él
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='pet_access', db_index=False)
+    pet = models.ForeignKey(Pet, on_delete=models.CASCADE, related_name='access')
+    role = models.CharField(max_length=20, choices=RoleChoices.choices)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'pet', 'role'], name='pet_access_user_pet_role_uniq'),
+        ]
+
+    def __str__(self):
+        return f"User {self.user_id} -> pet {self.pet_id} ({self.role})"
+
+
 # Modelo de historial médico
 class MedicalRecord(models.Model):
     uuid = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
@@ -158,20 +203,43 @@ class MedicalRecord(models.Model):
 
 
 # Modelo de localización
+# La tabla está particionada por meses según `timestamp` (ver manage_location_partitions), por eso
+# el uuid es único junto con el timestamp y no por sí solo.
 class Location(models.Model):
-    uuid = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
+    uuid = models.UUIDField(default=uuid.uuid4, editable=False, db_index=True)
     location = models.PointField()  # Coordenadas
-    timestamp = models.DateTimeField(auto_now_add=True)
+    timestamp = models.DateTimeField(default=now)  # Hora del fix según el dispositivo
 
     gps_device = models.ForeignKey(GPSDevice, on_delete=models.CASCADE, related_name='locations', blank=True, null=True)
 
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['uuid', 'timestamp'], name='location_uuid_timestamp_uniq'),
+        ]
+        indexes = [
+            # Histórico de un dispositivo del más reciente al más antiguo (paginación por cursor)
+            models.Index(fields=['gps_device', '-timestamp'], name='location_device_timestamp_idx'),
+        ]
+
     def __str__(self):
         return f"Location from device {self.gps_device.code if self.gps_device else 'Unknown'} at {self.timestamp}"
 
 
+# Última posición conocida de cada dispositivo, mantenida en cada ingesta (ver beDoggo.ingest)
+class LatestLocation(models.Model):
+    gps_device = models.OneToOneField(GPSDevice, on_delete=models.CASCADE, primary_key=True,
+                                      related_name='latest_location')
+    location = models.PointField(geography=True)  # Distancias en metros con ST_DWithin indexado
+    timestamp = models.DateTimeField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Latest location of device {self.gps_device_id} at {self.timestamp}"
+
+
 # Modelo de códigos de acceso
 class AccessCode(models.Model):
     uuid = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
@@ -209,3 +277,14 @@ class AccessCode(models.Model):
 
     def __str__(self):
         return f"Code for {self.pet.name} (Used: {self.is_used})"
+
+
+# Refresh tokens rotados o revocados, por JTI, hasta que caducan (ver beDoggo.revoked_tokens). Pasada
+# `expires_at` el propio JWT ya no es válido y la fila se puede borrar (prune_revoked_tokens).
+class RevokedToken(models.Model):
+    jti = models.CharField(max_length=255, primary_key=True)
+    expires_at = models.DateTimeField(db_index=True)
+    revoked_at = models.DateTimeField(default=now, db_index=True)  # Sondeo incremental del filtro en memoria
+
+    def __str__(self):
+        return f"Revoked token {self.jti} (expires {self.expires_at})"
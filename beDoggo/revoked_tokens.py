@@ -0,0 +1,160 @@
+"""
+Lista negra de refresh tokens por JTI.
+
+``revoke()`` guarda el JTI hasta que el token caduca con un único
+``INSERT ... ON CONFLICT DO NOTHING`` sobre la clave primaria: si la fila ya
+existía, el token se estaba reutilizando y la rotación se rechaza, también entre
+procesos. ``is_revoked()`` resuelve sin consultar la base de datos el caso común
+(token no revocado) con un filtro de Bloom en memoria que se sincroniza con la
+tabla como ``LostPetIndex``: sondeo incremental por ``revoked_at`` cada
+``poll_interval`` segundos y recarga completa, que descarta los caducados, cada
+``reload_interval``. Un "quizá" del filtro se confirma con una búsqueda por clave
+primaria. Lo que otro proceso revoque entre dos sondeos lo sigue detectando
+``revoke()`` al rotar. ``prune_revoked_tokens`` borra las filas caducadas.
+"""
+import hashlib
+import math
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.utils.timezone import now
+
+from . import metrics
+from .models import RevokedToken
+
+POLL_OVERLAP = timedelta(seconds=5)
+
+
+class BloomFilter:
+    """Conjunto aproximado sin falsos negativos y con ``error_rate`` de falsos positivos hasta ``capacity``."""
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = max(capacity, 1)
+        self.size = max(int(-self.capacity * math.log(error_rate) / math.log(2) ** 2), 8)  # Bits
+        self.hashes = max(round(self.size / self.capacity * math.log(2)), 1)
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item):
+        # Doble hashing (Kirsch-Mitzenmacher) a partir de un único digest
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return [(first + index * second) % self.size for index in range(self.hashes)]
+
+    def add(self, item):
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class RevokedTokenFilter:
+
+    def __init__(self, error_rate, min_capacity, poll_interval, reload_interval):
+        self.error_rate = error_rate
+        self.min_capacity = min_capacity
+        self.poll_interval = poll_interval
+        self.reload_interval = reload_interval
+        self._refresh_lock = threading.Lock()  # Una sola consulta de refresco a la vez
+        self._bloom = None
+        self._loaded_at = None
+        self._polled_at = 0
+        self._watermark = None
+        metrics.register_gauge('revoked_tokens.filter_entries', lambda: self._bloom.count if self._bloom else 0)
+
+    def might_be_revoked(self, jti):
+        """``False`` si el JTI seguro que no está revocado; ``True`` si puede estarlo."""
+        self._refresh()
+        return jti in self._bloom
+
+    def add(self, jti):
+        bloom = self._bloom
+        if bloom is not None:
+            bloom.add(jti)
+
+    def reset(self):
+        """Descarta el filtro; la próxima consulta lo recarga entero."""
+        with self._refresh_lock:
+            self._bloom = self._loaded_at = None
+
+    def _refresh(self):
+        started = time.monotonic()
+        if self._loaded_at is not None and started - self._polled_at < self.poll_interval:
+            return
+        # Si otro hilo ya está refrescando se sirve el filtro actual, salvo que no esté cargado
+        if not self._refresh_lock.acquire(blocking=self._loaded_at is None):
+            return
+        try:
+            if self._loaded_at is None:
+                self._reload(started)
+            elif started - self._loaded_at >= self.reload_interval or self._bloom.count > self._bloom.capacity:
+                # La recarga recorre toda la tabla: en otro hilo, que espera a que se libere el cerrojo
+                self._polled_at = started
+                threading.Thread(target=self._reload_in_background, name='revoked-tokens-reload',
+                                 daemon=True).start()
+                return
+            else:
+                self._update(started)
+            metrics.observe('revoked_tokens.refresh_seconds', time.monotonic() - started)
+        finally:
+            self._refresh_lock.release()
+
+    def _reload_in_background(self):
+        with self._refresh_lock:
+            try:
+                self._reload(time.monotonic())
+            finally:
+                connection.close()
+
+    def _reload(self, started):
+        watermark = now() - POLL_OVERLAP
+        active = RevokedToken.objects.filter(expires_at__gt=now())
+        bloom = BloomFilter(max(active.count() * 2, self.min_capacity), self.error_rate)
+        for jti in active.values_list('jti', flat=True).iterator(chunk_size=10_000):
+            bloom.add(jti)
+        self._bloom = bloom
+        self._loaded_at = self._polled_at = started
+        self._watermark = watermark
+        metrics.incr('revoked_tokens.filter_reloads')
+
+    def _update(self, started):
+        watermark = now() - POLL_OVERLAP
+        for jti in RevokedToken.objects.filter(revoked_at__gte=self._watermark).values_list('jti', flat=True):
+            self._bloom.add(jti)
+        self._polled_at = started
+        self._watermark = watermark
+
+
+revoked_token_filter = RevokedTokenFilter(
+    error_rate=settings.REVOKED_TOKENS_FILTER_ERROR_RATE,
+    min_capacity=settings.REVOKED_TOKENS_FILTER_MIN_CAPACITY,
+    poll_interval=settings.REVOKED_TOKENS_POLL_INTERVAL,
+    reload_interval=settings.REVOKED_TOKENS_RELOAD_INTERVAL,
+)
+
+
+def is_revoked(jti):
+    if not revoked_token_filter.might_be_revoked(jti):
+        metrics.incr('revoked_tokens.filter_negatives')
+        return False
+    metrics.incr('revoked_tokens.database_checks')
+    return RevokedToken.objects.filter(jti=jti).exists()
+
+
+def revoke(jti, expires_at):
+    """Revoca el JTI hasta ``expires_at``. Devuelve ``False`` si ya estaba revocado."""
+    table = connection.ops.quote_name(RevokedToken._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} ("jti", "expires_at", "revoked_at") VALUES (%s, %s, %s) '
+            f'ON CONFLICT ("jti") DO NOTHING',
+            [jti, expires_at, now()]
+        )
+        inserted = cursor.rowcount == 1
+    revoked_token_filter.add(jti)
+    return inserted
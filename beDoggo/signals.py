@@ -0,0 +1,118 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_init, post_save, post_delete, pre_delete
+from django.dispatch import receiver
+from django.utils.timezone import now
+
+from .access import grant_shared_access, revoke_shared_access, sync_pet_access, sync_veterinarian_access
+from .ingest import device_credentials
+from .lost_pets import invalidate_lost_pets_cache, lost_pet_index
+from .models import GPSDevice, LatestLocation, Pet, PetAccess, Veterinarian
+
+
+@receiver([post_save, post_delete], sender=GPSDevice)
+def invalidate_device_credentials(sender, **kwargs):
+    """Fuerza la recarga de las credenciales de ingesta tras cualquier cambio en un dispositivo."""
+    device_credentials.invalidate()
+
+
+@receiver(post_delete, sender=GPSDevice)
+def remove_device_from_lost_pet_index(sender, instance, **kwargs):
+    transaction.on_commit(lambda: lost_pet_index.device_removed(instance.pk))
+
+
+@receiver([post_save, post_delete], sender=Pet)
+def refresh_lost_pet_index(sender, instance, **kwargs):
+    """Relee la mascota en el índice de perdidas en cuanto se confirma el cambio."""
+    pet_id = instance.pk
+    transaction.on_commit(lambda: lost_pet_index.pet_changed(pet_id))
+
+
+@receiver(post_init, sender=Pet)
+def remember_lost_state(sender, instance, **kwargs):
+    # Sin leer `is_lost` si está diferido (`only()`): `None` es estado anterior desconocido
+    instance._was_lost = instance.__dict__.get('is_lost')
+
+
+@receiver([post_save, post_delete], sender=Pet)
+def invalidate_lost_pets_cache_for_pet(sender, instance, **kwargs):
+    """Invalida las búsquedas cacheadas de la zona de la mascota si está (o estaba) perdida."""
+    was_lost = instance._was_lost
+    instance._was_lost = instance.__dict__.get('is_lost', was_lost)
+    if not (instance.is_lost or was_lost is not False) or not instance.gps_device_id:
+        return
+    device_id = instance.gps_device_id
+
+    def invalidate():
+        position = LatestLocation.objects.filter(gps_device_id=device_id).values_list('location', flat=True).first()
+        if position is not None:
+            invalidate_lost_pets_cache([(position.y, position.x)])
+
+    transaction.on_commit(invalidate)
+
+
+@receiver(m2m_changed, sender=Pet.shared_with.through)
+def touch_pet_on_sharing_change(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Compartir o dejar de compartir no pasa por ``Pet.save()``: se actualiza ``updated_at``
+    para que cambien los ETag de las mascotas afectadas (su ``shared_with`` y quién las ve).
+    """
+    if action in ('post_add', 'post_remove'):
+        pets = Pet.objects.filter(pk__in=pk_set) if reverse else Pet.objects.filter(pk=instance.pk)
+    elif action == 'pre_clear':
+        pets = instance.shared_pets.all() if reverse else Pet.objects.filter(pk=instance.pk)
+    else:
+        return
+    pets.update(updated_at=now())
+
+
+@receiver(post_init, sender=Pet)
+def remember_access_fields(sender, instance, **kwargs):
+    # Sin leer campos diferidos (`only()`), que costarían una consulta por instancia
+    instance._access_fields = (instance.__dict__.get('owner_id'), instance.__dict__.get('veterinarian_id'))
+
+
+@receiver(post_save, sender=Pet)
+def sync_access_on_pet_save(sender, instance, created, update_fields=None, **kwargs):
+    """Mantiene las filas de dueño y veterinario de ``PetAccess`` al crear o reasignar la mascota."""
+    def changed(name, previous):
+        if created:
+            return True
+        if update_fields is not None and not {name, f'{name}_id'} & set(update_fields):
+            return False
+        return getattr(instance, f'{name}_id') != previous
+
+    owner_id, veterinarian_id = instance._access_fields
+    sync_pet_access(instance, owner_changed=changed('owner', owner_id),
+                    veterinarian_changed=changed('veterinarian', veterinarian_id))
+    instance._access_fields = (instance.owner_id, instance.veterinarian_id)
+
+
+@receiver(m2m_changed, sender=Pet.shared_with.through)
+def sync_shared_access(sender, instance, action, reverse, pk_set, **kwargs):
+    """Compartir (también con un ``AccessCode``) o dejar de compartir actualiza ``PetAccess``."""
+    pet_ids, user_ids = (pk_set, [instance.pk]) if reverse else ([instance.pk], pk_set)
+    if action == 'post_add':
+        grant_shared_access(pet_ids, user_ids)
+    elif action == 'post_remove':
+        revoke_shared_access(pet_ids, user_ids)
+    elif action == 'pre_clear':
+        revoke_shared_access(user_ids=[instance.pk]) if reverse else revoke_shared_access(pet_ids=[instance.pk])
+
+
+@receiver(post_init, sender=Veterinarian)
+def remember_veterinarian_user(sender, instance, **kwargs):
+    instance._access_user_id = instance.__dict__.get('user_id')
+
+
+@receiver(post_save, sender=Veterinarian)
+def sync_access_on_veterinarian_save(sender, instance, created, **kwargs):
+    if not created and instance.user_id != instance._access_user_id:
+        sync_veterinarian_access(instance)
+    instance._access_user_id = instance.user_id
+
+
+@receiver(pre_delete, sender=Veterinarian)
+def revoke_veterinarian_access(sender, instance, **kwargs):
+    # Sus mascotas quedan sin veterinario con un UPDATE (SET_NULL) que no pasa por `Pet.save()`
+    PetAccess.objects.filter(role=PetAccess.RoleChoices.VETERINARIAN, user_id=instance.user_id,
+                             pet__veterinarian=instance).delete()
@@ -0,0 +1,166 @@
+"""
+Spool en disco para los fixes que no se pueden escribir en la base de datos.
+
+Cuando PostGIS está caído o lento, la ingesta escribe los fixes aceptados en
+segmentos de solo-anexado (una línea ``<crc32>\\t<json>`` por fix) en lugar de
+fallar. El comando ``drain_location_spool`` los reinyecta después en bloque;
+como cada fix conserva su ``uuid``, repetir el drenado no duplica filas.
+
+Cada proceso escribe en su propio segmento ``*.open``. Al superar el tamaño o
+la antigüedad máxima, o cuando la base de datos vuelve a responder, el segmento
+se sella (``*.seg``) y queda listo para drenarse.
+"""
+import atexit
+import json
+import os
+import threading
+import time
+import zlib
+from uuid import UUID
+
+from django.contrib.gis.geos import Point
+from django.utils.dateparse import parse_datetime
+
+from . import metrics
+from .models import Location
+
+OPEN_SUFFIX = '.open'
+SEALED_SUFFIX = '.seg'
+
+
+def encode_record(location):
+    payload = json.dumps({
+        'uuid': str(location.uuid),
+        'device': location.gps_device_id,
+        'x': location.location.x,
+        'y': location.location.y,
+        'ts': location.timestamp.isoformat(),
+    }, separators=(',', ':'))
+    return f"{zlib.crc32(payload.encode()):08x}\t{payload}\n".encode()
+
+
+def decode_record(line):
+    """Devuelve la ``Location`` (sin guardar) de una línea del spool o None si está corrupta o incompleta."""
+    try:
+        checksum, payload = line.rstrip(b'\n').split(b'\t', 1)
+        if int(checksum, 16) != zlib.crc32(payload):
+            return None
+        data = json.loads(payload)
+        timestamp = parse_datetime(data['ts'])
+        if timestamp is None:
+            return None
+        return Location(
+            uuid=UUID(data['uuid']),
+            gps_device_id=data['device'],
+            location=Point(data['x'], data['y'], srid=4326),
+            timestamp=timestamp,
+        )
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def segment_pid(path):
+    """PID del proceso que escribió el segmento (codificado en el nombre)."""
+    try:
+        return int(os.path.basename(path).split('-')[1])
+    except (IndexError, ValueError):
+        return None
+
+
+class LocationSpool:
+
+    def __init__(self, directory, segment_max_bytes, segment_max_age, fsync_interval, fsync_batch):
+        self.directory = str(directory)
+        self.segment_max_bytes = segment_max_bytes
+        self.segment_max_age = segment_max_age
+        self.fsync_interval = fsync_interval
+        self.fsync_batch = fsync_batch
+        self._lock = threading.Lock()
+        self._file = None
+        self._path = None
+        self._opened_at = 0
+        self._sequence = 0
+        self._unsynced = 0
+        self._synced_at = 0
+        atexit.register(self.seal)
+
+    def append(self, locations):
+        """Anexa los fixes al segmento activo; el fsync se agrupa por número de registros o por tiempo."""
+        data = b''.join(encode_record(location) for location in locations)
+        with self._lock:
+            if self._file is not None and (self._file.tell() >= self.segment_max_bytes
+                                           or time.monotonic() - self._opened_at >= self.segment_max_age):
+                self._seal()
+            if self._file is None:
+                self._open()
+            self._file.write(data)
+            self._unsynced += len(locations)
+            if self._unsynced >= self.fsync_batch or time.monotonic() - self._synced_at >= self.fsync_interval:
+                self._sync()
+        metrics.incr('location_spool.appended', len(locations))
+
+    def seal(self):
+        """Cierra el segmento activo para que pueda drenarse."""
+        with self._lock:
+            self._seal()
+
+    def _open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._sequence += 1
+        name = f"{int(time.time() * 1000):013d}-{os.getpid()}-{self._sequence:06d}{OPEN_SUFFIX}"
+        self._path = os.path.join(self.directory, name)
+        self._file = open(self._path, 'ab')
+        self._opened_at = self._synced_at = time.monotonic()
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._synced_at = time.monotonic()
+        metrics.incr('location_spool.fsyncs')
+
+    def _seal(self):
+        if self._file is None:
+            return
+        self._sync()
+        self._file.close()
+        os.replace(self._path, self._path[:-len(OPEN_SUFFIX)] + SEALED_SUFFIX)
+        self._file = self._path = None
+
+    def segments(self, include_orphaned=False):
+        """Segmentos listos para drenar, del más antiguo al más reciente."""
+        if not os.path.isdir(self.directory):
+            return []
+        paths = []
+        for name in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, name)
+            if name.endswith(SEALED_SUFFIX):
+                paths.append(path)
+            elif include_orphaned and name.endswith(OPEN_SUFFIX) and not _process_alive(segment_pid(path)):
+                paths.append(path)
+        return paths
+
+
+def read_segment(path):
+    """Lee un segmento y devuelve ``(localizaciones, registros_corruptos)``."""
+    locations, corrupt = [], 0
+    with open(path, 'rb') as segment:
+        for line in segment:
+            location = decode_record(line)
+            if location is None:
+                corrupt += 1
+            else:
+                locations.append(location)
+    return locations, corrupt
+
+
+def _process_alive(pid):
+    if pid is None:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
@@ -1,6 +1,18 @@
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+from django.test import SimpleTestCase
 from rest_framework.test import APITestCase
 from rest_framework import status
 from django.contrib.auth import get_user_model
+from django.contrib.gis.geos import Point
+
+from beDoggo.buffer import LocationWriteBuffer, BufferFull
+from beDoggo.models import Location
+from beDoggo.revoked_tokens import BloomFilter
+from beDoggo.spool import LocationSpool, read_segment
+from beDoggo.tracks import _join_segments, _segment, encode_track
 
 
 class UserTests(APITestCase):
@@ -28,3 +40,78 @@ class UserTests(APITestCase):
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data['username'], 'testuser')
+
+
+class LocationWriteBufferTests(SimpleTestCase):
+
+    def test_flushes_in_groups_and_applies_backpressure(self):
+        written = []
+        buffer = LocationWriteBuffer(writer=written.append, max_size=5, flush_size=3, flush_interval=10)
+        buffer.put([1, 2])
+        with self.assertRaises(BufferFull):
+            buffer.put([3, 4, 5, 6])  # Se rechaza la petición completa
+        buffer.put([3])
+        time.sleep(0.2)
+        buffer.put([4])
+        buffer.drain()
+        self.assertEqual(written, [[1, 2, 3], [4]])
+
+    def test_requeues_batch_when_write_fails(self):
+        written = []
+        failures = [RuntimeError('database unavailable')]
+
+        def writer(batch):
+            if failures:
+                raise failures.pop()
+            written.extend(batch)
+
+        buffer = LocationWriteBuffer(writer=writer, max_size=10, flush_size=2, flush_interval=0.01)
+        buffer.put([1, 2])
+        buffer.drain()
+        self.assertEqual(written, [1, 2])
+
+
+class LocationSpoolTests(SimpleTestCase):
+
+    def test_roundtrip_skips_corrupt_records(self):
+        with tempfile.TemporaryDirectory() as directory:
+            spool = LocationSpool(directory, segment_max_bytes=1024 * 1024, segment_max_age=60,
+                                  fsync_interval=1, fsync_batch=100)
+            fixes = [Location(gps_device_id=1, location=Point(-4.42, 36.72, srid=4326)) for _ in range(3)]
+            spool.append(fixes)
+            self.assertEqual(spool.segments(), [])  # El segmento activo no se drena
+            spool.seal()
+
+            [segment] = spool.segments()
+            with open(segment, 'ab') as file:
+                file.write(b'00000000\t{"uuid": "truncado')
+
+            locations, corrupt = read_segment(segment)
+            self.assertEqual(corrupt, 1)
+            self.assertEqual([location.uuid for location in locations], [fix.uuid for fix in fixes])
+            self.assertEqual(locations[0].location.coords, (-4.42, 36.72))
+
+
+class PolylineTests(SimpleTestCase):
+
+    def test_day_segments_join_into_the_reference_polyline(self):
+        # Ejemplo de la documentación del algoritmo de Google
+        start = datetime(2025, 2, 1, 10, tzinfo=timezone.utc)
+        points = [(start, 38.5, -120.2), (start + timedelta(seconds=30), 40.7, -120.95),
+                  (start + timedelta(seconds=90), 43.252, -126.453)]
+        encoded = encode_track(points)
+        self.assertEqual(encoded['polyline'], '_p~iF~ps|U_ulLnnqC_mqNvxq`@')
+        self.assertEqual(encoded['timestamps'], [1738404000, 30, 60])
+        self.assertEqual(_join_segments([_segment(points[:1]), None, _segment(points[1:])]), encoded)
+
+
+class BloomFilterTests(SimpleTestCase):
+
+    def test_no_false_negatives_and_bounded_false_positives(self):
+        bloom = BloomFilter(capacity=10_000, error_rate=0.01)
+        revoked = [f'revoked-{number}' for number in range(10_000)]
+        for jti in revoked:
+            bloom.add(jti)
+        self.assertTrue(all(jti in bloom for jti in revoked))
+        false_positives = sum(f'active-{number}' in bloom for number in range(10_000))
+        self.assertLess(false_positives, 300)
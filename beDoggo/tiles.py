@@ -0,0 +1,139 @@
+"""
+Teselas vectoriales (Mapbox Vector Tile) de las mascotas perdidas.
+
+Cada tesela se genera en PostGIS con ``ST_AsMVT`` y se guarda en dos niveles:
+un LRU en memoria por proceso y un directorio en disco compartido por los
+workers del host. La versión de una tesela es la generación de las regiones
+que cubre (ver ``lost_pets.generation_token``), así que cuando una mascota
+perdida cambia o se mueve solo dejan de valer las teselas de su zona y las
+demás se sirven desde caché sin límite de tiempo. ``LOST_PETS_TILE_TIMEOUT``
+acota el desfase si la caché de Django no se comparte entre procesos.
+"""
+import glob
+import hashlib
+import math
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import connection
+
+from . import metrics
+from .lost_pets import generation_token
+from .models import LatestLocation, Pet, User
+
+LAYER_NAME = 'lost_pets'
+EXTENT = 4096
+
+
+def tile_bounds(z, x, y):
+    """Límites ``(sur, oeste, norte, este)`` en grados de la tesela XYZ."""
+    tiles = 2 ** z
+
+    def latitude(row):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / tiles))))
+
+    return latitude(y + 1), x / tiles * 360 - 180, latitude(y), (x + 1) / tiles * 360 - 180
+
+
+def tile_version(z, x, y):
+    token = generation_token(*tile_bounds(z, x, y))
+    return hashlib.sha1(token.encode()).hexdigest()[:16]
+
+
+def render_tile(z, x, y):
+    qn = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'WITH bounds AS (SELECT ST_TileEnvelope(%s, %s, %s) AS geom), features AS ('
+            f'SELECT ST_AsMVTGeom(ST_Transform(latest."location"::geometry, 3857), bounds.geom, %s) AS geom, '
+            f'pet."uuid"::text AS uuid, pet."name" AS name, pet."breed" AS breed, '
+            f'pet."birth_date"::text AS birth_date, '
+            f'concat_ws(\' \', owner."first_name", owner."last_name") AS owner_name, '
+            f'owner."phone" AS owner_phone, owner."email" AS owner_email '
+            f'FROM {qn(Pet._meta.db_table)} pet '
+            f'JOIN {qn(LatestLocation._meta.db_table)} latest ON latest."gps_device_id" = pet."gps_device_id" '
+            f'JOIN {qn(User._meta.db_table)} owner ON owner."id" = pet."owner_id" '
+            f'CROSS JOIN bounds '
+            f'WHERE pet."is_lost" AND latest."location" && ST_Transform(bounds.geom, 4326)::geography'
+            f') SELECT ST_AsMVT(features, %s, %s, \'geom\') FROM features',
+            [z, x, y, EXTENT, LAYER_NAME, EXTENT],
+        )
+        return bytes(cursor.fetchone()[0] or b'')
+
+
+class TileCache:
+
+    def __init__(self, directory, memory_entries, timeout):
+        self.directory = str(directory)
+        self.memory_entries = memory_entries
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # (z, x, y, versión) -> (creada, bytes)
+        metrics.register_gauge('lost_pets_tiles.memory_entries', lambda: len(self._memory))
+
+    def get(self, z, x, y, version):
+        """Devuelve la tesela en esa versión, generándola si no está en memoria ni en disco."""
+        key = (z, x, y, version)
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and time.time() - entry[0] < self.timeout:
+                self._memory.move_to_end(key)
+                metrics.incr('lost_pets_tiles.memory_hits')
+                return entry[1]
+
+        path = self._path(z, x, y, version)
+        try:
+            created_at = os.path.getmtime(path)
+            if time.time() - created_at < self.timeout:
+                with open(path, 'rb') as tile_file:
+                    data = tile_file.read()
+                metrics.incr('lost_pets_tiles.disk_hits')
+                self._remember(key, created_at, data)
+                return data
+        except OSError:
+            pass
+
+        metrics.incr('lost_pets_tiles.misses')
+        started = time.monotonic()
+        data = render_tile(z, x, y)
+        metrics.observe('lost_pets_tiles.render_seconds', time.monotonic() - started)
+        self._store(z, x, y, version, data)
+        self._remember(key, time.time(), data)
+        return data
+
+    def _path(self, z, x, y, version):
+        return os.path.join(self.directory, str(z), str(x), f'{y}-{version}.mvt')
+
+    def _remember(self, key, created_at, data):
+        with self._lock:
+            self._memory[key] = (created_at, data)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def _store(self, z, x, y, version, data):
+        path = self._path(z, x, y, version)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Las versiones anteriores de la tesela ya no se van a servir
+            for stale in glob.glob(os.path.join(os.path.dirname(path), f'{y}-*.mvt')):
+                if stale != path:
+                    os.remove(stale)
+            descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(descriptor, 'wb') as tile_file:
+                tile_file.write(data)
+            os.replace(temporary, path)
+        except OSError:
+            # La caché en disco es opcional: sin permisos o sin espacio se sigue sirviendo desde memoria
+            metrics.incr('lost_pets_tiles.disk_errors')
+
+
+tile_cache = TileCache(
+    directory=settings.LOST_PETS_TILE_DIR,
+    memory_entries=settings.LOST_PETS_TILE_MEMORY_ENTRIES,
+    timeout=settings.LOST_PETS_TILE_TIMEOUT,
+)
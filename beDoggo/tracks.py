@@ -0,0 +1,310 @@
+"""
+Lectura y exportación del trayecto (histórico de localizaciones) de un dispositivo.
+
+Los fixes se leen con un cursor de servidor (``iterator(chunk_size=...)``) y se
+escriben en bloques a medida que llegan, así que la memoria no depende de la
+longitud del trayecto. Cada formato es un generador de ``str``; ``gzip_stream``
+los comprime al vuelo.
+
+``simplified_track`` reduce el trayecto en la base de datos (muestreo por
+intervalos de tiempo y Douglas-Peucker) y cachea el resultado con la versión
+de su intervalo (``track_version``): el número de fixes y la última escritura,
+leídos de la base de datos, así que cualquier proceso ve los fixes que escriben
+los demás (workers, drenado del spool) aunque la caché no sea compartida.
+
+``encoded_track`` devuelve el trayecto como polilínea codificada de Google más
+las diferencias entre marcas de tiempo; cada día se codifica y cachea por
+separado, con su propia versión (leída igual que ``track_version``), así que un
+fix nuevo solo recodifica su día.
+"""
+import csv
+import io
+import json
+import zlib
+from datetime import datetime, timedelta, timezone as dt_timezone
+from xml.sax.saxutils import escape, quoteattr
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Count, F, FloatField, Func, Max
+from django.db.models.functions import TruncDate
+from django.utils.timezone import now
+
+from . import metrics
+from .models import Location
+
+# Filas por bloque de salida: agrupar evita un `yield` (y un write al socket) por fix
+ROWS_PER_CHUNK = 1000
+
+
+def track_locations(device_id, start=None, end=None):
+    """Fixes del dispositivo con ``start <= timestamp < end`` (sin límite en el extremo que sea ``None``)."""
+    queryset = Location.objects.filter(gps_device_id=device_id)
+    if start is not None:
+        queryset = queryset.filter(timestamp__gte=start)
+    if end is not None:
+        queryset = queryset.filter(timestamp__lt=end)
+    return queryset
+
+
+def track_points(device_id, start=None, end=None):
+    """``(timestamp, latitud, longitud)`` del dispositivo en orden cronológico, sin cargar el trayecto en memoria."""
+    return track_locations(device_id, start, end).order_by('timestamp', 'id').annotate(
+        latitude=Func(F('location'), function='ST_Y', output_field=FloatField()),
+        longitude=Func(F('location'), function='ST_X', output_field=FloatField()),
+    ).values_list('timestamp', 'latitude', 'longitude').iterator(chunk_size=settings.LOCATION_EXPORT_CHUNK_SIZE)
+
+
+def _chunked(points, format_point):
+    chunk = []
+    for point in points:
+        chunk.append(format_point(*point))
+        if len(chunk) >= ROWS_PER_CHUNK:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+
+def geojson_stream(points, name):
+    yield '{"type":"FeatureCollection","name":%s,"features":[' % json.dumps(name)
+    first = True
+    for chunk in _chunked(points, lambda timestamp, latitude, longitude: (
+            ',{"type":"Feature","geometry":{"type":"Point","coordinates":[%r,%r]},'
+            '"properties":{"timestamp":"%s"}}' % (longitude, latitude, timestamp.isoformat()))):
+        if first:
+            chunk, first = chunk[1:], False
+        yield chunk
+    yield ']}\n'
+
+
+def gpx_stream(points, name):
+    yield ('<?xml version="1.0" encoding="UTF-8"?>\n'
+           '<gpx version="1.1" creator="BeDoggo" xmlns="http://www.topografix.com/GPX/1/1">\n'
+           f'<trk><name>{escape(name)}</name><trkseg>\n')
+    yield from _chunked(points, lambda timestamp, latitude, longitude: (
+        f'<trkpt lat={quoteattr(repr(latitude))} lon={quoteattr(repr(longitude))}>'
+        f'<time>{timestamp.isoformat()}</time></trkpt>\n'))
+    yield '</trkseg></trk>\n</gpx>\n'
+
+
+def csv_stream(points, name):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def row(*values):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerow(values)
+        return buffer.getvalue()
+
+    yield row('timestamp', 'latitude', 'longitude')
+    yield from _chunked(points, lambda timestamp, latitude, longitude: row(timestamp.isoformat(), latitude, longitude))
+
+
+# formato -> (generador, content type, extensión)
+EXPORT_FORMATS = {
+    'geojson': (geojson_stream, 'application/geo+json', 'geojson'),
+    'gpx': (gpx_stream, 'application/gpx+xml', 'gpx'),
+    'csv': (csv_stream, 'text/csv; charset=utf-8', 'csv'),
+}
+
+
+def gzip_stream(chunks):
+    """Comprime en gzip cada bloque según se genera."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+# --- Trayectos simplificados ----------------------------------------------------------------------------------------
+
+def _day(timestamp):
+    return timestamp.astimezone(dt_timezone.utc).date()
+
+
+def track_version(device_id, start=None, end=None):
+    """
+    ``(versión, última_escritura)`` de los fixes del dispositivo entre ``start`` y ``end``.
+
+    La versión es el número de fixes y el ``updated_at`` más reciente: cambia con
+    cualquier fix nuevo del intervalo, también los atrasados, y con los borrados.
+    """
+    row = track_locations(device_id, start, end).aggregate(count=Count('id'), modified=Max('updated_at'))
+    modified = row['modified']
+    return f"{row['count']}:{modified and modified.timestamp()}", modified
+
+
+def simplified_track(device_id, start=None, end=None, tolerance=None, max_points=None):
+    """
+    Trayecto reducido ``[(timestamp, latitud, longitud), ...]`` en orden cronológico.
+
+    ``max_points`` divide el intervalo en ese número de tramos de igual duración y
+    conserva el primer fix de cada uno; ``tolerance`` (metros) aplica Douglas-Peucker
+    sobre el resultado. Ambos se calculan en PostGIS y el resultado se cachea.
+    """
+    version, _modified = track_version(device_id, start, end)
+    key = (f'track:{device_id}:{version}:{start and start.isoformat()}:'
+           f'{end and end.isoformat()}:{tolerance}:{max_points}')
+    points = cache.get(key)
+    if points is not None:
+        metrics.incr('track_cache.hits')
+        return points
+    metrics.incr('track_cache.misses')
+    points = _query_track(device_id, start, end, tolerance, max_points)
+    cache.set(key, points, settings.LOCATION_TRACK_CACHE_TIMEOUT)
+    return points
+
+
+def _query_track(device_id, start, end, tolerance, max_points):
+    qn = connection.ops.quote_name
+    conditions, params = ['"gps_device_id" = %s'], [device_id]
+    if start is not None:
+        conditions.append('"timestamp" >= %s')
+        params.append(start)
+    if end is not None:
+        conditions.append('"timestamp" < %s')
+        params.append(end)
+    sql = (f'SELECT "timestamp", "location" FROM {qn(Location._meta.db_table)} '
+           f'WHERE {" AND ".join(conditions)}')
+
+    if max_points:
+        # Primer fix de cada uno de los `max_points` tramos de tiempo entre el primero y el último
+        sql = (f'SELECT DISTINCT ON (bucket) "timestamp", "location" FROM ('
+               f'SELECT track.*, width_bucket(extract(epoch FROM track."timestamp"), '
+               f'extract(epoch FROM bounds.first), extract(epoch FROM bounds.last) + 0.001, %s) AS bucket '
+               f'FROM ({sql}) track, (SELECT min("timestamp") AS first, max("timestamp") AS last FROM ({sql}) t) bounds'
+               f') bucketed ORDER BY bucket, "timestamp"')
+        params = [max_points] + params + params
+
+    if tolerance:
+        # La hora viaja en la coordenada M para que sobreviva a la simplificación (ST_Simplify conserva M).
+        # En 3857 las distancias se estiran por 1/cos(latitud): se corrige la tolerancia con la latitud media.
+        sql = (f'WITH line AS (SELECT ST_Transform(ST_MakeLine(ST_SetSRID(ST_MakePointM(ST_X("location"), '
+               f'ST_Y("location"), extract(epoch FROM "timestamp")), 4326) ORDER BY "timestamp"), 3857) AS geom, '
+               f'avg(ST_Y("location")) AS latitude FROM ({sql}) track) '
+               f'SELECT to_timestamp(ST_M(dump.geom)), ST_Y(ST_Transform(dump.geom, 4326)), '
+               f'ST_X(ST_Transform(dump.geom, 4326)) '
+               f'FROM line, ST_DumpPoints(ST_Simplify(line.geom, %s / cos(radians(line.latitude)))) dump '
+               f'ORDER BY dump.path')
+        params = params + [tolerance]
+    else:
+        sql = f'SELECT "timestamp", ST_Y("location"), ST_X("location") FROM ({sql}) track ORDER BY "timestamp"'
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+# --- Polilínea codificada -------------------------------------------------------------------------------------------
+# https://developers.google.com/maps/documentation/utilities/polylinealgorithm
+
+POLYLINE_PRECISION = 5
+POLYLINE_FACTOR = 10 ** POLYLINE_PRECISION
+
+
+def _encode_value(value):
+    value = ~(value << 1) if value < 0 else value << 1
+    chunks = []
+    while value >= 0x20:
+        chunks.append(chr((0x20 | (value & 0x1f)) + 63))
+        value >>= 5
+    chunks.append(chr(value + 63))
+    return ''.join(chunks)
+
+
+def _segment(points):
+    """
+    Codifica puntos ``(timestamp, latitud, longitud)`` como un tramo concatenable:
+    ``(primero, último, polilínea_del_resto, deltas_del_resto)``, donde primero y
+    último son ``(lat_e5, lon_e5, epoch)`` y el resto va relativo al primero.
+    """
+    quantized = [(round(latitude * POLYLINE_FACTOR), round(longitude * POLYLINE_FACTOR), int(timestamp.timestamp()))
+                 for timestamp, latitude, longitude in points]
+    if not quantized:
+        return None
+    polyline, deltas = [], []
+    for previous, point in zip(quantized, quantized[1:]):
+        polyline.append(_encode_value(point[0] - previous[0]) + _encode_value(point[1] - previous[1]))
+        deltas.append(point[2] - previous[2])
+    return quantized[0], quantized[-1], ''.join(polyline), deltas
+
+
+def _join_segments(segments):
+    """Une los tramos: solo el primer punto de cada uno se recodifica respecto al final del anterior."""
+    polyline, timestamps, previous = [], [], None
+    for first, last, rest, deltas in filter(None, segments):
+        if previous is None:
+            polyline.append(_encode_value(first[0]) + _encode_value(first[1]))
+            timestamps.append(first[2])
+        else:
+            polyline.append(_encode_value(first[0] - previous[0]) + _encode_value(first[1] - previous[1]))
+            timestamps.append(first[2] - previous[2])
+        polyline.append(rest)
+        timestamps.extend(deltas)
+        previous = last
+    return {
+        "encoding": "polyline",
+        "precision": POLYLINE_PRECISION,
+        "polyline": ''.join(polyline),
+        # Epoch (s) del primer fix seguido de los segundos transcurridos desde el anterior
+        "timestamps": timestamps,
+    }
+
+
+def encode_track(points):
+    """Polilínea y marcas de tiempo delta de una lista de puntos ya cargada (p. ej. un trayecto simplificado)."""
+    return _join_segments([_segment(points)])
+
+
+def _day_versions(device_id, start):
+    """Versión (número de fixes y último ``updated_at``) de cada día con fixes desde ``start``."""
+    rows = track_locations(device_id, start).annotate(day=TruncDate('timestamp', tzinfo=dt_timezone.utc)) \
+        .values('day').annotate(count=Count('id'), modified=Max('updated_at')).values_list('day', 'count', 'modified')
+    return {day: f'{count}:{modified.timestamp()}' for day, count, modified in rows}
+
+
+def encoded_track(device_id, start=None):
+    """
+    Trayecto del dispositivo desde el día de ``start`` hasta hoy, codificado.
+
+    Sin ``start`` se devuelven los últimos ``LOCATION_TRACK_MAX_DAYS`` días.
+    """
+    today = _day(now())
+    first_day = _day(start) if start is not None else today - timedelta(days=settings.LOCATION_TRACK_MAX_DAYS - 1)
+    versions = _day_versions(device_id, datetime.combine(first_day, datetime.min.time(), tzinfo=dt_timezone.utc))
+    # Los días sin fixes no generan tramo
+    days = sorted(day for day in versions if first_day <= day <= today)
+    keys = {day: f'track:polyline:{device_id}:{day.isoformat()}:{versions[day]}' for day in days}
+    cached = cache.get_many(keys.values())
+
+    segments, missing = {}, []
+    for day in days:
+        if keys[day] in cached:
+            metrics.incr('track_cache.hits')
+            segments[day] = cached[keys[day]]
+        else:
+            metrics.incr('track_cache.misses')
+            missing.append(day)
+
+    # Los días sin caché consecutivos se leen con una sola consulta
+    runs = []
+    for day in missing:
+        if runs and runs[-1][-1] + timedelta(days=1) == day:
+            runs[-1].append(day)
+        else:
+            runs.append([day])
+    for run in runs:
+        by_day = {day: [] for day in run}
+        start_of_run = datetime.combine(run[0], datetime.min.time(), tzinfo=dt_timezone.utc)
+        for point in track_points(device_id, start_of_run, start_of_run + timedelta(days=len(run))):
+            by_day[_day(point[0])].append(point)
+        for day, points in by_day.items():
+            segments[day] = _segment(points)
+        cache.set_many({keys[day]: segments[day] for day in run}, settings.LOCATION_TRACK_CACHE_TIMEOUT)
+
+    return _join_segments(segments[day] for day in days)
@@ -1,3 +1,6 @@
+import hashlib
+
+from django.conf import settings
 from rest_framework import status, generics
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
@@ -7,13 +10,16 @@ from .serializers import UserSerializer, RegisterSerializer
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import login, authenticate
 from django.contrib.auth.forms import AuthenticationForm
+from .lost_pets import cached_lost_pets, cluster_lost_pets, find_lost_pets, global_generation_token, \
+    lost_pets_in_bbox, parse_cluster_params, parse_viewport_params, search_version
 from .forms import CustomUserCreationForm, PetForm, MedicalRecordForm, ProfileForm, VeterinarianRegistrationForm
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib.gis.geos import Point
-from django.contrib.gis.measure import D
-from django.contrib.gis.db.models.functions import Distance
 from django.http import JsonResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
 from django.db.models import Q
+from django.utils.timezone import now
 
 
 def is_veterinarian(user):
@@ -196,38 +202,74 @@ def lost_pets_map_view(request):
     return render(request, "pets/lost_pets_map.html")
 
 
-def lost_pets_data_view(request):
-    latitude = float(request.GET.get('latitude', 0))
-    longitude = float(request.GET.get('longitude', 0))
-    distance = float(request.GET.get('distance', 5))  # Distancia en km
-
-    # Coordenadas del usuario
-    user_location = Point(longitude, latitude, srid=4326)
-
-    # Filtrar mascotas perdidas dentro de la distancia especificada
-    lost_pets = Pet.objects.filter(
-        is_lost=True,
-        gps_device__isnull=False,  # Solo mascotas con GPS
-        gps_device__locations__location__distance_lte=(user_location, D(km=distance))
-    ).annotate(
-        distance=Distance('gps_device__locations__location', user_location)
-    ).select_related('owner', 'gps_device').prefetch_related('gps_device__locations').order_by('distance')
-
-    locations = [
+def _map_data(pets):
+    return [
         {
+            'uuid': pet.uuid,
+            'is_lost': pet.is_lost,
             'name': pet.name,
             'breed': pet.breed,
             'birth_date': pet.birth_date,
-            'latitude': pet.gps_device.locations.last().location.y,
-            'longitude': pet.gps_device.locations.last().location.x,
+            'latitude': pet.gps_device.latest_location.location.y,
+            'longitude': pet.gps_device.latest_location.location.x,
             'owner_name': f"{pet.owner.first_name} {pet.owner.last_name}",
             'owner_phone': pet.owner.phone if pet.owner.phone else "N/A",
             'owner_email': pet.owner.email if pet.owner.email else "N/A",
         }
-        for pet in lost_pets
+        for pet in pets
     ]
 
-    return JsonResponse({'locations': locations})
+
+def _lost_pets_map_data(user_location, distance):
+    return _map_data(find_lost_pets(user_location, distance))
+
+
+def _conditional_json(request, version, build):
+    """
+    ``JsonResponse`` con ETag derivado de ``version``. Si el cliente ya tiene esa versión
+    (``If-None-Match``) responde 304 sin llamar a ``build``; sin versión responde siempre.
+    """
+    if version is None:
+        return JsonResponse(build())
+    etag = quote_etag(hashlib.md5(f'{version}:{request.get_full_path()}'.encode()).hexdigest())
+    response = get_conditional_response(request, etag=etag) or JsonResponse(build())
+    response['ETag'] = etag
+    patch_cache_control(response, no_cache=True)  # El navegador revalida siempre con If-None-Match
+    return response
+
+
+def lost_pets_data_view(request):
+    if 'zoom' in request.GET:
+        try:
+            zoom, bbox = parse_cluster_params(request.GET['zoom'], request.GET.get('bbox'))
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        version = global_generation_token() if settings.LOST_PETS_CACHE_ENABLED else None
+        return _conditional_json(request, version, lambda: {'clusters': cluster_lost_pets(zoom, bbox)})
+
+    if 'bbox' in request.GET:
+        try:
+            bbox, since, limit = parse_viewport_params(request.GET['bbox'], request.GET.get('since'),
+                                                       request.GET.get('limit'))
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        # El cliente envía `fetched_at` como `since` en la siguiente petición para recibir solo los cambios
+        fetched_at = now()
+        pets, removed, truncated = lost_pets_in_bbox(bbox, since, limit)
+        return JsonResponse({'locations': _map_data(pets), 'removed': removed, 'truncated': truncated,
+                             'fetched_at': fetched_at})
+
+    latitude = float(request.GET.get('latitude', 0))
+    longitude = float(request.GET.get('longitude', 0))
+    distance = float(request.GET.get('distance', 5))  # Distancia en km
+
+    # Coordenadas del usuario
+    user_location = Point(longitude, latitude, srid=4326)
+
+    # Mascotas perdidas dentro de la distancia especificada (cacheadas por celda); la versión de la
+    # celda es también el ETag, así que el mapa que sondea recibe 304 mientras no cambie nada en la zona
+    return _conditional_json(request, search_version(user_location, distance), lambda: {
+        'locations': cached_lost_pets('map', user_location, distance, _lost_pets_map_data)})
 
 
 """
@@ -10,6 +10,10 @@ set -e
 echo "Aplicando migraciones..."
 python manage.py migrate --noinput
 
+# Crear las particiones de localizaciones de los próximos meses
+echo "Gestionando particiones de localizaciones..."
+python manage.py manage_location_partitions
+
 # Recopilar los archivos estáticos
 echo "Recopilando archivos estáticos..."
 python manage.py collectstatic --noinput